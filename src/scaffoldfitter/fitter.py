@@ -2,28 +2,143 @@
 Main class for fitting scaffolds.
 """
 
+from array import array
+import bisect
+import csv
 import json
+import math
+import os
+import time
 
-from cmlibs.maths.vectorops import add, mult, sub
+from cmlibs.maths.vectorops import add, matrix_det, matrix_inv, matrix_mult, mult, sub, transpose
 from cmlibs.utils.zinc.field import (
     assignFieldParameters, createFieldFiniteElementClone, getGroupList, findOrCreateFieldFiniteElement,
     find_or_create_field_stored_mesh_location, getUniqueFieldName, orphanFieldByName, create_jacobian_determinant_field)
 from cmlibs.utils.zinc.finiteelement import (
     evaluate_field_nodeset_range, findNodeWithName, get_scalar_field_minimum_in_mesh)
-from cmlibs.utils.zinc.group import match_fitting_group_names
+from cmlibs.utils.zinc.group import (
+    match_fitting_group_names, mesh_group_add_identifier_ranges, mesh_group_to_identifier_ranges,
+    nodeset_group_add_identifier_ranges, nodeset_group_to_identifier_ranges)
 from cmlibs.utils.zinc.general import ChangeManager
-from cmlibs.utils.zinc.mesh import element_or_ancestor_is_in_mesh
 from cmlibs.utils.zinc.region import copy_fitting_data
 from cmlibs.zinc.context import Context
-from cmlibs.zinc.element import Elementbasis, Elementfieldtemplate
+from cmlibs.zinc.element import Element, Elementbasis, Elementfieldtemplate
 from cmlibs.zinc.field import Field, FieldFindMeshLocation, FieldGroup
 from cmlibs.zinc.region import Region
 from cmlibs.zinc.result import RESULT_OK, RESULT_WARNING_PART_DONE
 
-from scaffoldfitter.fitterexceptions import FitterModelCoordinateField
+from scaffoldfitter.fitterdelta import encodeDeltaBase, encodeDeltaFrame
+from scaffoldfitter.fitterexceptions import FitterCancelled, FitterModelCoordinateField
+from scaffoldfitter.fitterstate import (
+    arrayToIdentifierRanges, decodeStateArchive, encodeStateArchive, identifierRangesToArray)
 from scaffoldfitter.fitterstep import FitterStep
 from scaffoldfitter.fitterstepconfig import FitterStepConfig
 from scaffoldfitter.fitterstepfit import FitterStepFit
+from scaffoldfitter.fitterwriter import FitterFileWriter, compressBuffer, decompressBuffer
+
+
+def _select_voxel_representatives(points, voxelSize):
+    """
+    Select the point nearest to the centre of each occupied cubic voxel using a hash grid.
+    :param points: List of (identifier, coordinates).
+    :param voxelSize: Absolute size of voxels > 0.0.
+    :return: List of selected identifiers in increasing order.
+    """
+    voxels = {}  # map(voxel indexes) to (distance squared from voxel centre, identifier)
+    for identifier, x in points:
+        scaledX = [c / voxelSize for c in x]
+        voxel = tuple(math.floor(c) for c in scaledX)
+        distanceSquared = sum((c - i - 0.5) * (c - i - 0.5) for c, i in zip(scaledX, voxel))
+        nearest = voxels.get(voxel)
+        if (nearest is None) or (distanceSquared < nearest[0]):
+            voxels[voxel] = (distanceSquared, identifier)
+    return sorted(nearest[1] for nearest in voxels.values())
+
+
+def _get_percentile(sortedValues, percentile):
+    """
+    Get percentile of values by linear interpolation between closest ranks.
+    :param sortedValues: Non-empty sequence of values in increasing order.
+    :param percentile: Percentile from 0.0 to 100.0.
+    :return: Value at percentile.
+    """
+    position = (len(sortedValues) - 1) * percentile / 100.0
+    lowerIndex = math.floor(position)
+    upperIndex = min(lowerIndex + 1, len(sortedValues) - 1)
+    xi = position - lowerIndex
+    return (1.0 - xi) * sortedValues[lowerIndex] + xi * sortedValues[upperIndex]
+
+
+# 3 point Gauss-Legendre quadrature on [0, 1] used for deformation penalty integrals
+_penaltyGaussPoints = [0.5 - math.sqrt(0.15), 0.5, 0.5 + math.sqrt(0.15)]
+
+
+def _gauss_to_grid_values(gaussValues, dimension):
+    """
+    Convert values at the 3 Gauss points in each xi direction to values at element grid points xi = 0, 0.5, 1,
+    so that multilinear interpolation within the 2 grid cells per direction gives the exact value at each
+    Gauss point.
+    :param gaussValues: List of 3**dimension values varying fastest in xi1.
+    :param dimension: Element dimension from 1 to 3.
+    :return: List of 3**dimension grid values varying fastest in xi1.
+    """
+    s = 2.0 * _penaltyGaussPoints[0]  # cell xi of first point; last point is at 1 - s in the second cell
+    values = list(gaussValues)
+    stride = 1
+    for d in range(dimension):
+        for start in range(len(values)):
+            if (start // stride) % 3 != 0:
+                continue
+            f0, f1, f2 = values[start], values[start + stride], values[start + 2 * stride]
+            values[start] = (f0 - s * f1) / (1.0 - s)
+            values[start + 2 * stride] = (f2 - s * f1) / (1.0 - s)
+        stride *= 3
+    return values
+
+
+def _get_error_statistics(errors, percentiles):
+    """
+    Get summary statistics of projection errors.
+    :param errors: Sequence of error values.
+    :param percentiles: List of percentiles from 0.0 to 100.0 to calculate.
+    :return: dict with "count", "rms", "max", "mean" and "percentiles" list; values are None if no errors.
+    """
+    count = len(errors)
+    if count == 0:
+        return {"count": 0, "rms": None, "max": None, "mean": None, "percentiles": [None] * len(percentiles)}
+    sortedErrors = sorted(errors)
+    return {
+        "count": count,
+        "rms": math.sqrt(sum(error * error for error in sortedErrors) / count),
+        "max": sortedErrors[-1],
+        "mean": math.fsum(sortedErrors) / count,
+        "percentiles": [_get_percentile(sortedErrors, percentile) for percentile in percentiles]
+    }
+
+
+def _get_relative_outlier_length(projectionLengths, outlierLength, outlierPercentile, outlierMADFactor):
+    """
+    Get the projection length above which data points are outliers, as the minimum from the active
+    relative outlier modes.
+    :param projectionLengths: Non-empty sequence of data projection lengths.
+    :param outlierLength: If negative, proportion of the maximum length to exclude.
+    :param outlierPercentile: If positive, percentile of lengths above which points are excluded.
+    :param outlierMADFactor: If positive, factor multiplying scaled median absolute deviation added
+    to the median length, above which points are excluded.
+    :return: Outlier length.
+    """
+    sortedLengths = sorted(projectionLengths)
+    relativeOutlierLength = sortedLengths[-1]
+    if outlierLength < 0.0:
+        relativeOutlierLength = (1.0 + outlierLength) * sortedLengths[-1]
+    if outlierPercentile > 0.0:
+        relativeOutlierLength = min(relativeOutlierLength, _get_percentile(sortedLengths, outlierPercentile))
+    if outlierMADFactor > 0.0:
+        median = _get_percentile(sortedLengths, 50.0)
+        mad = _get_percentile(sorted(abs(length - median) for length in sortedLengths), 50.0)
+        # 1.4826 scales MAD to standard deviation for normally distributed values
+        relativeOutlierLength = min(relativeOutlierLength, median + outlierMADFactor * 1.4826 * mad)
+    return relativeOutlierLength
 
 
 def _next_available_identifier(node_set, candidate):
@@ -108,16 +223,64 @@ class Fitter:
         self._curvatureActiveMeshGroup = None
         self._strainPenaltyField = None  # field storing strain penalty as per-element constant
         self._curvaturePenaltyField = None  # field storing curvature penalty as per-element constant
+        self._dataProjectionCount = 0  # incremented whenever data projections change
+        # incremented whenever model coordinates and model reference coordinates parameters change, to key caches
+        # of values calculated from them; see notifyModelParametersChanged()
+        self._modelParametersVersion = 0
+        self._modelReferenceParametersVersion = 0
+        # (key, map(element identifier) to list of active data identifiers, map(data identifier) to error)
+        # key is from _getDataErrorStateKey() when built
+        self._dataElementIndex = None
+        # field storing per-element constant count, RMS and maximum error of active data projected into element
+        self._elementDataErrorField = None
+        self._elementDataErrorFieldKey = None
+        # reference state element fields at deformation penalty Gauss points, and key when last calculated:
+        # (basis, fibre axes or None, integration weight, curvature basis) or None if not supported;
+        # see getReferenceDeformationFields()
+        self._referenceDeformationFields = None
+        self._referenceDeformationFieldsKey = None
+        self._jacobianField = None  # jacobian determinant of model coordinates w.r.t. reference coordinates
+        # (key, map(element identifier) to minimum jacobian in element of highest dimension mesh)
+        # key is from _getElementJacobianStateKey() when built
+        self._elementMinimumJacobians = None
+        # map(structural key) to objective field reused over fit iterations and steps; see getObjectiveField()
+        self._objectiveFields = {}
+        self._flattenWeightField = None  # constant field assigned with flatten group weight for each fit step
         self._dataCentre = [0.0, 0.0, 0.0]
         self._dataScale = 1.0
         self._diagnosticLevel = 0
-        self._groupProjectionData = {}  # map(group name) to (subgroup, projectionMeshGroup, findHighestDimension)
+        self._timeBudget = 0.0  # maximum wall time in seconds for run(), or 0.0 for unlimited
+        self._deadline = None  # time.perf_counter() value at which current run's time budget is exhausted
+        self._timeBudgetExhausted = False  # set if last run() stopped early because time budget was exhausted
+        self._progressCallback = None  # function(eventName, info dict) called to report progress
+        self._cancellationToken = None  # object with is_set() method e.g. threading.Event; cancels run if set
+        # set if data projections were not completed, or fit step was cancelled after changing model and data
+        # projections need recalculating to resume
+        self._dataProjectionsIncomplete = False
+        # map(group name) to (subgroup name, projectionMeshGroup, findHighestDimension)
+        self._groupProjectionData = {}
+        self._modelTopologyFingerprint = None  # identifies unchanged model file to reuse analyses after reload
+        # map(model topology fingerprint, group name, subgroup name, model fit group name) to
+        # (projection mesh dimension or 0 if none, element identifier ranges if intersection, findHighestDimension)
+        # Not cleared on reload.
+        self._groupProjectionAnalyses = {}
+        # map(group name, data coordinates field name, absolute voxel size) to set of decimated data identifiers
+        self._dataVoxelSelections = {}
+        # map(group name, data coordinates field name) to map(data identifier) to stratified rank from 0.0 to < 1.0
+        self._dataStratifiedRanks = {}
+        self._fileWriter = None  # created on demand for writing intermediate files in the background
+        self._intermediateOutputDelta = False  # if True write fit iterations to delta file, not separate models
+        self._deltaFileName = None  # name of delta file currently being written
+        self._deltaParameters = None  # model coordinates parameters last written to delta file
         # must always have an initial FitterStepConfig - which can never be removed
         self._fitterSteps = []
         fitterStep = FitterStepConfig()
         self.addFitterStep(fitterStep)
 
     def cleanup(self):
+        if self._fileWriter:
+            self._fileWriter.close()
+            self._fileWriter = None
         self._fitterSteps = []
         self._clearFields()
         self._rawDataRegion = None
@@ -153,6 +316,7 @@ class Fitter:
             self._dataCoordinatesFieldName = settings.get("dataCoordinatesField")
             self._markerGroupName = settings.get("markerGroup")
             self._diagnosticLevel = settings["diagnosticLevel"]
+            self._timeBudget = settings.get("timeBudget", 0.0)
         else:
             self._fitterSteps = oldFitterSteps
             raise AssertionError("Missing initial config step")
@@ -171,6 +335,7 @@ class Fitter:
             "dataCoordinatesField": self._dataCoordinatesFieldName,
             "markerGroup": self._markerGroupName,
             "diagnosticLevel": self._diagnosticLevel,
+            "timeBudget": self._timeBudget,
             "fitterSteps": [fitterStep.encodeSettingsJSONDict() for fitterStep in self._fitterSteps]
         }
         return json.dumps(dct, sort_keys=False, indent=4)
@@ -305,7 +470,19 @@ class Fitter:
         self._curvatureActiveMeshGroup = None
         self._strainPenaltyField = None
         self._curvaturePenaltyField = None
+        self._dataElementIndex = None
+        self._elementDataErrorField = None
+        self._elementDataErrorFieldKey = None
+        self._referenceDeformationFields = None
+        self._referenceDeformationFieldsKey = None
+        self._jacobianField = None
+        self._elementMinimumJacobians = None
+        self._objectiveFields = {}
+        self._flattenWeightField = None
         self._groupProjectionData = {}
+        self._modelTopologyFingerprint = None
+        self._dataVoxelSelections = {}
+        self._dataStratifiedRanks = {}
 
     def load(self):
         """
@@ -341,6 +518,243 @@ class Fitter:
             step.setHasRun(False)
         self._fitterSteps[0].run()  # initial config step will calculate data projections
 
+    def reloadData(self, zincDataFileName=None):
+        """
+        Replace data with contents of zinc data file, keeping the loaded model and its fields, and reset fit.
+        Cheaper than load() when fitting the same model to many data sets. Model coordinates are not reset:
+        restore their parameters and call updateModelReferenceCoordinates() first to fit from the initial model.
+        :param zincDataFileName: Name of zinc file supplying new data, or None to re-read current data file.
+        """
+        assert self._region, "Fitter.reloadData:  Must call load() first"
+        if zincDataFileName:
+            self._zincDataFileName = zincDataFileName
+        with ChangeManager(self._fieldmodule):
+            datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            datapoints.destroyAllNodes()
+            self._region.removeChild(self._rawDataRegion)
+            self._rawDataRegion = self._region.createChild("raw_data")
+            # clear marker data state so not applied to new data before marker group is rediscovered
+            self._markerGroup = None
+            self._markerDataGroup = None
+            self._markerDataCoordinatesField = None
+            self._markerDataNameField = None
+            self._markerDataLocationGroupField = None
+            self._markerDataLocationGroup = None
+            self._dataElementIndex = None
+            self._elementDataErrorField = None
+            self._elementDataErrorFieldKey = None
+            self._groupProjectionData = {}
+            self._dataVoxelSelections = {}
+            self._dataStratifiedRanks = {}
+            self._loadData()
+            self.defineDataProjectionFields()
+        self.initializeFit()
+
+    def clone(self):
+        """
+        Create an independent copy of this fitter in a new Zinc context, to continue fitting from the current
+        state with alternative settings. Model and data are read from the files supplied to the constructor,
+        then the fitter steps, model parameters, data projections, weights and penalties are copied from this
+        fitter in bulk. Progress callback and cancellation token are not copied.
+        :return: New Fitter.
+        """
+        assert self._zincModelFileName and self._zincDataFileName, \
+            "Fitter.clone:  Only supported for fitter constructed with model and data file names"
+        fitter = Fitter(self._zincModelFileName, self._zincDataFileName)
+        fitter._groupProjectionAnalyses.update(self._groupProjectionAnalyses)
+        fitter._loadState(*self._getState())
+        return fitter
+
+    def writeStateArchive(self, fileName=None, compression=None):
+        """
+        Write compact binary archive of fitter settings and current state, from which readStateArchive() can
+        resume fitting without re-running completed fitter steps. Model and data are not included.
+        :param fileName: Name of file to write to, or None to return contents in memory.
+        :param compression: Optional compression "gzip" or "zstd" applied to file or memory output.
+        :return: Bytes written if fileName is None, otherwise None.
+        """
+        buffer = compressBuffer(encodeStateArchive(*self._getState()), compression)
+        if fileName:
+            with open(fileName, "wb") as f:
+                f.write(buffer)
+            return None
+        return buffer
+
+    def readStateArchive(self, fileName=None, buffer=None):
+        """
+        Load model and data from the files supplied to the constructor, then restore fitter settings and state
+        from archive written by writeStateArchive() for the same model and data.
+        :param fileName: Name of state archive file to read, or None if supplying buffer.
+        :param buffer: Bytes of state archive, optionally compressed, or None if supplying fileName.
+        """
+        if fileName:
+            assert buffer is None
+            with open(fileName, "rb") as f:
+                buffer = f.read()
+        self._loadState(*decodeStateArchive(decompressBuffer(buffer)))
+
+    def _getState(self):
+        """
+        Get fitter settings and state for archiving or cloning.
+        :return: header dict, dict mapping name to array of values. See fitterstate.encodeStateArchive().
+        """
+        assert self._region, "Fitter:  Must call load() before getting state"
+        mesh = self.getHighestDimensionMesh()
+        meshDimension = mesh.getDimension()
+        coordinatesCount = self._modelCoordinatesField.getNumberOfComponents()
+        header = {
+            "settings": self.encodeSettingsJSON(),
+            "hasRun": [fitterStep.hasRun() for fitterStep in self._fitterSteps],
+            "meshDimension": meshDimension,
+            "coordinatesCount": coordinatesCount,
+            "dataProjectionGroupNames": self._dataProjectionGroupNames,
+            "dataProjectionsIncomplete": self._dataProjectionsIncomplete
+        }
+        arrays = {}
+        for name, field in (("modelCoordinates", self._modelCoordinatesField),
+                            ("modelReferenceCoordinates", self._modelReferenceCoordinatesField)):
+            fieldparameters = field.getFieldparameters()
+            result, parameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+            assert result == RESULT_OK, "Fitter:  Failed to get " + field.getName() + " parameters"
+            arrays[name] = array("d", parameters)
+        for name, nodesetGroup in (("activeData", self._activeDataNodesetGroup),
+                                   ("dataProjection1", self._dataProjectionNodesetGroups[0]),
+                                   ("dataProjection2", self._dataProjectionNodesetGroups[1])):
+            arrays[name] = identifierRangesToArray(nodeset_group_to_identifier_ranges(nodesetGroup))
+        for name, meshGroup in (("activeDataProjectionMesh1", self._activeDataProjectionMeshGroups[0]),
+                                ("activeDataProjectionMesh2", self._activeDataProjectionMeshGroups[1]),
+                                ("deformActiveMesh", self._deformActiveMeshGroup),
+                                ("strainActiveMesh", self._strainActiveMeshGroup),
+                                ("curvatureActiveMesh", self._curvatureActiveMeshGroup)):
+            arrays[name] = identifierRangesToArray(mesh_group_to_identifier_ranges(meshGroup))
+        locationIdentifiers, locationElements, locationXi = array("I"), array("I"), array("d")
+        weightIdentifiers, weights = array("I"), array("d")
+        orientationIdentifiers, orientations = array("I"), array("d")
+        with ChangeManager(self._fieldmodule):
+            fieldcache = self._fieldmodule.createFieldcache()
+            datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            nodeIter = datapoints.createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                fieldcache.setNode(node)
+                identifier = node.getIdentifier()
+                element, xi = self._dataHostLocationField.evaluateMeshLocation(fieldcache, meshDimension)
+                if element.isValid():
+                    locationIdentifiers.append(identifier)
+                    locationElements.append(element.getIdentifier())
+                    locationXi.extend(xi if (meshDimension > 1) else [xi])
+                result, weight = self._dataWeightField.evaluateReal(fieldcache, coordinatesCount)
+                if result == RESULT_OK:
+                    weightIdentifiers.append(identifier)
+                    weights.extend(weight if (coordinatesCount > 1) else [weight])
+                result, orientation = self._dataProjectionOrientationField.evaluateReal(
+                    fieldcache, coordinatesCount * coordinatesCount)
+                if result == RESULT_OK:
+                    orientationIdentifiers.append(identifier)
+                    orientations.extend(orientation if (coordinatesCount > 1) else [orientation])
+                node = nodeIter.next()
+            elementIdentifiers, strainPenalties, curvaturePenalties = array("I"), array("d"), array("d")
+            strainComponents = meshDimension * meshDimension
+            curvatureComponents = coordinatesCount * strainComponents
+            elementIter = mesh.createElementiterator()
+            element = elementIter.next()
+            while element.isValid():
+                fieldcache.setElement(element)
+                strainResult, strainPenalty = self._strainPenaltyField.evaluateReal(fieldcache, strainComponents)
+                curvatureResult, curvaturePenalty = \
+                    self._curvaturePenaltyField.evaluateReal(fieldcache, curvatureComponents)
+                if (strainResult == RESULT_OK) and (curvatureResult == RESULT_OK):
+                    elementIdentifiers.append(element.getIdentifier())
+                    strainPenalties.extend(strainPenalty if (strainComponents > 1) else [strainPenalty])
+                    curvaturePenalties.extend(curvaturePenalty if (curvatureComponents > 1) else [curvaturePenalty])
+                element = elementIter.next()
+            del fieldcache
+        arrays.update({
+            "dataLocationIdentifiers": locationIdentifiers,
+            "dataLocationElements": locationElements,
+            "dataLocationXi": locationXi,
+            "dataWeightIdentifiers": weightIdentifiers,
+            "dataWeights": weights,
+            "dataOrientationIdentifiers": orientationIdentifiers,
+            "dataOrientations": orientations,
+            "penaltyElementIdentifiers": elementIdentifiers,
+            "strainPenalties": strainPenalties,
+            "curvaturePenalties": curvaturePenalties
+        })
+        return header, arrays
+
+    def _loadState(self, header, arrays):
+        """
+        Decode settings, load model and data, then restore state from _getState() of a fitter for the same
+        model and data.
+        :param header: State header dict.
+        :param arrays: dict mapping name to array of state values.
+        """
+        # imported here as fitterjson depends on this module
+        from scaffoldfitter.fitterjson import decodeJSONFitterSteps
+        self.decodeSettingsJSON(header["settings"], decodeJSONFitterSteps)
+        self.load()
+        assert len(header["hasRun"]) == len(self._fitterSteps)
+        for fitterStep, hasRun in zip(self._fitterSteps, header["hasRun"]):
+            fitterStep.setHasRun(hasRun)
+        mesh = self.getHighestDimensionMesh()
+        meshDimension = mesh.getDimension()
+        coordinatesCount = self._modelCoordinatesField.getNumberOfComponents()
+        assert (header["meshDimension"] == meshDimension) and (header["coordinatesCount"] == coordinatesCount), \
+            "Fitter:  State does not match model"
+        for name, field in (("modelCoordinates", self._modelCoordinatesField),
+                            ("modelReferenceCoordinates", self._modelReferenceCoordinatesField)):
+            fieldparameters = field.getFieldparameters()
+            # note: must get number of parameters before they can be set
+            assert fieldparameters.getNumberOfParameters() == len(arrays[name]), \
+                "Fitter:  State " + name + " parameters do not match model"
+            result = fieldparameters.setParameters(list(arrays[name]))
+            assert result == RESULT_OK, "Fitter:  Failed to set " + field.getName() + " parameters"
+        self.notifyModelParametersChanged(referenceCoordinates=True)
+        datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+        with ChangeManager(self._fieldmodule):
+            for name, nodesetGroup in (("activeData", self._activeDataNodesetGroup),
+                                       ("dataProjection1", self._dataProjectionNodesetGroups[0]),
+                                       ("dataProjection2", self._dataProjectionNodesetGroups[1])):
+                nodesetGroup.removeAllNodes()
+                nodeset_group_add_identifier_ranges(nodesetGroup, arrayToIdentifierRanges(arrays[name]))
+            for name, meshGroup in (("activeDataProjectionMesh1", self._activeDataProjectionMeshGroups[0]),
+                                    ("activeDataProjectionMesh2", self._activeDataProjectionMeshGroups[1]),
+                                    ("deformActiveMesh", self._deformActiveMeshGroup),
+                                    ("strainActiveMesh", self._strainActiveMeshGroup),
+                                    ("curvatureActiveMesh", self._curvatureActiveMeshGroup)):
+                meshGroup.removeAllElements()
+                mesh_group_add_identifier_ranges(meshGroup, arrayToIdentifierRanges(arrays[name]))
+            fieldcache = self._fieldmodule.createFieldcache()
+            locationXi = arrays["dataLocationXi"]
+            for i, (identifier, elementIdentifier) in enumerate(
+                    zip(arrays["dataLocationIdentifiers"], arrays["dataLocationElements"])):
+                fieldcache.setNode(datapoints.findNodeByIdentifier(identifier))
+                xi = list(locationXi[i * meshDimension:(i + 1) * meshDimension])
+                self._dataHostLocationField.assignMeshLocation(
+                    fieldcache, mesh.findElementByIdentifier(elementIdentifier), xi if (meshDimension > 1) else xi[0])
+            for field, identifiers, values, componentsCount in (
+                    (self._dataWeightField, arrays["dataWeightIdentifiers"], arrays["dataWeights"], coordinatesCount),
+                    (self._dataProjectionOrientationField, arrays["dataOrientationIdentifiers"],
+                     arrays["dataOrientations"], coordinatesCount * coordinatesCount)):
+                for i, identifier in enumerate(identifiers):
+                    fieldcache.setNode(datapoints.findNodeByIdentifier(identifier))
+                    field.assignReal(fieldcache, list(values[i * componentsCount:(i + 1) * componentsCount]))
+            strainComponents = meshDimension * meshDimension
+            curvatureComponents = coordinatesCount * strainComponents
+            strainPenalties = arrays["strainPenalties"]
+            curvaturePenalties = arrays["curvaturePenalties"]
+            for i, elementIdentifier in enumerate(arrays["penaltyElementIdentifiers"]):
+                fieldcache.setElement(mesh.findElementByIdentifier(elementIdentifier))
+                self._strainPenaltyField.assignReal(
+                    fieldcache, list(strainPenalties[i * strainComponents:(i + 1) * strainComponents]))
+                self._curvaturePenaltyField.assignReal(
+                    fieldcache, list(curvaturePenalties[i * curvatureComponents:(i + 1) * curvatureComponents]))
+            del fieldcache
+        self._dataProjectionGroupNames = list(header["dataProjectionGroupNames"])
+        self._dataProjectionsIncomplete = header["dataProjectionsIncomplete"]
+        self._dataProjectionCount += 1
+
     def getDataCentre(self):
         """
         :return: Precalculated centre of data on [ x, y, z].
@@ -405,9 +819,228 @@ class Fitter:
     def getCurvaturePenaltyField(self):
         return self._curvaturePenaltyField
 
+    def getObjectiveField(self, key, createFunction):
+        """
+        Get objective field for structural key, creating and caching it if not already cached. Objective fields
+        are reused over fit iterations and steps as per-step weights and penalties are stored in fields, so the
+        field graph need not be rebuilt each time. Cache is cleared when fields objectives depend on are
+        redefined, and for keys starting with "deformation" when reference deformation fields are recalculated.
+        Assumes ChangeManager(fieldmodule) is in effect.
+        :param key: Tuple of structural inputs the objective field graph depends on, starting with its type name.
+        :param createFunction: Function taking no arguments and returning the new objective field, or None.
+        :return: Zinc Field, or None if not applied.
+        """
+        if key not in self._objectiveFields:
+            self._objectiveFields[key] = createFunction()
+        return self._objectiveFields[key]
+
+    def getFlattenWeightField(self):
+        """
+        Get constant field for flatten group weight, assigned by each fit step so cached flatten objective
+        can be reused.
+        :return: Zinc FieldConstant.
+        """
+        if not self._flattenWeightField:
+            self._flattenWeightField = self._fieldmodule.createFieldConstant([0.0])
+        return self._flattenWeightField
+
+    def getReferenceDeformationFields(self, numberOfGaussPoints=3, curvatureBasis=False):
+        """
+        Get element fields storing reference state quantities for deformation penalties, so they are not
+        re-evaluated at each Gauss point in each Newton assembly. Recalculated only when the reference
+        coordinates or fibre field change. Values are exact at the 3 Gauss points per element direction used
+        by penalty integrals, using grid-based interpolation, so are only available for line, square and cube
+        element shapes integrated with that number of points.
+        :param numberOfGaussPoints: Number of Gauss points per element direction in the penalty integral.
+        :param curvatureBasis: Set to True to also calculate curvature basis for analytic curvature penalty.
+        :return: None if element shapes or number of Gauss points are not supported, otherwise tuple of
+        basis, fibreAxes, weight, curvatureBasis. basis is a dimension x dimension matrix G such that
+        the deformation gradient in fibre axes (or global axes if no fibre field) is F = dx/dxi . G. fibreAxes is
+        the coordinates x dimension transposed reference fibre axes, or None if no fibre field. weight is the
+        reference volume, area or length element, for integrating penalties over xi. curvatureBasis is None if
+        not requested and not already calculated for the current reference state, otherwise a
+        (dimension * dimension) x (dimension * dimension + dimension) matrix K such that the transposed second
+        derivatives of x w.r.t. fibre axes are K . [d2x/dxi_i dxi_j; dx/dxi_i], with derivatives w.r.t. xi in
+        rows (i, j) then i; its last dimension columns include the derivative of the reference inverse jacobian.
+        Rows are in the order of the gradient of gradient curvature formulation: (k, l) without fibres, (l, k) with.
+        """
+        key = (self._modelReferenceParametersVersion,
+               self._modelReferenceCoordinatesField.getName(), self._fibreField.getName() if self._fibreField else None,
+               numberOfGaussPoints)
+        if (self._referenceDeformationFieldsKey == key) and not (
+                curvatureBasis and self._referenceDeformationFields and (self._referenceDeformationFields[3] is None)):
+            return self._referenceDeformationFields
+        # deformation objective fields using the previous reference fields are stale
+        self._objectiveFields = {key: field for key, field in self._objectiveFields.items() if key[0] != "deformation"}
+        self._referenceDeformationFields = None
+        self._referenceDeformationFieldsKey = None
+        mesh = self.getHighestDimensionMesh()
+        dimension = mesh.getDimension()
+        if numberOfGaussPoints != len(_penaltyGaussPoints):
+            self._referenceDeformationFieldsKey = key
+            return None
+        # grid values are written for line x line (x line) shapes, which Zinc integrates with Gauss-Legendre points
+        shapeType = [Element.SHAPE_TYPE_LINE, Element.SHAPE_TYPE_SQUARE, Element.SHAPE_TYPE_CUBE][dimension - 1]
+        elemIter = mesh.createElementiterator()
+        element = elemIter.next()
+        while element.isValid():
+            if element.getShapeType() != shapeType:
+                if self.getDiagnosticLevel() > 0:
+                    print("Reference deformation fields not supported for shape of element " +
+                          str(element.getIdentifier()) + "; using reference coordinates gradients")
+                self._referenceDeformationFieldsKey = key
+                return None
+            element = elemIter.next()
+        coordinatesCount = self._modelCoordinatesField.getNumberOfComponents()
+        assert (coordinatesCount == dimension) or self._fibreField, \
+            "Must supply a fibre field to use strain/curvature penalties with mesh dimension < coordinate components."
+        referenceCoordinates = self._modelReferenceCoordinatesField
+        fieldNames = ["reference_deformation_basis", "reference_fibre_axes", "reference_integration_weight",
+                      "reference_curvature_basis"]
+        curvatureColumnsCount = dimension * dimension + dimension
+        componentCounts = [dimension * dimension, coordinatesCount * dimension if self._fibreField else 0, 1,
+                           dimension * dimension * curvatureColumnsCount if curvatureBasis else 0]
+        with ChangeManager(self._fieldmodule):
+            # transposed reference coordinates derivatives w.r.t. xi, dimension x coordinatesCount
+            dXdxiT = self._fieldmodule.createFieldConcatenate(
+                [self._fieldmodule.createFieldDerivative(referenceCoordinates, d + 1) for d in range(dimension)])
+            # reference coordinates second derivatives w.r.t. xi_p, xi_j in order (p, j)
+            d2Xdxi2 = self._fieldmodule.createFieldConcatenate(
+                [self._fieldmodule.createFieldDerivative(
+                    self._fieldmodule.createFieldDerivative(referenceCoordinates, p + 1), j + 1)
+                 for p in range(dimension) for j in range(dimension)]) if curvatureBasis else None
+            fibreAxesT = None
+            if self._fibreField:
+                fibreAxes = self._fieldmodule.createFieldFibreAxes(self._fibreField, referenceCoordinates)
+                if dimension == 3:
+                    fibreAxesT = self._fieldmodule.createFieldTranspose(3, fibreAxes)
+                elif dimension == 2:
+                    fibreAxesT = self._fieldmodule.createFieldComponent(
+                        fibreAxes, [1, 4, 2, 5, 3, 6] if (coordinatesCount == 3) else [1, 4, 2, 5])
+                else:  # dimension == 1
+                    fibreAxesT = self._fieldmodule.createFieldComponent(
+                        fibreAxes, [1, 2, 3] if (coordinatesCount == 3) else [1, 2] if (coordinatesCount == 2) else [1])
+                del fibreAxes
+            fieldcache = self._fieldmodule.createFieldcache()
+            gaussPointCount = 3 ** dimension
+            gaussXi = [[_penaltyGaussPoints[(i // (3 ** d)) % 3] for d in range(dimension)]
+                       for i in range(gaussPointCount)]
+            elementsText = []
+            elemIter = mesh.createElementiterator()
+            element = elemIter.next()
+            while element.isValid():
+                # values at Gauss points for each component of each field
+                gaussValues = [[[] for c in range(componentCount)] for componentCount in componentCounts]
+                for xi in gaussXi:
+                    fieldcache.setMeshLocation(element, xi)
+                    result, dXdxiTValues = dXdxiT.evaluateReal(fieldcache, dimension * coordinatesCount)
+                    assert result == RESULT_OK, \
+                        "Scaffoldfitter: Failed to evaluate reference coordinates derivatives in element " + \
+                        str(element.getIdentifier())
+                    J = transpose([dXdxiTValues[d * coordinatesCount:(d + 1) * coordinatesCount]
+                                   for d in range(dimension)])
+                    JTJ = matrix_mult(transpose(J), J)
+                    detJTJ = matrix_det(JTJ) if (dimension > 1) else JTJ[0][0]
+                    weight = math.sqrt(detJTJ) if (detJTJ > 0.0) else 0.0
+                    if weight > 0.0:
+                        # least squares inverse dxi/dX; exact inverse if dimension == coordinatesCount
+                        invJTJ = matrix_inv(JTJ) if (dimension > 1) else [[1.0 / JTJ[0][0]]]
+                        dxidX = matrix_mult(invJTJ, transpose(J))
+                    else:
+                        invJTJ = [[0.0] * dimension for d in range(dimension)]
+                        dxidX = [[0.0] * coordinatesCount for d in range(dimension)]
+                    basis = dxidX
+                    fibreAxesTMatrix = [[1.0 if (c == d) else 0.0 for d in range(dimension)]
+                                        for c in range(coordinatesCount)]
+                    if fibreAxesT:
+                        result, fibreAxesTValues = fibreAxesT.evaluateReal(fieldcache, coordinatesCount * dimension)
+                        assert result == RESULT_OK, \
+                            "Scaffoldfitter: Failed to evaluate fibre axes in element " + str(element.getIdentifier())
+                        fibreAxesTMatrix = [fibreAxesTValues[c * dimension:(c + 1) * dimension]
+                                            for c in range(coordinatesCount)]
+                        basis = matrix_mult(dxidX, fibreAxesTMatrix)
+                        for c in range(coordinatesCount * dimension):
+                            gaussValues[1][c].append(fibreAxesTValues[c])
+                    for i in range(dimension):
+                        for j in range(dimension):
+                            gaussValues[0][i * dimension + j].append(basis[i][j])
+                    gaussValues[2][0].append(weight)
+                    if d2Xdxi2:
+                        # curvature basis: second derivative term then inverse jacobian derivative term, using
+                        # d(dxi/dX)/dxi_j = A^-1 . dJ_j^T - A^-1 . (dJ_j^T . J + J^T . dJ_j) . dxi/dX, A = J^T . J
+                        result, d2Xdxi2Values = d2Xdxi2.evaluateReal(
+                            fieldcache, dimension * dimension * coordinatesCount)
+                        assert result == RESULT_OK, \
+                            "Scaffoldfitter: Failed to evaluate reference coordinates second derivatives in " + \
+                            "element " + str(element.getIdentifier())
+                        dxidXdxi = []  # d(dxi/dX)/dxi_j . fibreAxesT for each j
+                        for j in range(dimension):
+                            dJ = [[d2Xdxi2Values[(p * dimension + j) * coordinatesCount + m] for p in range(dimension)]
+                                  for m in range(coordinatesCount)]
+                            dJT = transpose(dJ)
+                            dA = [[a + b for a, b in zip(rowA, rowB)] for rowA, rowB in
+                                  zip(matrix_mult(dJT, J), matrix_mult(transpose(J), dJ))]
+                            dP = [[a - b for a, b in zip(rowA, rowB)] for rowA, rowB in
+                                  zip(matrix_mult(invJTJ, dJT), matrix_mult(matrix_mult(invJTJ, dA), dxidX))]
+                            dxidXdxi.append(matrix_mult(dP, fibreAxesTMatrix))
+                        for k in range(dimension):
+                            for l in range(dimension):
+                                # row order matches gradient of gradient formulation, which swaps with fibres
+                                row = ((l * dimension + k) if fibreAxesT else (k * dimension + l)) * \
+                                    curvatureColumnsCount
+                                for i in range(dimension):
+                                    for j in range(dimension):
+                                        gaussValues[3][row + i * dimension + j].append(basis[i][k] * basis[j][l])
+                                    gaussValues[3][row + dimension * dimension + i].append(
+                                        sum(dxidXdxi[j][i][k] * basis[j][l] for j in range(dimension)))
+                values = []
+                for fieldGaussValues in gaussValues:
+                    for componentGaussValues in fieldGaussValues:
+                        values += _gauss_to_grid_values(componentGaussValues, dimension)
+                elementsText.append("Element: " + str(element.getIdentifier()) + "\n Values :\n " +
+                                    " ".join(repr(value) for value in values) + "\n")
+                element = elemIter.next()
+            del fieldcache
+            del fibreAxesT
+            del d2Xdxi2
+            del dXdxiT
+            # read grid-based element fields from EX buffer as they cannot be assigned directly
+            basisName = "*".join(["l.Lagrange"] * dimension)
+            gridText = ", ".join("#xi" + str(d + 1) + "=2" for d in range(dimension))
+            fieldsText = []
+            for fieldName, componentCount in zip(fieldNames, componentCounts):
+                if componentCount > 0:
+                    orphanFieldByName(self._fieldmodule, fieldName)
+                    fieldsText.append(
+                        str(len(fieldsText) + 1) + ") " + fieldName + ", field, rectangular cartesian, real, " +
+                        "#Components=" + str(componentCount) + "\n" +
+                        "".join(" " + str(c + 1) + ". " + basisName + ", no modify, grid based.\n " + gridText + "\n"
+                                for c in range(componentCount)))
+            exText = ("EX Version: 2\nRegion: /\n!#mesh " + mesh.getName() + ", dimension=" + str(dimension) +
+                      "\nShape. Dimension=" + str(dimension) + ", " + "*".join(["line"] * dimension) + "\n" +
+                      "#Scale factor sets=0\n#Nodes=0\n#Fields=" + str(len(fieldsText)) + "\n" +
+                      "".join(fieldsText) + "".join(elementsText))
+            sir = self._region.createStreaminformationRegion()
+            sir.createStreamresourceMemoryBuffer(exText.encode())
+            result = self._region.read(sir)
+            assert result == RESULT_OK, "Scaffoldfitter: Failed to define reference deformation fields"
+            fields = []
+            for fieldName, componentCount in zip(fieldNames, componentCounts):
+                field = None
+                if componentCount > 0:
+                    field = self._fieldmodule.findFieldByName(fieldName).castFiniteElement()
+                    field.setManaged(False)
+                    field.setTypeCoordinate(False)
+                fields.append(field)
+        self._referenceDeformationFields = tuple(fields)
+        self._referenceDeformationFieldsKey = key
+        return self._referenceDeformationFields
+
     def _loadModel(self):
         result = self._region.readFile(self._zincModelFileName)
         assert result == RESULT_OK, "Failed to load model file" + str(self._zincModelFileName)
+        stat = os.stat(self._zincModelFileName)
+        self._modelTopologyFingerprint = (os.path.abspath(self._zincModelFileName), stat.st_size, stat.st_mtime_ns)
         self._discoverModelCoordinatesField()
         self._discoverModelFitGroup()
         self._discoverFibreField()
@@ -424,6 +1057,7 @@ class Fitter:
         # in future may want to support mixed dimension top-level elements
         if not (self._modelCoordinatesField and self._dataCoordinatesField):
             return  # on first load, can't call until setModelCoordinatesField and setDataCoordinatesField
+        self._objectiveFields = {}
         with ChangeManager(self._fieldmodule):
             mesh = self.getHighestDimensionMesh()
             datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
@@ -487,23 +1121,154 @@ class Fitter:
         if not endStep:
             endStep = self._fitterSteps[-1]
         endIndex = self._fitterSteps.index(endStep)
-        # reload only if necessary
-        if (endStep.hasRun() and (endIndex < (len(self._fitterSteps) - 1)) and self._fitterSteps[endIndex + 1].hasRun()
-                or reorder):
-            # re-load to get back to current state
-            self.load()
-            for index in range(1, endIndex + 1):
-                self._fitterSteps[index].run(modelFileNameStem + str(index) if modelFileNameStem else None)
+        self._timeBudgetExhausted = False
+        self._deadline = (time.perf_counter() + self._timeBudget) if (self._timeBudget > 0.0) else None
+        try:
+            # reload only if necessary
+            if (endStep.hasRun() and (endIndex < (len(self._fitterSteps) - 1)) and
+                    self._fitterSteps[endIndex + 1].hasRun() or reorder):
+                # re-load to get back to current state
+                self.load()
+                self._runSteps(endIndex, modelFileNameStem, rerun=True)
+                return True
+            if self._dataProjectionsIncomplete:
+                # resume after cancellation with complete data projections for next step
+                for fitterStep in self._fitterSteps[1:endIndex + 1]:
+                    if not fitterStep.hasRun():
+                        self.calculateDataProjections(fitterStep)
+                        break
+            if endIndex == 0:
+                self._runStep(0, None)  # force re-run initial config
+            else:
+                # run from current point up to step
+                self._runSteps(endIndex, modelFileNameStem)
+        finally:
+            self._deadline = None
+        return False
+
+    def _runStep(self, index, modelFileNameStem):
+        """
+        Run fitter step, reporting progress. If cancelled, step is left not run with the model parameters
+        from its last completed iteration, and data projections are recalculated by the next run().
+        :param index: Index of fitter step to run.
+        :param modelFileNameStem: File name stem for writing intermediate model files for step, or None.
+        """
+        fitterStep = self._fitterSteps[index]
+        progressInfo = {"stepIndex": index, "stepCount": len(self._fitterSteps),
+                        "stepType": fitterStep.getJsonTypeId()}
+        self.notifyProgress("stepStart", progressInfo)
+        try:
+            fitterStep.run(modelFileNameStem)
+        except FitterCancelled:
+            self.flushFileWrites()
+            fitterStep.setHasRun(False)
+            self._dataProjectionsIncomplete = True
+            if self._diagnosticLevel > 0:
+                print("Fitter cancelled in step " + str(index))
+            raise
+        self.notifyProgress("stepEnd", progressInfo)
+
+    def _runSteps(self, endIndex, modelFileNameStem, rerun=False):
+        """
+        Run fitter steps after the initial config up to end index, stopping if time budget is exhausted.
+        :param endIndex: Index of last step to run.
+        :param modelFileNameStem: File name stem for writing intermediate model files.
+        :param rerun: If True run all steps, otherwise only those which have not run.
+        """
+        for index in range(1, endIndex + 1):
+            fitterStep = self._fitterSteps[index]
+            if rerun or not fitterStep.hasRun():
+                if self.isDeadlinePassed():
+                    self._timeBudgetExhausted = True
+                    if self._diagnosticLevel > 0:
+                        print("Time budget exhausted before step " + str(index) + " of " + str(endIndex))
+                    break
+                self._runStep(index, modelFileNameStem + str(index) if modelFileNameStem else None)
+                if isinstance(fitterStep, FitterStepFit) and fitterStep.isTimeBudgetExhausted():
+                    self._timeBudgetExhausted = True
+
+    def getProgressCallback(self):
+        return self._progressCallback
+
+    def setProgressCallback(self, progressCallback):
+        """
+        Set function called to report progress of run(), with arguments eventName, info dict:
+        "stepStart", "stepEnd": stepIndex, stepCount, stepType (JSON type id);
+        "iterationStart", "iterationEnd": iteration (from 1), iterationCount, objectives (dict of objective
+        term name -> value, or None if not evaluated);
+        "projections": activeDataCount (including markers), projectedDataCount (onto lines and surfaces).
+        Called on the thread running the fit.
+        :param progressCallback: Callable or None to not report progress.
+        """
+        self._progressCallback = progressCallback
+
+    def notifyProgress(self, eventName, info):
+        """
+        Report progress to progress callback, if any. See setProgressCallback().
+        :param eventName: Name of progress event.
+        :param info: dict of information about event.
+        """
+        if self._progressCallback:
+            self._progressCallback(eventName, info)
+
+    def getCancellationToken(self):
+        return self._cancellationToken
+
+    def setCancellationToken(self, cancellationToken):
+        """
+        Set token checked between steps, fit iterations and sub-iterations, and groups in data projections.
+        When set, FitterCancelled is raised, leaving the current step not run with the model parameters from its
+        last completed (sub-)iteration. Data projections are recalculated if needed on the next run(), which
+        resumes from that step. The token must be cleared before resuming.
+        :param cancellationToken: Object with is_set() method, e.g. threading.Event set from another thread,
+        or None for no cancellation.
+        """
+        self._cancellationToken = cancellationToken
+
+    def checkCancelled(self):
+        """
+        Raise FitterCancelled if cancellation token is set.
+        """
+        if self._cancellationToken and self._cancellationToken.is_set():
+            raise FitterCancelled("Fitter cancelled")
+
+    def getTimeBudget(self):
+        return self._timeBudget
+
+    def setTimeBudget(self, timeBudget):
+        """
+        Set maximum wall time for each call to run(). Steps are not started once it is exhausted, and fit
+        steps stop between iterations, keeping the parameters and data projections from the last completed
+        (sub-)iteration. See isTimeBudgetExhausted().
+        :param timeBudget: Time in seconds > 0.0, or 0.0 for unlimited (default).
+        :return: True if time budget changed, otherwise False.
+        """
+        assert timeBudget >= 0.0
+        if timeBudget != self._timeBudget:
+            self._timeBudget = timeBudget
             return True
-        if endIndex == 0:
-            endStep.run()  # force re-run initial config
-        else:
-            # run from current point up to step
-            for index in range(1, endIndex + 1):
-                if not self._fitterSteps[index].hasRun():
-                    self._fitterSteps[index].run(modelFileNameStem + str(index) if modelFileNameStem else None)
         return False
 
+    def getDeadline(self):
+        """
+        :return: time.perf_counter() value at which time budget of current run() is exhausted, or None if
+        not running or unlimited.
+        """
+        return self._deadline
+
+    def isDeadlinePassed(self):
+        """
+        :return: True if current run() time budget is exhausted, otherwise False.
+        """
+        return (self._deadline is not None) and (time.perf_counter() >= self._deadline)
+
+    def isTimeBudgetExhausted(self):
+        """
+        :return: True if the last run() stopped early because its time budget or a fit step's time budget
+        was exhausted. Get the achieved error with getDataRMSAndMaximumProjectionError().
+        """
+        return self._timeBudgetExhausted
+
     def getDataCoordinatesField(self):
         return self._dataCoordinatesField
 
@@ -515,6 +1280,7 @@ class Fitter:
         self._dataCoordinatesFieldName = dataCoordinatesField.getName()
         self._dataCoordinatesField = finiteElementField
         self._defineCommonDataFields()
+        self._defineDataProjectionStorage()
         self._calculateMarkerDataLocations()  # needed to assign to self._dataCoordinatesField
 
     def setDataCoordinatesFieldByName(self, dataCoordinatesFieldName):
@@ -834,6 +1600,294 @@ class Fitter:
 
         return None, None
 
+    def getDataErrorStatistics(self, percentiles=None, fileName=None):
+        """
+        Get projection error statistics for all data projection groups and the marker group, from errors
+        evaluated once for all active data and marker points. No group weights are applied.
+        :param percentiles: Optional list of percentiles from 0.0 to 100.0 to calculate, e.g. [50.0, 95.0].
+        :param fileName: Optional name of file to also write statistics to: CSV with a row per group if
+        name ends in ".csv", otherwise JSON.
+        :return: dict group name -> dict with "count", "rms", "max", "mean" and "percentiles", a list of values
+        in order of percentiles argument, for active data in group. Values other than count are None if group
+        has no active data.
+        """
+        if percentiles is None:
+            percentiles = []
+        for percentile in percentiles:
+            assert 0.0 <= percentile <= 100.0, "getDataErrorStatistics: Invalid percentile " + str(percentile)
+        dataErrors = self._getDataElementIndex()[1]
+        groupNames = list(self._dataProjectionGroupNames)
+        if self._markerGroup and (self._markerGroup.getName() not in groupNames):
+            groupNames.append(self._markerGroup.getName())
+        datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+        statistics = {}
+        for groupName in groupNames:
+            errors = array("d")
+            group = self._fieldmodule.findFieldByName(groupName).castGroup()
+            if group.isValid():
+                dataGroup = group.getNodesetGroup(datapoints)
+                if dataGroup.isValid():
+                    nodeIter = dataGroup.createNodeiterator()
+                    node = nodeIter.next()
+                    while node.isValid():
+                        error = dataErrors.get(node.getIdentifier())
+                        if error is not None:
+                            errors.append(error)
+                        node = nodeIter.next()
+            statistics[groupName] = _get_error_statistics(errors, percentiles)
+        if fileName:
+            if fileName.lower().endswith(".csv"):
+                with open(fileName, "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["group", "count", "rms", "max", "mean"] +
+                                    ["percentile " + str(percentile) for percentile in percentiles])
+                    for groupName, groupStatistics in statistics.items():
+                        writer.writerow([groupName] +
+                                        [groupStatistics[key] for key in ("count", "rms", "max", "mean")] +
+                                        groupStatistics["percentiles"])
+            else:
+                with open(fileName, "w") as f:
+                    json.dump({"percentiles": percentiles, "groups": statistics}, f, indent=4)
+        return statistics
+
+    def _getDataErrorStateKey(self):
+        """
+        :return: Key identifying current data projections and model geometry.
+        """
+        return self._dataProjectionCount, self._modelParametersVersion
+
+    def _getDataElementIndex(self):
+        """
+        Get index of active data and marker points by the highest dimension element they are located in,
+        and their projection errors. Rebuilt in a single pass over active data if data projections or
+        model geometry have changed since last built.
+        :return: map(element identifier) to list of data identifiers, map(data identifier) to error.
+        """
+        key = self._getDataErrorStateKey()
+        if self._dataElementIndex and (self._dataElementIndex[0] == key):
+            return self._dataElementIndex[1], self._dataElementIndex[2]
+        elementDataIdentifiers = {}
+        dataErrors = {}
+        meshDimension = self.getHighestDimensionMesh().getDimension()
+        with ChangeManager(self._fieldmodule):
+            fieldcache = self._fieldmodule.createFieldcache()
+            nodeIter = self._activeDataNodesetGroup.createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                fieldcache.setNode(node)
+                element, xi = self._dataHostLocationField.evaluateMeshLocation(fieldcache, meshDimension)
+                result, error = self._dataErrorField.evaluateReal(fieldcache, 1)
+                if element.isValid() and (result == RESULT_OK):
+                    dataIdentifier = node.getIdentifier()
+                    elementDataIdentifiers.setdefault(element.getIdentifier(), []).append(dataIdentifier)
+                    dataErrors[dataIdentifier] = error
+                node = nodeIter.next()
+            del fieldcache
+        self._dataElementIndex = (key, elementDataIdentifiers, dataErrors)
+        return elementDataIdentifiers, dataErrors
+
+    def getElementDataIdentifiers(self, elementIdentifier):
+        """
+        Get identifiers of active data and marker points located in element of highest dimension mesh.
+        :param elementIdentifier: Identifier of element in highest dimension mesh.
+        :return: List of data point identifiers, empty if none.
+        """
+        elementDataIdentifiers = self._getDataElementIndex()[0]
+        return list(elementDataIdentifiers.get(elementIdentifier, []))
+
+    def getElementDataErrors(self):
+        """
+        Get per-element statistics of active data and marker point projection errors, for elements of the
+        highest dimension mesh with data located in them. No group weights are applied.
+        :return: elementIdentifiers, counts, rmsErrors, maxErrors: lists in order of increasing element
+        identifier.
+        """
+        elementDataIdentifiers, dataErrors = self._getDataElementIndex()
+        elementIdentifiers = sorted(elementDataIdentifiers.keys())
+        counts = []
+        rmsErrors = []
+        maxErrors = []
+        for elementIdentifier in elementIdentifiers:
+            errors = [dataErrors[dataIdentifier] for dataIdentifier in elementDataIdentifiers[elementIdentifier]]
+            counts.append(len(errors))
+            rmsErrors.append(math.sqrt(sum(error * error for error in errors) / len(errors)))
+            maxErrors.append(max(errors))
+        return elementIdentifiers, counts, rmsErrors, maxErrors
+
+    def getElementDataErrorField(self):
+        """
+        Get field storing per-element constant count, RMS error and maximum error of active data and
+        marker points located in each element of the highest dimension mesh; all zero if no data.
+        Values are updated on each call if data projections or model geometry have changed.
+        :return: 3 component finite element field "element_data_error".
+        """
+        key = self._getDataErrorStateKey()
+        if self._elementDataErrorField and (self._elementDataErrorFieldKey == key):
+            return self._elementDataErrorField
+        elementIdentifiers, counts, rmsErrors, maxErrors = self.getElementDataErrors()
+        elementErrors = {elementIdentifier: [float(count), rmsError, maxError]
+                         for elementIdentifier, count, rmsError, maxError
+                         in zip(elementIdentifiers, counts, rmsErrors, maxErrors)}
+        mesh = self.getHighestDimensionMesh()
+        with ChangeManager(self._fieldmodule):
+            elementtemplate = None
+            if not self._elementDataErrorField:
+                self._elementDataErrorField = findOrCreateFieldFiniteElement(
+                    self._fieldmodule, "element_data_error", components_count=3)
+                elementtemplate = mesh.createElementtemplate()
+                constantBasis = self._fieldmodule.createElementbasis(
+                    mesh.getDimension(), Elementbasis.FUNCTION_TYPE_CONSTANT)
+                eft = mesh.createElementfieldtemplate(constantBasis)
+                eft.setParameterMappingMode(Elementfieldtemplate.PARAMETER_MAPPING_MODE_ELEMENT)
+                elementtemplate.defineField(self._elementDataErrorField, -1, eft)
+            fieldcache = self._fieldmodule.createFieldcache()
+            zeroValues = [0.0, 0.0, 0.0]
+            elemIter = mesh.createElementiterator()
+            element = elemIter.next()
+            while element.isValid():
+                if elementtemplate:
+                    element.merge(elementtemplate)
+                fieldcache.setElement(element)
+                self._elementDataErrorField.assignReal(
+                    fieldcache, elementErrors.get(element.getIdentifier(), zeroValues))
+                element = elemIter.next()
+            del fieldcache
+        self._elementDataErrorFieldKey = key
+        return self._elementDataErrorField
+
+    def _getElementNodeIdentifiers(self, mesh):
+        """
+        :param mesh: Zinc Mesh or MeshGroup.
+        :return: map(element identifier) to list of identifiers of nodes used by model coordinates field.
+        """
+        elementNodeIdentifiers = {}
+        elemIter = mesh.createElementiterator()
+        element = elemIter.next()
+        while element.isValid():
+            eft = element.getElementfieldtemplate(self._modelCoordinatesField, -1)
+            if eft.isValid():
+                nodeIdentifiers = []
+                for localNodeIndex in range(1, eft.getNumberOfLocalNodes() + 1):
+                    node = element.getNode(eft, localNodeIndex)
+                    if node.isValid():
+                        nodeIdentifiers.append(node.getIdentifier())
+                elementNodeIdentifiers[element.getIdentifier()] = nodeIdentifiers
+            element = elemIter.next()
+        return elementNodeIdentifiers
+
+    def createLocalFitGroups(self, errorThreshold, neighbourRings=1):
+        """
+        Create temporary groups for refitting only the model around elements with high data projection errors.
+        :param errorThreshold: Elements of the highest dimension mesh with RMS error of active data located in
+        them greater than this value are refitted.
+        :param neighbourRings: Number of rings of neighbouring elements sharing nodes to also refit.
+        :return: localFitGroup, localObjectiveGroup: Zinc FieldGroups with elements of highest dimension and their
+        faces, lines and nodes. localFitGroup contains the elements whose nodes are refitted; localObjectiveGroup
+        additionally contains all other elements using those nodes, which are the only elements whose geometry
+        changes. Both are empty if no elements exceed errorThreshold.
+        """
+        mesh = self.getHighestDimensionMesh()
+        fitMesh = self._modelFitGroup.getMeshGroup(mesh) if self._modelFitGroup else mesh
+        elementIdentifiers, counts, rmsErrors, maxErrors = self.getElementDataErrors()
+        fitElementIdentifiers = set(elementIdentifier for elementIdentifier, rmsError in
+                                    zip(elementIdentifiers, rmsErrors) if rmsError > errorThreshold)
+        objectiveElementIdentifiers = set()
+        if fitElementIdentifiers:
+            elementNodeIdentifiers = self._getElementNodeIdentifiers(mesh)
+            nodeElementIdentifiers = {}
+            for elementIdentifier, nodeIdentifiers in elementNodeIdentifiers.items():
+                for nodeIdentifier in nodeIdentifiers:
+                    nodeElementIdentifiers.setdefault(nodeIdentifier, set()).add(elementIdentifier)
+
+            def getNeighbourElementIdentifiers(elementIdentifiers):
+                neighbourElementIdentifiers = set()
+                for elementIdentifier in elementIdentifiers:
+                    for nodeIdentifier in elementNodeIdentifiers.get(elementIdentifier, []):
+                        neighbourElementIdentifiers.update(nodeElementIdentifiers[nodeIdentifier])
+                return neighbourElementIdentifiers - elementIdentifiers
+
+            for ring in range(neighbourRings):
+                ringElementIdentifiers = set(
+                    elementIdentifier for elementIdentifier in getNeighbourElementIdentifiers(fitElementIdentifiers)
+                    if fitMesh.containsElement(mesh.findElementByIdentifier(elementIdentifier)))
+                if not ringElementIdentifiers:
+                    break
+                fitElementIdentifiers.update(ringElementIdentifiers)
+            objectiveElementIdentifiers = fitElementIdentifiers | getNeighbourElementIdentifiers(fitElementIdentifiers)
+        localGroups = []
+        with ChangeManager(self._fieldmodule):
+            for localElementIdentifiers in (fitElementIdentifiers, objectiveElementIdentifiers):
+                localGroup = self._fieldmodule.createFieldGroup()
+                localGroup.setSubelementHandlingMode(FieldGroup.SUBELEMENT_HANDLING_MODE_FULL)
+                localMeshGroup = localGroup.createMeshGroup(mesh)
+                for elementIdentifier in sorted(localElementIdentifiers):
+                    localMeshGroup.addElement(mesh.findElementByIdentifier(elementIdentifier))
+                localGroups.append(localGroup)
+        if self.getDiagnosticLevel() > 0:
+            print("Local fit of " + str(len(fitElementIdentifiers)) + " elements with error > " +
+                  str(errorThreshold) + " or within " + str(neighbourRings) + " neighbour rings; objectives over " +
+                  str(len(objectiveElementIdentifiers)) + " elements")
+        return localGroups[0], localGroups[1]
+
+    def _getElementJacobianStateKey(self):
+        """
+        :return: Key identifying current model and reference coordinates parameters.
+        """
+        return self._modelParametersVersion, self._modelReferenceParametersVersion
+
+    def _getElementMinimumJacobians(self):
+        """
+        Get minimum jacobian determinant of model coordinates w.r.t. reference coordinates in each element of the
+        highest dimension mesh, evaluated in a single pass over the mesh and cached until model or reference
+        coordinates parameters change.
+        :return: map(element identifier) to minimum jacobian, for elements where it could be evaluated.
+        """
+        key = self._getElementJacobianStateKey()
+        if self._elementMinimumJacobians and (self._elementMinimumJacobians[0] == key):
+            return self._elementMinimumJacobians[1]
+        if not self._jacobianField:
+            with ChangeManager(self._fieldmodule):
+                self._jacobianField = create_jacobian_determinant_field(
+                    self._modelCoordinatesField, self._modelReferenceCoordinatesField)
+        elementMinimumJacobians = {}
+        fieldcache = self._fieldmodule.createFieldcache()
+        fieldrange = fieldcache.createFieldrange()
+        elemIter = self.getHighestDimensionMesh().createElementiterator()
+        element = elemIter.next()
+        while element.isValid():
+            fieldcache.setElement(element)
+            if self._jacobianField.evaluateFieldrange(fieldcache, fieldrange) == RESULT_OK:
+                result, minimumJacobian, maximumJacobian = fieldrange.getRangeReal(1)
+                if result == RESULT_OK:
+                    elementMinimumJacobians[element.getIdentifier()] = minimumJacobian
+            element = elemIter.next()
+        del fieldrange
+        del fieldcache
+        self._elementMinimumJacobians = (key, elementMinimumJacobians)
+        return elementMinimumJacobians
+
+    def _getMeshGroupMinimumJacobians(self, mesh_group):
+        """
+        :param mesh_group: Mesh group of highest dimension, or None for whole mesh.
+        :return: List of (element identifier, minimum jacobian) for elements in mesh group in iteration order,
+        or None if mesh group is not in the highest dimension mesh.
+        """
+        elementMinimumJacobians = self._getElementMinimumJacobians()
+        if not mesh_group:
+            return list(elementMinimumJacobians.items())
+        if (not mesh_group.isValid()) or (mesh_group.getDimension() != self.getHighestDimensionMesh().getDimension()):
+            return None
+        minimumJacobians = []
+        elemIter = mesh_group.createElementiterator()
+        element = elemIter.next()
+        while element.isValid():
+            elementIdentifier = element.getIdentifier()
+            minimumJacobian = elementMinimumJacobians.get(elementIdentifier)
+            if minimumJacobian is not None:
+                minimumJacobians.append((elementIdentifier, minimumJacobian))
+            element = elemIter.next()
+        return minimumJacobians
+
     def getLowestElementJacobian(self, mesh_group=None):
         """
         Get the information on the 3D element with the worst jacobian value (most negative).
@@ -841,15 +1895,72 @@ class Fitter:
         elements.
         Optional mesh group parameter allows the user to make the calculation over a different group
         from the whole mesh.
+        Uses per-element minimum jacobians cached until model coordinates change.
         :param mesh_group: Optional parameter to specify a particular mesh group to make the calculation over.
         :return: Element identifier, minimum jacobian value. Values are -1, inf if there is no data or bad fields.
         """
-        with ChangeManager(self._fieldmodule):
-            jacobian = create_jacobian_determinant_field(self._modelCoordinatesField, self._modelReferenceCoordinatesField)
-            result = get_scalar_field_minimum_in_mesh(jacobian, mesh_group)
-            del jacobian
-
-        return result
+        minimumJacobians = self._getMeshGroupMinimumJacobians(mesh_group)
+        if minimumJacobians is None:
+            # not in highest dimension mesh
+            with ChangeManager(self._fieldmodule):
+                jacobian = create_jacobian_determinant_field(
+                    self._modelCoordinatesField, self._modelReferenceCoordinatesField)
+                result = get_scalar_field_minimum_in_mesh(jacobian, mesh_group)
+                del jacobian
+            return result
+        minimumElementIdentifier = -1
+        minimumJacobian = math.inf
+        for elementIdentifier, elementMinimumJacobian in minimumJacobians:
+            if elementMinimumJacobian < minimumJacobian:
+                minimumElementIdentifier = elementIdentifier
+                minimumJacobian = elementMinimumJacobian
+        return minimumElementIdentifier, minimumJacobian
+
+    def getInvertedElementCount(self, mesh_group=None, minimumJacobian=0.0):
+        """
+        Get number of elements of the highest dimension mesh with jacobian at or below minimumJacobian, i.e.
+        inverted for right-handed elements. Cheap to call repeatedly as uses cached per-element minimum jacobians.
+        :param mesh_group: Optional mesh group of highest dimension to count elements in, otherwise whole mesh.
+        :param minimumJacobian: Elements with minimum jacobian <= this value are counted.
+        :return: Number of elements, or None if mesh group is not in highest dimension mesh.
+        """
+        invertedElementIdentifiers = self.getInvertedElementIdentifiers(mesh_group, minimumJacobian)
+        if invertedElementIdentifiers is None:
+            return None
+        return len(invertedElementIdentifiers)
+
+    def getInvertedElementIdentifiers(self, mesh_group=None, minimumJacobian=0.0):
+        """
+        Get identifiers of elements of the highest dimension mesh with jacobian at or below minimumJacobian.
+        Uses cached per-element minimum jacobians.
+        :param mesh_group: Optional mesh group of highest dimension to get elements in, otherwise whole mesh.
+        :param minimumJacobian: Elements with minimum jacobian <= this value are included.
+        :return: set of element identifiers, or None if mesh group is not in highest dimension mesh.
+        """
+        minimumJacobians = self._getMeshGroupMinimumJacobians(mesh_group)
+        if minimumJacobians is None:
+            return None
+        return set(elementIdentifier for elementIdentifier, elementMinimumJacobian in minimumJacobians
+                   if elementMinimumJacobian <= minimumJacobian)
+
+    def getElementJacobianHistogram(self, binEdges, mesh_group=None):
+        """
+        Get histogram of minimum jacobians of elements of the highest dimension mesh, from cached values.
+        :param binEdges: List of increasing jacobian values separating bins.
+        :param mesh_group: Optional mesh group of highest dimension to count elements in, otherwise whole mesh.
+        :return: List of len(binEdges) + 1 element counts: first for minimum jacobian < binEdges[0], then for
+        each bin from binEdges[i] up to but not including binEdges[i + 1], last for >= binEdges[-1].
+        Returns None if mesh group is not in highest dimension mesh.
+        """
+        assert all((binEdges[i] < binEdges[i + 1]) for i in range(len(binEdges) - 1)), \
+            "getElementJacobianHistogram: bin edges must be increasing"
+        minimumJacobians = self._getMeshGroupMinimumJacobians(mesh_group)
+        if minimumJacobians is None:
+            return None
+        counts = [0] * (len(binEdges) + 1)
+        for elementIdentifier, elementMinimumJacobian in minimumJacobians:
+            counts[bisect.bisect_right(binEdges, elementMinimumJacobian)] += 1
+        return counts
 
     def getLowestElementJacobianForGroup(self, group_name):
         """
@@ -984,6 +2095,7 @@ class Fitter:
             # ensure activeDataNodeset only contains active marker points
             self._activeDataNodesetGroup.removeNodesConditional(self._markerGroup)
             self._activeDataNodesetGroup.addNodesConditional(self._markerDataLocationGroupField)
+        self._dataProjectionCount += 1
 
         # Warn about marker points without a location in model
         markerDataGroupSize = self._markerDataGroup.getSize()
@@ -1040,6 +2152,9 @@ class Fitter:
         orphanFieldByName(self._fieldmodule, modelReferenceCoordinatesFieldName)
         self._modelReferenceCoordinatesField = \
             createFieldFiniteElementClone(self._modelCoordinatesField, modelReferenceCoordinatesFieldName)
+        self._jacobianField = None
+        self._elementMinimumJacobians = None
+        self._objectiveFields = {}
         self._defineCommonDataFields()
         self._updateMarkerCoordinatesField()
 
@@ -1204,9 +2319,144 @@ class Fitter:
                 self._dataProjectionNodeGroupFields.append(group)
                 self._dataProjectionNodesetGroups.append(group.createNodesetGroup(datapoints))
             self._defineDataProjectionOrientationField()
+            self._defineDataProjectionStorage(redefine=True)
+
+    def _defineDataProjectionStorage(self, redefine=False):
+        """
+        Define storage for data host location, weight and projection orientation on all non-marker
+        data points with data coordinates, in a single pass so first projection of each group does
+        not need to. Marker data points are handled in _calculateMarkerDataLocations().
+        Called from defineDataProjectionFields() and when data coordinates field changes.
+        :param redefine: If True, redefine on all points which clears existing host locations, e.g.
+        from a previous fitter in the same region. Otherwise only define on points without storage.
+        """
+        if not (self._dataCoordinatesField and self._dataHostLocationField and self._dataProjectionOrientationField):
+            return
+        with ChangeManager(self._fieldmodule):
+            datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            defineGroup = self._fieldmodule.createFieldGroup()
+            defineNodesetGroup = defineGroup.createNodesetGroup(datapoints)
+            conditionalField = self._fieldmodule.createFieldIsDefined(self._dataCoordinatesField)
+            if not redefine:
+                conditionalField = self._fieldmodule.createFieldAnd(conditionalField, self._fieldmodule.createFieldNot(
+                    self._fieldmodule.createFieldIsDefined(self._dataProjectionOrientationField)))
+            defineNodesetGroup.addNodesConditional(conditionalField)
+            del conditionalField
+            if self._markerGroup:
+                defineNodesetGroup.removeNodesConditional(self._markerGroup)
+            if defineNodesetGroup.getSize() > 0:
+                nodetemplate = datapoints.createNodetemplate()
+                nodetemplate.defineField(self._dataHostLocationField)
+                # need to define storage for marker data weight, but don't assign here
+                nodetemplate.defineField(self._dataWeightField)
+                nodetemplate.defineField(self._dataProjectionOrientationField)
+                nodeIter = defineNodesetGroup.createNodeiterator()
+                node = nodeIter.next()
+                while node.isValid():
+                    node.merge(nodetemplate)
+                    node = nodeIter.next()
+                del nodetemplate
+            del defineNodesetGroup
+            del defineGroup
+
+    def _clearGroupDataProjectionStorage(self, group: FieldGroup):
+        """
+        Clear host location, weight and projection orientation on data in group which already has a host
+        location, e.g. from projection for an earlier group sharing it, by re-merging their storage. Called on
+        first projection of each group after load. Other data already has cleared storage from load.
+        :param group: Group whose data is being projected.
+        """
+        with ChangeManager(self._fieldmodule):
+            datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            clearGroup = self._fieldmodule.createFieldGroup()
+            clearNodesetGroup = clearGroup.createNodesetGroup(datapoints)
+            clearNodesetGroup.addNodesConditional(self._fieldmodule.createFieldAnd(
+                group, self._fieldmodule.createFieldIsDefined(self._dataHostCoordinatesField)))
+            if clearNodesetGroup.getSize() > 0:
+                nodetemplate = datapoints.createNodetemplate()
+                nodetemplate.defineField(self._dataHostLocationField)
+                nodetemplate.defineField(self._dataWeightField)
+                nodetemplate.defineField(self._dataProjectionOrientationField)
+                nodeIter = clearNodesetGroup.createNodeiterator()
+                node = nodeIter.next()
+                while node.isValid():
+                    node.merge(nodetemplate)
+                    node = nodeIter.next()
+                del nodetemplate
+            del clearNodesetGroup
+            del clearGroup
+
+    def _getDataVoxelSelection(self, fieldcache, groupName, dataGroup, voxelSize):
+        """
+        Get identifiers of data points in group nearest to the centres of cubic voxels of the given size,
+        using a hash grid. Result is cached until the data or voxel size change.
+        :param fieldcache: Fieldcache for zinc field evaluations in region.
+        :param groupName: Name of group data is for, used as cache key.
+        :param dataGroup: Nodeset group containing data points to decimate.
+        :param voxelSize: Absolute size of voxels > 0.0.
+        :return: set of data point identifiers to keep.
+        """
+        key = (groupName, self._dataCoordinatesFieldName, voxelSize)
+        selection = self._dataVoxelSelections.get(key)
+        if selection is None:
+            selection = set(_select_voxel_representatives(self._getGroupDataCoordinates(fieldcache, dataGroup),
+                                                          voxelSize))
+            self._dataVoxelSelections[key] = selection
+        return selection
+
+    def _getDataStratifiedRanks(self, fieldcache, groupName, dataGroup):
+        """
+        Get spatially stratified ranks of data points in group, so points with rank less than any
+        proportion are spread evenly over the data, and the subset for a smaller proportion is
+        contained in the subset for any larger proportion.
+        Points nearest the centres of voxels of the data scale are ranked first, then points nearest
+        the centres of voxels of half that size, and so on. Result is cached until the data changes.
+        :param fieldcache: Fieldcache for zinc field evaluations in region.
+        :param groupName: Name of group data is for, used as cache key.
+        :param dataGroup: Nodeset group containing data points to rank.
+        :return: map(data identifier) to rank from 0.0 to < 1.0.
+        """
+        key = (groupName, self._dataCoordinatesFieldName)
+        ranks = self._dataStratifiedRanks.get(key)
+        if ranks is not None:
+            return ranks
+        points = self._getGroupDataCoordinates(fieldcache, dataGroup)
+        pointsCount = len(points)
+        order = []
+        voxelSize = self._dataScale
+        while points:
+            selection = _select_voxel_representatives(points, voxelSize)
+            if len(selection) == len(points):
+                order += selection
+                break
+            order += selection
+            selectionSet = set(selection)
+            points = [point for point in points if point[0] not in selectionSet]
+            voxelSize *= 0.5
+        ranks = {identifier: index / pointsCount for index, identifier in enumerate(order)}
+        self._dataStratifiedRanks[key] = ranks
+        return ranks
+
+    def _getGroupDataCoordinates(self, fieldcache, dataGroup):
+        """
+        :param fieldcache: Fieldcache for zinc field evaluations in region.
+        :param dataGroup: Nodeset group containing data points.
+        :return: list of (data identifier, data coordinates) for points with data coordinates in group.
+        """
+        points = []
+        nodeIter = dataGroup.createNodeiterator()
+        node = nodeIter.next()
+        while node.isValid():
+            fieldcache.setNode(node)
+            result, x = self._dataCoordinatesField.evaluateReal(fieldcache, 3)
+            if result == RESULT_OK:
+                points.append((node.getIdentifier(), x))
+            node = nodeIter.next()
+        return points
 
     def calculateGroupDataProjections(self, fieldcache, group, dataGroup, meshGroup, findHighestDimension, meshLocation,
-                                      activeFitterStepConfig: FitterStepConfig):
+                                      activeFitterStepConfig: FitterStepConfig, scheduleProportion=1.0,
+                                      localDataNodesetGroup=None):
         """
         Project data points for group. Assumes called while ChangeManager is active for fieldmodule.
         :param fieldcache: Fieldcache for zinc field evaluations in region.
@@ -1217,6 +2467,10 @@ class Fitter:
         model fit mesh, requiring an EXACT re-projection of the coordinates at the NEAREST location on meshGroup.
         :param meshLocation: FieldStoredMeshLocation to store found location in on highest dimension mesh.
         :param activeFitterStepConfig: Where to get current projection modes from.
+        :param scheduleProportion: Proportion of data points otherwise projected to include, from a
+        nested spatially stratified ordering. Used for coarse-to-fine data schedules in fit steps.
+        :param localDataNodesetGroup: Optional data NodesetGroup limiting which points are projected. Used
+        for local refits in which only data in changed elements is re-projected.
         """
         groupName = group.getName()
         meshDimension = meshGroup.getDimension()
@@ -1224,9 +2478,24 @@ class Fitter:
         sizeBefore = dataProjectionNodesetGroup.getSize()
         dataCoordinates = self._dataCoordinatesField
         dataProportion = activeFitterStepConfig.getGroupDataProportion(groupName)[0]
+        dataVoxelSize = activeFitterStepConfig.getGroupDataVoxelSize(groupName)[0]
+        dataVoxelSelection = None
+        if dataVoxelSize > 0.0:
+            dataVoxelSelection = self._getDataVoxelSelection(
+                fieldcache, groupName, dataGroup, dataVoxelSize * self._dataScale)
+        dataStratifiedRanks = None
+        if scheduleProportion < 1.0:
+            dataStratifiedRanks = self._getDataStratifiedRanks(fieldcache, groupName, dataGroup)
         outlierLength = activeFitterStepConfig.getGroupOutlierLength(groupName)[0]
-        maximumProjectionLength = 0.0
-        dataProjectionLengths = []  # For relative outliers: list of (data identifier, projection length)
+        outlierPercentile = activeFitterStepConfig.getGroupOutlierPercentile(groupName)[0]
+        outlierMADFactor = activeFitterStepConfig.getGroupOutlierMADFactor(groupName)[0]
+        relativeOutliers = (outlierLength < 0.0) or (outlierPercentile > 0.0) or (outlierMADFactor > 0.0)
+        dataProjectionLengths = array("d")  # for relative outliers: projection lengths of points added
+        # for relative outliers: points projected by this call, as others may be projected by overlapping groups
+        projectedNodesetGroup = None
+        if relativeOutliers:
+            projectedNodesetGroup = self._fieldmodule.createFieldGroup().createNodesetGroup(
+                dataGroup.getMasterNodeset())
         centralProjection = activeFitterStepConfig.getGroupCentralProjection(groupName)[0]
         if centralProjection:
             # use centre of bounding box as middle of data; previous use of mean was affected by uneven density
@@ -1280,39 +2549,70 @@ class Fitter:
         dataProportionCounter = 0.5
         pointsProjected = 0
         outlierPointsRemoved = 0
+        localPointsCount = 0
         while node.isValid():
+            isLocal = (not localDataNodesetGroup) or localDataNodesetGroup.containsNode(node)
+            if isLocal and localDataNodesetGroup:
+                localPointsCount += 1
+            if dataVoxelSelection and (node.getIdentifier() not in dataVoxelSelection):
+                node = nodeIter.next()
+                continue
+            # advance counter over all data so local refits select the same points as the global pass
             dataProportionCounter += dataProportion
             if dataProportionCounter >= 1.0:
                 dataProportionCounter -= 1.0
+                if dataStratifiedRanks and (dataStratifiedRanks.get(node.getIdentifier(), 1.0) >= scheduleProportion):
+                    node = nodeIter.next()
+                    continue
                 fieldcache.setNode(node)
+                if not isLocal:
+                    # keep existing projection, but include its length in relative outlier calculation
+                    if relativeOutliers:
+                        result, projectionLength = self._dataErrorField.evaluateReal(fieldcache, 1)
+                        if (result == RESULT_OK) and ((outlierLength <= 0.0) or (projectionLength <= outlierLength)):
+                            dataProjectionLengths.append(projectionLength)
+                    node = nodeIter.next()
+                    continue
                 element, xi = findLocation.evaluateMeshLocation(fieldcache, storeMeshDimension)
                 if element.isValid():
                     result = meshLocation.assignMeshLocation(fieldcache, element, xi)
                     assert result == RESULT_OK, \
                         "Error: Failed to assign data projection mesh location for group " + groupName
                     result, projectionLength = self._dataErrorField.evaluateReal(fieldcache, 1)
-                    if projectionLength > maximumProjectionLength:
-                        maximumProjectionLength = projectionLength
-                    if outlierLength < 0.0:
-                        # store and filter once we know the maximum
-                        dataProjectionLengths.append((node.getIdentifier(), projectionLength))
                     if (outlierLength <= 0.0) or (projectionLength <= outlierLength):
                         dataProjectionNodesetGroup.addNode(node)
                         pointsProjected += 1
+                        if relativeOutliers:
+                            # filter once all lengths are known
+                            projectedNodesetGroup.addNode(node)
+                            dataProjectionLengths.append(projectionLength)
                     else:
                         outlierPointsRemoved += 1
             node = nodeIter.next()
-        if outlierLength < 0.0:
-            relativeOutlierLength = (1.0 + outlierLength) * maximumProjectionLength
-            for nodeIdentifier, projectionLength in dataProjectionLengths:
-                if projectionLength > relativeOutlierLength:
-                    node = dataGroup.findNodeByIdentifier(nodeIdentifier)
-                    dataProjectionNodesetGroup.removeNode(node)
-                    pointsProjected -= 1
-                    outlierPointsRemoved += 1
+        if relativeOutliers and dataProjectionLengths:
+            relativeOutlierLength = _get_relative_outlier_length(
+                dataProjectionLengths, outlierLength, outlierPercentile, outlierMADFactor)
+            # remove outliers projected by this call in one operation, so points kept in local refits or
+            # projected for other groups are not filtered
+            outlierConditional = self._fieldmodule.createFieldAnd(
+                projectedNodesetGroup.getFieldGroup(), self._fieldmodule.createFieldGreaterThan(
+                    self._dataErrorField, self._fieldmodule.createFieldConstant([relativeOutlierLength])))
+            sizeBeforeOutliers = dataProjectionNodesetGroup.getSize()
+            dataProjectionNodesetGroup.removeNodesConditional(outlierConditional)
+            outlierCount = sizeBeforeOutliers - dataProjectionNodesetGroup.getSize()
+            pointsProjected -= outlierCount
+            outlierPointsRemoved += outlierCount
+            del outlierConditional
+        del projectedNodesetGroup
         if self.getDiagnosticLevel() > 0:
-            print(str(pointsProjected) + " of " + str(dataGroup.getSize()) + " data points projected for group " +
-                  groupName + "; " + str(outlierPointsRemoved) + " outliers removed")
+            if localDataNodesetGroup:
+                print(str(pointsProjected) + " of " + str(localPointsCount) +
+                      " local data points re-projected for group " + groupName + "; " +
+                      str(outlierPointsRemoved) + " outliers removed")
+            else:
+                print(str(pointsProjected) + " of " + str(dataGroup.getSize()) +
+                      " data points projected for group " + groupName + "; " +
+                      str(outlierPointsRemoved) + " outliers removed")
         # add to active group
         self._activeDataNodesetGroup.addNodesConditional(self._dataProjectionNodeGroupFields[meshDimension - 1])
         return
@@ -1342,15 +2642,35 @@ class Fitter:
         groupName = group.getName()
         activeFitterStepConfig = self.getActiveFitterStepConfig(fitterStep)
         subgroup = activeFitterStepConfig.getGroupProjectionSubgroup(groupName)[0]
+        subgroupName = subgroup.getName() if subgroup else None
         groupProjectionData = self._groupProjectionData.get(groupName)
         if groupProjectionData:
-            if (groupProjectionData[0] == subgroup):
+            if groupProjectionData[0] == subgroupName:
                 return groupProjectionData[1], groupProjectionData[2]
+        # reuse analysis from before reload if model file is unchanged
+        analysisKey = (self._modelTopologyFingerprint, groupName, subgroupName, self._modelFitGroupName) \
+            if self._modelTopologyFingerprint else None
+        analysis = self._groupProjectionAnalyses.get(analysisKey) if analysisKey else None
         returnMeshGroup = None
         findHighestDimension = False
         with ChangeManager(self._fieldmodule):
             if groupProjectionData:
                 del self._groupProjectionData[groupName]  # cleans up field references if subgroup changed
+            if analysis:
+                meshDimension, identifierRanges, findHighestDimension = analysis
+                if meshDimension:
+                    mesh = self.getMesh(meshDimension)
+                    if identifierRanges:
+                        intersectionGroup = self._fieldmodule.createFieldGroup()
+                        intersectionGroup.setName(groupName + " " + subgroupName)  # for debugging
+                        returnMeshGroup = intersectionGroup.createMeshGroup(mesh)
+                        mesh_group_add_identifier_ranges(returnMeshGroup, identifierRanges)
+                        del intersectionGroup
+                    else:
+                        returnMeshGroup = group.getMeshGroup(mesh)
+                self._groupProjectionData[groupName] = (subgroupName, returnMeshGroup, findHighestDimension)
+                return returnMeshGroup, findHighestDimension
+
             highestDimensionMesh = self.getHighestDimensionMesh()
             highestDimension = highestDimensionMesh.getDimension()
 
@@ -1374,45 +2694,92 @@ class Fitter:
                     else:
                         returnMeshGroup = meshGroup
                         break
-        if returnMeshGroup:
-            # do any elements in returnMeshGroup NOT have self or an ancestor in modelFitMesh?
-            # If so, need to find highest dimension mesh location by a second FindMeshLocation field when projecting
-            modelFitMesh = highestDimensionMesh
-            if self._modelFitGroup:
-                modelFitMesh = self._modelFitGroup.getMeshGroup(highestDimensionMesh)
-            elementiterator = returnMeshGroup.createElementiterator()
-            element = elementiterator.next()
-            while element.isValid():
-                if not element_or_ancestor_is_in_mesh(element, modelFitMesh):
-                    findHighestDimension = True
-                    break
-                element = elementiterator.next()
-        self._groupProjectionData[groupName] = (subgroup, returnMeshGroup, findHighestDimension)
+            if returnMeshGroup:
+                findHighestDimension = self._meshGroupHasElementsOutsideModelFitMesh(returnMeshGroup)
+        if analysisKey:
+            meshDimension = returnMeshGroup.getDimension() if returnMeshGroup else 0
+            identifierRanges = mesh_group_to_identifier_ranges(returnMeshGroup) if (returnMeshGroup and subgroup) \
+                else None
+            self._groupProjectionAnalyses[analysisKey] = (meshDimension, identifierRanges, findHighestDimension)
+        self._groupProjectionData[groupName] = (subgroupName, returnMeshGroup, findHighestDimension)
 
         return returnMeshGroup, findHighestDimension
 
-    def calculateDataProjections(self, fitterStep: FitterStep):
+    def _meshGroupHasElementsOutsideModelFitMesh(self, meshGroup):
+        """
+        Determine whether any elements in mesh group are not in, or a face/line of, the highest dimension
+        model fit mesh, i.e. elements do not have self or an ancestor in the model fit mesh.
+        Computed with group operations: adding model fit elements with full subelement handling also
+        adds their faces and lines, leaving the set difference.
+        :param meshGroup: Mesh group of dimension <= highest dimension.
+        :return: True if any elements are outside model fit mesh, otherwise False.
+        """
+        with ChangeManager(self._fieldmodule):
+            highestDimensionMesh = self.getHighestDimensionMesh()
+            modelFitGroup = self._fieldmodule.createFieldGroup()
+            modelFitGroup.setSubelementHandlingMode(FieldGroup.SUBELEMENT_HANDLING_MODE_FULL)
+            modelFitMeshGroup = modelFitGroup.createMeshGroup(highestDimensionMesh)
+            if self._modelFitGroup:
+                modelFitMeshGroup.addElementsConditional(self._modelFitGroup)
+            else:
+                modelFitMeshGroup.addElementsConditional(self._fieldmodule.createFieldConstant(1.0))
+            outsideGroup = self._fieldmodule.createFieldGroup()
+            outsideMeshGroup = outsideGroup.createMeshGroup(meshGroup.getMasterMesh())
+            outsideMeshGroup.addElementsConditional(self._fieldmodule.createFieldAnd(
+                meshGroup.getFieldGroup(), self._fieldmodule.createFieldNot(modelFitGroup)))
+            hasElementsOutside = outsideMeshGroup.getSize() > 0
+            del outsideMeshGroup
+            del outsideGroup
+            del modelFitMeshGroup
+            del modelFitGroup
+        return hasElementsOutside
+
+    def calculateDataProjections(self, fitterStep: FitterStep, scheduleProportion=1.0, localGroup=None):
         """
         Find projections of datapoints' coordinates onto model coordinates,
         by groups i.e. from datapoints group onto matching 2-D or 1-D mesh group.
         Calculate and store projection direction unit vector.
+        :param fitterStep: Fitter step to get active config settings for.
+        :param scheduleProportion: Proportion of data points to project from a nested, spatially
+        stratified ordering, from > 0.0 to 1.0 (default, all points).
+        :param localGroup: Optional FieldGroup containing the only elements of the highest dimension mesh whose
+        geometry has changed, e.g. localObjectiveGroup from createLocalFitGroups(). If supplied, only data
+        currently located in these elements is re-projected and projections of all other data are kept.
+        Data proportion selects the same points as a full projection, and relative outlier lengths are
+        calculated from all projected data in each group, but only re-projected data is filtered by them.
         """
         assert self._dataCoordinatesField and self._modelCoordinatesField
         activeFitterStepConfig = self.getActiveFitterStepConfig(fitterStep)
         with ChangeManager(self._fieldmodule):
-            # build group of active data and marker points
-            self._activeDataNodesetGroup.removeAllNodes()
-            if self._markerDataLocationGroupField:
-                self._activeDataNodesetGroup.addNodesConditional(self._markerDataLocationGroupField)
-            # build groups of data and elements participating in projections in 1 and 2 dimension
-            for d in range(2):
-                self._dataProjectionNodesetGroups[d].removeAllNodes()
-                self._activeDataProjectionMeshGroups[d].removeAllElements()
-
             datapoints = self._fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            localDataGroup = None
+            localDataNodesetGroup = None
+            if localGroup:
+                # only re-project non-marker data currently located in local elements
+                localDataGroup = self._fieldmodule.createFieldGroup()
+                localDataNodesetGroup = localDataGroup.createNodesetGroup(datapoints)
+                localDataNodesetGroup.addNodesConditional(
+                    self._fieldmodule.createFieldEmbedded(localGroup, self._dataHostLocationField))
+                if self._markerGroup:
+                    localDataNodesetGroup.removeNodesConditional(self._markerGroup)
+                self._activeDataNodesetGroup.removeNodesConditional(localDataGroup)
+                for d in range(2):
+                    self._dataProjectionNodesetGroups[d].removeNodesConditional(localDataGroup)
+            else:
+                # build group of active data and marker points
+                self._activeDataNodesetGroup.removeAllNodes()
+                if self._markerDataLocationGroupField:
+                    self._activeDataNodesetGroup.addNodesConditional(self._markerDataLocationGroupField)
+                # build groups of data and elements participating in projections in 1 and 2 dimension
+                for d in range(2):
+                    self._dataProjectionNodesetGroups[d].removeAllNodes()
+                    self._activeDataProjectionMeshGroups[d].removeAllElements()
+
+            self._dataProjectionsIncomplete = True
             fieldcache = self._fieldmodule.createFieldcache()
             groups = getGroupList(self._fieldmodule)
             for group in groups:
+                self.checkCancelled()
                 if not group.isManaged():
                     continue  # skip cmiss_selection, for example
                 groupName = group.getName()
@@ -1426,27 +2793,17 @@ class Fitter:
                             print("Warning: Cannot project data for group " + groupName + " as no matching mesh group")
                     continue
                 if groupName not in self._dataProjectionGroupNames:
-                    self._dataProjectionGroupNames.append(groupName)  # so only define mesh location, or warn once
+                    self._dataProjectionGroupNames.append(groupName)  # so only clear mesh location, or warn once
                     fieldcache.setNode(dataGroup.createNodeiterator().next())
                     if not self._dataCoordinatesField.isDefinedAtLocation(fieldcache):
                         if self.getDiagnosticLevel() > 0:
                             print("Warning: Cannot project data for group " + groupName +
                                   " as field " + self._dataCoordinatesField.getName() + " is not defined on data")
                         continue
-                    # define host location, data point weight and data projection orientation on data Group:
-                    nodetemplate = datapoints.createNodetemplate()
-                    nodetemplate.defineField(self._dataHostLocationField)
-                    # need to define storage for marker data weight, but don't assign here
-                    nodetemplate.defineField(self._dataWeightField)
-                    nodetemplate.defineField(self._dataProjectionOrientationField)
-                    nodeIter = dataGroup.createNodeiterator()
-                    node = nodeIter.next()
-                    while node.isValid():
-                        node.merge(nodetemplate)
-                        node = nodeIter.next()
-                    del nodetemplate
+                    self._clearGroupDataProjectionStorage(group)
                 self.calculateGroupDataProjections(fieldcache, group, dataGroup, meshGroup, findHighestDimension,
-                                                   self._dataHostLocationField, activeFitterStepConfig)
+                                                   self._dataHostLocationField, activeFitterStepConfig,
+                                                   scheduleProportion, localDataNodesetGroup)
                 # add elements being projected onto to active group for mesh dimension
                 self._activeDataProjectionMeshGroups[meshGroup.getDimension() - 1].addElementsConditional(group)
 
@@ -1455,6 +2812,12 @@ class Fitter:
             highestMeshDimension = self.getHighestDimensionMesh().getDimension()
             for meshDimension in range(1, 3):
                 nodesetGroup = self._dataProjectionNodesetGroups[meshDimension - 1]
+                if localDataGroup:
+                    # only assign orientation for re-projected points
+                    localProjectionGroup = self._fieldmodule.createFieldGroup()
+                    nodesetGroup = localProjectionGroup.createNodesetGroup(datapoints)
+                    nodesetGroup.addNodesConditional(self._fieldmodule.createFieldAnd(
+                        self._dataProjectionNodeGroupFields[meshDimension - 1], localDataGroup))
                 if nodesetGroup.getSize() > 0:
                     if meshDimension == highestMeshDimension:
                         faceLocationField = self._dataHostLocationField  # 2-D fit case
@@ -1544,6 +2907,7 @@ class Fitter:
                         "Error:  Failed to assign data projection orientation for mesh dimension " + str(meshDimension)
                     del fieldassignment
                     del sourceOrientationField
+                del nodesetGroup
 
             if self.getDiagnosticLevel() > 0:
                 # Warn about unprojected points
@@ -1566,6 +2930,14 @@ class Fitter:
 
             # remove temporary objects before ChangeManager exits
             del fieldcache
+            del localDataNodesetGroup
+            del localDataGroup
+        self._dataProjectionsIncomplete = False
+        self._dataProjectionCount += 1
+        if self._progressCallback:
+            projectedDataCount = sum(nodesetGroup.getSize() for nodesetGroup in self._dataProjectionNodesetGroups)
+            self.notifyProgress("projections", {
+                "activeDataCount": self._activeDataNodesetGroup.getSize(), "projectedDataCount": projectedDataCount})
 
     def getDataProjectionOrientationField(self):
         return self._dataProjectionOrientationField
@@ -1657,13 +3029,111 @@ class Fitter:
         assert diagnosticLevel >= 0
         self._diagnosticLevel = diagnosticLevel
 
+    def notifyModelParametersChanged(self, referenceCoordinates=False):
+        """
+        Invalidate values cached from model coordinates parameters, e.g. data errors by element and element
+        jacobians. Called by the fitter and its steps whenever they set parameters; callers setting model
+        coordinates parameters directly must call this before querying the fitter.
+        :param referenceCoordinates: Set to True if model reference coordinates parameters also changed.
+        """
+        self._modelParametersVersion += 1
+        if referenceCoordinates:
+            self._modelReferenceParametersVersion += 1
+
     def updateModelReferenceCoordinates(self):
         assignFieldParameters(self._modelReferenceCoordinatesField, self._modelCoordinatesField)
+        self._modelReferenceParametersVersion += 1
 
-    def writeModel(self, modelFileName):
+    def writeModel(self, modelFileName=None, compression=None):
         """
-        Write model nodes and elements with model coordinates field to file.
+        Write model nodes and elements with model coordinates field to file or memory.
+        Note: Output field name is prefixed with "fitted ".
+        :param modelFileName: Name of file to write to, or None to return contents in memory.
+        :param compression: Optional compression "gzip" or "zstd" applied to file or memory output.
+        See scaffoldfitter.fitterwriter.compressBuffer/decompressBuffer.
+        :return: Bytes written if modelFileName is None, otherwise None.
+        """
+        if modelFileName and not compression:
+            self._writeModel(modelFileName)
+            return None
+        buffer = compressBuffer(self._writeModel(), compression)
+        if modelFileName:
+            with open(modelFileName, "wb") as f:
+                f.write(buffer)
+            return None
+        return buffer
+
+    def writeModelInBackground(self, modelFileName, compression=None):
+        """
+        Capture model in memory as for writeModel, then compress and write it to file on a background thread.
+        Call flushFileWrites() to wait until all queued files have been written.
+        :param modelFileName: Name of file to write to.
+        :param compression: Optional compression "gzip" or "zstd".
+        """
+        buffer = self._writeModel()
+        if not self._fileWriter:
+            self._fileWriter = FitterFileWriter()
+        self._fileWriter.write(modelFileName, buffer, compression=compression)
+
+    def flushFileWrites(self):
+        """
+        Wait until all files queued by writeModelInBackground() or writeModelDeltaInBackground() have been written.
+        """
+        if self._fileWriter:
+            self._fileWriter.flush()
+
+    def isIntermediateOutputDelta(self):
+        return self._intermediateOutputDelta
+
+    def setIntermediateOutputDelta(self, intermediateOutputDelta):
+        """
+        Set whether fit steps write intermediate iterations to a single delta file per step, containing the
+        model topology once and only the changed coordinate parameters per iteration, instead of
+        writing a complete model file per iteration. Read with scaffoldfitter.fitterdelta.FitterDeltaReader.
+        :param intermediateOutputDelta: True to write delta files, False to write model files.
+        """
+        self._intermediateOutputDelta = intermediateOutputDelta
+
+    def startModelDelta(self, deltaFileName):
+        """
+        Start writing delta file with current model as base, on a background thread.
+        :param deltaFileName: Name of delta file to write; overwritten if it exists.
+        """
+        fieldparameters = self._modelCoordinatesField.getFieldparameters()
+        parametersCount = fieldparameters.getNumberOfParameters()
+        result, parameters = fieldparameters.getParameters(parametersCount)
+        assert result == RESULT_OK
+        self._deltaParameters = array("d", parameters)
+        self._deltaFileName = deltaFileName
+        buffer = encodeDeltaBase(self._writeModel(fullModel=True), "fitted " + self._modelCoordinatesFieldName,
+                                 self._modelFitGroup.getName() if self._modelFitGroup else None)
+        if not self._fileWriter:
+            self._fileWriter = FitterFileWriter()
+        self._fileWriter.write(deltaFileName, buffer)
+
+    def writeModelDeltaInBackground(self, frameNumber):
+        """
+        Append model coordinates parameters changed since last frame to delta file started with startModelDelta().
+        :param frameNumber: Number identifying frame, e.g. iteration number.
+        """
+        assert self._deltaFileName, "Fitter.writeModelDeltaInBackground:  Delta file not started"
+        fieldparameters = self._modelCoordinatesField.getFieldparameters()
+        parametersCount = fieldparameters.getNumberOfParameters()
+        result, parameters = fieldparameters.getParameters(parametersCount)
+        assert result == RESULT_OK
+        parameters = array("d", parameters)
+        buffer = encodeDeltaFrame(frameNumber, parameters, self._deltaParameters)
+        self._deltaParameters = parameters
+        self._fileWriter.write(self._deltaFileName, buffer, append=True)
+
+    def _writeModel(self, modelFileName=None, fullModel=False):
+        """
+        Write model nodes and elements with model coordinates field to file or memory.
         Note: Output field name is prefixed with "fitted ".
+        :param modelFileName: Name of file to write to, or None to write to memory.
+        :param fullModel: If True, write all nodes and elements plus groups if there is a model fit group,
+        as needed for rebuilding output from a delta file. Otherwise limit output to the model fit group.
+        :return: Bytes written if writing to memory, otherwise None.
         """
         with ChangeManager(self._fieldmodule):
             # temporarily rename model coordinates field to prefix with "fitted "
@@ -1672,12 +3142,15 @@ class Fitter:
             self._modelCoordinatesField.setName(outputCoordinatesFieldName)
 
             sir = self._region.createStreaminformationRegion()
-            sir.setRecursionMode(sir.RECURSION_MODE_OFF)
-            srf = sir.createStreamresourceFile(modelFileName)
+            if not (fullModel and self._modelFitGroup):
+                # groups are only written with recursion on
+                sir.setRecursionMode(sir.RECURSION_MODE_OFF)
+            srf = sir.createStreamresourceFile(modelFileName) if modelFileName else \
+                sir.createStreamresourceMemory()
             sir.setResourceFieldNames(srf, [outputCoordinatesFieldName])
             sir.setResourceDomainTypes(srf, Field.DOMAIN_TYPE_NODES |
                                        Field.DOMAIN_TYPE_MESH1D | Field.DOMAIN_TYPE_MESH2D | Field.DOMAIN_TYPE_MESH3D)
-            if self._modelFitGroup:
+            if self._modelFitGroup and not fullModel:
                 sir.setResourceGroupName(srf, self._modelFitGroup.getName())
             result = self._region.write(sir)
             # self.print_log()
@@ -1687,9 +3160,33 @@ class Fitter:
 
             assert result == RESULT_OK
 
-    def writeData(self, fileName):
+        if modelFileName:
+            return None
+        result, buffer = srf.getBuffer()
+        assert result == RESULT_OK
+        return buffer
+
+    def writeData(self, fileName=None, compression=None):
+        """
+        Write data points with all their fields to file or memory.
+        :param fileName: Name of file to write to, or None to return contents in memory.
+        :param compression: Optional compression "gzip" or "zstd" applied to file or memory output.
+        :return: Bytes written if fileName is None, otherwise None.
+        """
         sir = self._region.createStreaminformationRegion()
         sir.setRecursionMode(sir.RECURSION_MODE_OFF)
-        sr = sir.createStreamresourceFile(fileName)
+        writeFile = fileName and not compression
+        sr = sir.createStreamresourceFile(fileName) if writeFile else sir.createStreamresourceMemory()
         sir.setResourceDomainTypes(sr, Field.DOMAIN_TYPE_DATAPOINTS)
-        self._region.write(sir)
+        result = self._region.write(sir)
+        assert result == RESULT_OK
+        if writeFile:
+            return None
+        result, buffer = sr.getBuffer()
+        assert result == RESULT_OK
+        buffer = compressBuffer(buffer, compression)
+        if fileName:
+            with open(fileName, "wb") as f:
+                f.write(buffer)
+            return None
+        return buffer
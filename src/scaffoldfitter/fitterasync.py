@@ -0,0 +1,161 @@
+"""
+Asyncio facade for Fitter, running blocking calls on a dedicated worker thread per fitter.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+
+from scaffoldfitter.fitter import Fitter
+
+
+class AsyncFitter:
+    """
+    Runs Fitter calls on a single worker thread so they don't block the event loop, and all Zinc calls for
+    the fitter's context are serialised. Progress events from run() are delivered through progressEvents().
+    """
+
+    def __init__(self, fitter: Fitter):
+        """
+        :param fitter: Fitter to run calls on. Must not be used directly while owned by this object.
+        """
+        self._fitter = fitter
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncFitter")
+        self._cancellationToken = threading.Event()
+        self._fitter.setCancellationToken(self._cancellationToken)
+        self._progressQueues = []  # list of (event loop, asyncio.Queue) for each progressEvents() iterator
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def getFitter(self):
+        """
+        :return: Owned Fitter. Only access it in functions passed to call().
+        """
+        return self._fitter
+
+    async def call(self, function, *args, **kwargs):
+        """
+        Call function on the worker thread.
+        :param function: Function to call, e.g. a Fitter method or one taking the fitter as an argument.
+        :return: Result of function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def load(self):
+        """
+        Load model and data. See Fitter.load().
+        """
+        await self.call(self._fitter.load)
+
+    async def run(self, endStep=None, modelFileNameStem=None, reorder=False):
+        """
+        Run fitter steps, reporting progress to progressEvents() iterators. See Fitter.run().
+        Raises FitterCancelled if cancel() is called before run completes; calling again resumes.
+        Cancelling the awaiting task, e.g. on asyncio.wait_for() timeout, also cancels the fit so later calls
+        are not queued behind it.
+        :return: True if reloaded, False if not.
+        """
+        def runWithProgress():
+            # clear cancellation when run starts on worker thread so an earlier cancelled run still sees it;
+            # progress callback is only set while running
+            self._cancellationToken.clear()
+            self._fitter.setProgressCallback(self._postProgress)
+            try:
+                return self._fitter.run(endStep, modelFileNameStem, reorder)
+            finally:
+                self._fitter.setProgressCallback(None)
+                self._postProgress(None, None)  # end progress iterators
+
+        try:
+            return await self.call(runWithProgress)
+        except asyncio.CancelledError:
+            self._cancellationToken.set()
+            raise
+
+    def cancel(self):
+        """
+        Request current run() to stop at the next cancellation check. Safe to call from any thread.
+        """
+        self._cancellationToken.set()
+
+    async def writeModel(self, modelFileName=None, compression=None):
+        """
+        See Fitter.writeModel().
+        """
+        return await self.call(self._fitter.writeModel, modelFileName, compression)
+
+    async def writeData(self, fileName=None, compression=None):
+        """
+        See Fitter.writeData().
+        """
+        return await self.call(self._fitter.writeData, fileName, compression)
+
+    async def getDataRMSAndMaximumProjectionError(self):
+        """
+        See Fitter.getDataRMSAndMaximumProjectionError().
+        """
+        return await self.call(self._fitter.getDataRMSAndMaximumProjectionError)
+
+    async def getDataErrorStatistics(self, percentiles=None, fileName=None):
+        """
+        See Fitter.getDataErrorStatistics().
+        """
+        return await self.call(self._fitter.getDataErrorStatistics, percentiles, fileName)
+
+    async def getLowestElementJacobian(self, mesh_group=None):
+        """
+        See Fitter.getLowestElementJacobian().
+        """
+        return await self.call(self._fitter.getLowestElementJacobian, mesh_group)
+
+    def progressEvents(self):
+        """
+        Get async iterator over (eventName, info) progress events from the current or next run(), ending when it
+        finishes. Events are queued from this call, so get it before starting run() to receive all events.
+        See Fitter.setProgressCallback() for events. Must be called from the event loop thread.
+        :return: Async iterator.
+        """
+        return _ProgressEvents(self._progressQueues)
+
+    def _postProgress(self, eventName, info):
+        """
+        Progress callback called on worker thread, posting event to all iterators' queues.
+        """
+        for loop, queue in list(self._progressQueues):
+            loop.call_soon_threadsafe(queue.put_nowait, (eventName, info))
+
+    async def close(self):
+        """
+        Clean up fitter on the worker thread and stop it.
+        """
+        await self.call(self._fitter.cleanup)
+        self._executor.shutdown(wait=True)
+
+
+class _ProgressEvents:
+    """
+    Async iterator over progress events posted to its queue, registered on construction.
+    """
+
+    def __init__(self, progressQueues: list):
+        self._progressQueues = progressQueues
+        self._entry = (asyncio.get_running_loop(), asyncio.Queue())
+        self._progressQueues.append(self._entry)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._entry is None:
+            raise StopAsyncIteration
+        eventName, info = await self._entry[1].get()
+        if eventName is None:
+            self._progressQueues.remove(self._entry)
+            self._entry = None
+            raise StopAsyncIteration
+        return eventName, info
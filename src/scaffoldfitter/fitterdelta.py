@@ -0,0 +1,150 @@
+"""
+Compact append-only container for intermediate model outputs, storing the model topology once
+followed by only the changed coordinate parameters for each iteration.
+
+Layout: magic bytes then records, each with a 1 byte type, 8 byte little-endian payload length
+and payload:
+  b"H": UTF-8 JSON header with output coordinates field name and optional fit group name.
+  b"B": Zinc EX model buffer giving topology and parameters before the first frame.
+  b"F": frame: uint32 frame number, uint32 count, then count uint32 parameter indexes and
+        count float64 values which changed since the previous frame.
+"""
+from array import array
+import json
+import struct
+
+from cmlibs.utils.zinc.general import ChangeManager
+from cmlibs.zinc.context import Context
+from cmlibs.zinc.field import Field
+from cmlibs.zinc.result import RESULT_OK
+from scaffoldfitter.fitterrecords import decodeRecords, encodeRecord, fromLittleEndian, toLittleEndian
+
+
+_deltaMagic = b"SFDELTA\x01"
+_frameHeader = struct.Struct("<II")
+
+
+def encodeDeltaBase(modelBuffer, coordinatesFieldName, groupName=None):
+    """
+    Encode start of delta container.
+    :param modelBuffer: Zinc EX bytes for model with all nodes, elements, coordinates and group fields.
+    :param coordinatesFieldName: Name of coordinates field in modelBuffer whose parameters change.
+    :param groupName: Optional name of group in modelBuffer to limit output to, or None for all.
+    :return: Bytes.
+    """
+    header = json.dumps({"coordinatesFieldName": coordinatesFieldName, "groupName": groupName})
+    return _deltaMagic + encodeRecord(b"H", header.encode("utf-8")) + encodeRecord(b"B", modelBuffer)
+
+
+def encodeDeltaFrame(frameNumber, parameters, previousParameters):
+    """
+    Encode parameters which have changed since previous frame.
+    :param frameNumber: Number identifying frame e.g. iteration number.
+    :param parameters: Current parameters array('d').
+    :param previousParameters: Parameters array('d') at previous frame, or base.
+    :return: Bytes.
+    """
+    assert len(parameters) == len(previousParameters)
+    indexes = array("I", [i for i, (value, previousValue) in enumerate(zip(parameters, previousParameters))
+                          if value != previousValue])
+    values = array("d", [parameters[i] for i in indexes])
+    payload = _frameHeader.pack(frameNumber, len(indexes)) + toLittleEndian(indexes) + toLittleEndian(values)
+    return encodeRecord(b"F", payload)
+
+
+class FitterDeltaReader:
+    """
+    Reads delta container written by Fitter intermediate output, and rebuilds Zinc EX model for any frame.
+    """
+
+    def __init__(self, fileName=None, buffer=None):
+        """
+        :param fileName: Name of delta file to read, or None if supplying buffer.
+        :param buffer: Bytes of delta file, or None if supplying fileName.
+        """
+        if fileName:
+            assert buffer is None
+            with open(fileName, "rb") as f:
+                buffer = f.read()
+        self._header = None
+        self._modelBuffer = None
+        self._frames = {}  # map frame number -> (indexes, values)
+        self._frameNumbers = []  # in order written
+        # ignore incomplete record at end of file being written
+        for recordType, payload in decodeRecords(buffer, _deltaMagic, "delta file", allowTruncated=True):
+            if recordType == b"H":
+                self._header = json.loads(payload.decode("utf-8"))
+            elif recordType == b"B":
+                self._modelBuffer = payload
+            elif recordType == b"F":
+                frameNumber, count = _frameHeader.unpack_from(payload)
+                start = _frameHeader.size
+                indexes = fromLittleEndian("I", payload[start:start + 4 * count])
+                values = fromLittleEndian("d", payload[start + 4 * count:start + 12 * count])
+                self._frames[frameNumber] = (indexes, values)
+                self._frameNumbers.append(frameNumber)
+        if (self._header is None) or (self._modelBuffer is None):
+            raise ValueError("Delta file is missing header or base model")
+
+    def getFrameNumbers(self):
+        """
+        :return: List of frame numbers in the order they were written.
+        """
+        return list(self._frameNumbers)
+
+    def getModelBuffer(self, frameNumber=None):
+        """
+        Rebuild model EX for frame.
+        :param frameNumber: Frame number to rebuild, or None for base model before first frame.
+        :return: Zinc EX bytes, equivalent to Fitter.writeModel() output at that frame.
+        """
+        context = Context("FitterDeltaReader")
+        region = context.getDefaultRegion()
+        fieldmodule = region.getFieldmodule()
+        sir = region.createStreaminformationRegion()
+        sir.createStreamresourceMemoryBuffer(self._modelBuffer)
+        result = region.read(sir)
+        assert result == RESULT_OK, "FitterDeltaReader: Failed to read base model"
+        coordinatesFieldName = self._header["coordinatesFieldName"]
+        coordinates = fieldmodule.findFieldByName(coordinatesFieldName).castFiniteElement()
+        assert coordinates.isValid()
+        if frameNumber is not None:
+            if frameNumber not in self._frames:
+                raise KeyError("Delta file has no frame " + str(frameNumber))
+            fieldparameters = coordinates.getFieldparameters()
+            parametersCount = fieldparameters.getNumberOfParameters()
+            result, parameters = fieldparameters.getParameters(parametersCount)
+            assert result == RESULT_OK
+            for number in self._frameNumbers:
+                indexes, values = self._frames[number]
+                for index, value in zip(indexes, values):
+                    parameters[index] = value
+                if number == frameNumber:
+                    break
+            with ChangeManager(fieldmodule):
+                result = fieldparameters.setParameters(parameters)
+            assert result == RESULT_OK
+        sir = region.createStreaminformationRegion()
+        sir.setRecursionMode(sir.RECURSION_MODE_OFF)
+        srm = sir.createStreamresourceMemory()
+        sir.setResourceFieldNames(srm, [coordinatesFieldName])
+        sir.setResourceDomainTypes(srm, Field.DOMAIN_TYPE_NODES |
+                                   Field.DOMAIN_TYPE_MESH1D | Field.DOMAIN_TYPE_MESH2D | Field.DOMAIN_TYPE_MESH3D)
+        groupName = self._header["groupName"]
+        if groupName:
+            sir.setResourceGroupName(srm, groupName)
+        result = region.write(sir)
+        assert result == RESULT_OK
+        result, buffer = srm.getBuffer()
+        assert result == RESULT_OK
+        return buffer
+
+    def writeModel(self, fileName, frameNumber=None):
+        """
+        Rebuild model EX for frame and write to file.
+        :param fileName: Name of file to write.
+        :param frameNumber: Frame number to rebuild, or None for base model before first frame.
+        """
+        buffer = self.getModelBuffer(frameNumber)
+        with open(fileName, "wb") as f:
+            f.write(buffer)
@@ -1,3 +1,10 @@
 
 class FitterModelCoordinateField(Exception):
     pass
+
+
+class FitterCancelled(Exception):
+    """
+    Raised when a fitter run is cancelled with its cancellation token.
+    """
+    pass
@@ -0,0 +1,224 @@
+"""
+Pool of worker processes each holding a loaded Fitter for a scaffold template, for fitting many data sets
+with low latency. Between jobs each fitter is reset by restoring the template model coordinates and reloading
+only the data, avoiding a full Fitter.load().
+"""
+import multiprocessing
+import os
+import time
+
+from cmlibs.zinc.result import RESULT_OK
+from scaffoldfitter.fitter import Fitter
+from scaffoldfitter.fitterjson import decodeJSONFitterSteps
+
+
+# state of fitter in worker process, set by _initialiseWorker()
+_workerTemplate = None  # (zincModelFileName, zincDataFileName, settingsJSON)
+_workerFitter = None  # None if not loaded or failed
+_workerTemplateParameters = None  # model coordinates parameters after load
+_workerLoadError = None  # exception from failed load in initializer, raised by next job
+_workerJobCount = 0
+
+
+def _loadWorkerFitter():
+    """
+    Load worker fitter from template and store its initial model coordinates parameters.
+    """
+    global _workerFitter, _workerTemplateParameters
+    zincModelFileName, zincDataFileName, settingsJSON = _workerTemplate
+    _workerFitter = None
+    fitter = Fitter(zincModelFileName, zincDataFileName)
+    fitter.decodeSettingsJSON(settingsJSON, decodeJSONFitterSteps)
+    fitter.load()
+    fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+    result, _workerTemplateParameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+    assert result == RESULT_OK, "FitterPool:  Failed to get template model parameters"
+    _workerFitter = fitter
+
+
+def _initialiseWorker(zincModelFileName, zincDataFileName, settingsJSON):
+    """
+    Pool initializer preparing worker process fitter. Load failures are recorded to raise from the next job,
+    as an exception in the initializer ends the worker process and the pool endlessly replaces it.
+    """
+    global _workerTemplate, _workerLoadError
+    _workerTemplate = (zincModelFileName, zincDataFileName, settingsJSON)
+    try:
+        _loadWorkerFitter()
+    except Exception as exception:
+        _workerLoadError = exception
+
+
+def _resetWorkerFitter(zincDataFileName):
+    """
+    Restore template model coordinates and reload data. Fully reloads if last job failed.
+    Raises exception from failed load in initializer, if any.
+    """
+    global _workerLoadError
+    if _workerLoadError:
+        loadError = _workerLoadError
+        _workerLoadError = None
+        raise loadError
+    if not _workerFitter:
+        _loadWorkerFitter()
+    fieldparameters = _workerFitter.getModelCoordinatesField().getFieldparameters()
+    # note: must get number of parameters before they can be set
+    assert fieldparameters.getNumberOfParameters() == len(_workerTemplateParameters), \
+        "FitterPool:  Template parameters do not match model"
+    result = fieldparameters.setParameters(_workerTemplateParameters)
+    assert result == RESULT_OK, "FitterPool:  Failed to restore template model parameters"
+    _workerFitter.notifyModelParametersChanged()
+    _workerFitter.updateModelReferenceCoordinates()
+    _workerFitter.reloadData(zincDataFileName)
+
+
+def _runPoolJob(zincDataFileName, modelFileName, compression):
+    """
+    Fit worker fitter to data. Module function so it can be run in a worker process.
+    :return: dict of results for job.
+    """
+    global _workerFitter, _workerJobCount
+    _workerJobCount += 1
+    startTime = time.perf_counter()
+    try:
+        _resetWorkerFitter(zincDataFileName)
+        _workerFitter.run()
+        rmsError, maxError = _workerFitter.getDataRMSAndMaximumProjectionError()
+        minimumJacobianElementIdentifier, minimumJacobian = _workerFitter.getLowestElementJacobian()
+        if modelFileName:
+            _workerFitter.writeModel(modelFileName, compression)
+    except Exception:
+        # fitter state is unknown: fully reload for next job
+        if _workerFitter:
+            _workerFitter.cleanup()
+        _workerFitter = None
+        raise
+    return {
+        "rmsError": rmsError,
+        "maxError": maxError,
+        "minimumJacobian": minimumJacobian,
+        "minimumJacobianElement": minimumJacobianElementIdentifier,
+        "time": time.perf_counter() - startTime,
+        "processId": os.getpid(),
+        "jobCount": _workerJobCount
+    }
+
+
+def _getWorkerHealth():
+    """
+    :return: dict describing worker process and fitter state.
+    """
+    return {
+        "processId": os.getpid(),
+        "jobCount": _workerJobCount,
+        "loaded": _workerFitter is not None,
+        "loadError": str(_workerLoadError) if _workerLoadError else None
+    }
+
+
+class FitterPool:
+    """
+    Keeps pools of worker processes with fitters prepared for named scaffold templates, to which fit jobs for
+    new data are submitted. Worker processes are recycled after a maximum number of jobs to bound memory growth.
+    """
+
+    def __init__(self):
+        self._templates = {}  # map(template name) to (multiprocessing.Pool, processCount)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def addTemplate(self, name, zincModelFileName: str, zincDataFileName: str, settingsJSON: str, processCount=1,
+                    maximumJobsPerProcess=None):
+        """
+        Start worker processes each loading a fitter for the template.
+        :param name: Unique name to submit jobs for template with.
+        :param zincModelFileName: Name of zinc file supplying model to fit.
+        :param zincDataFileName: Name of zinc file supplying representative data to prepare fitters with.
+        Jobs' data must be compatible with it, e.g. same data coordinates field and group names.
+        :param settingsJSON: Fitter settings JSON as output by Fitter.encodeSettingsJSON().
+        :param processCount: Number of worker processes, each holding a fitter.
+        :param maximumJobsPerProcess: Number of jobs or health checks after which a worker process is replaced by
+        a new one, or None to keep worker processes for life of the pool.
+        """
+        assert name not in self._templates, "FitterPool:  Template " + str(name) + " already exists"
+        assert processCount > 0, "FitterPool:  Invalid process count " + str(processCount)
+        assert (maximumJobsPerProcess is None) or (maximumJobsPerProcess > 0), \
+            "FitterPool:  Invalid maximum jobs per process " + str(maximumJobsPerProcess)
+        # spawn fresh workers as forking a process holding Zinc objects and threads is unsafe
+        pool = multiprocessing.get_context("spawn").Pool(
+            processCount, initializer=_initialiseWorker,
+            initargs=(zincModelFileName, zincDataFileName, settingsJSON),
+            maxtasksperchild=maximumJobsPerProcess)
+        self._templates[name] = (pool, processCount)
+
+    def getTemplateNames(self):
+        """
+        :return: List of template names.
+        """
+        return list(self._templates.keys())
+
+    def getProcessCount(self, name):
+        """
+        :param name: Template name.
+        :return: Number of worker processes for template.
+        """
+        return self._templates[name][1]
+
+    def removeTemplate(self, name):
+        """
+        Stop worker processes for template after finishing outstanding jobs.
+        :param name: Template name.
+        """
+        pool = self._templates.pop(name)[0]
+        pool.close()
+        pool.join()
+
+    def submit(self, name, zincDataFileName: str, modelFileName=None, compression=None):
+        """
+        Submit job to fit template to data, running on the next available worker process.
+        :param name: Template name.
+        :param zincDataFileName: Name of zinc file supplying data to fit to.
+        :param modelFileName: Optional name of file to write fitted model to.
+        :param compression: Optional compression "gzip" or "zstd" for model file. See Fitter.writeModel().
+        :return: multiprocessing AsyncResult whose get() returns dict of results with keys rmsError, maxError,
+        minimumJacobian, minimumJacobianElement, time in seconds for reset and fit, processId and jobCount for
+        the worker process, or raises the job's exception.
+        """
+        pool = self._templates[name][0]
+        return pool.apply_async(_runPoolJob, (zincDataFileName, modelFileName, compression))
+
+    def fit(self, name, zincDataFileName: str, modelFileName=None, compression=None, timeout=None):
+        """
+        Fit template to data and wait for result. See submit().
+        :param timeout: Optional time in seconds to wait, after which multiprocessing.TimeoutError is raised.
+        :return: dict of results.
+        """
+        return self.submit(name, zincDataFileName, modelFileName, compression).get(timeout)
+
+    def checkHealth(self, name, timeout=None):
+        """
+        Run a health check task per worker process for template. Tasks are queued behind outstanding jobs,
+        are not guaranteed to reach every process and count towards maximumJobsPerProcess.
+        :param name: Template name.
+        :param timeout: Optional time in seconds to wait for all checks, after which multiprocessing.TimeoutError
+        is raised.
+        :return: List of dicts with keys processId, jobCount, loaded (False if last job failed and fitter
+        will be reloaded for next job) and loadError (message from failed template load, to be raised by next
+        job, otherwise None).
+        """
+        pool, processCount = self._templates[name]
+        results = [pool.apply_async(_getWorkerHealth) for i in range(processCount)]
+        endTime = (time.monotonic() + timeout) if (timeout is not None) else None
+        return [result.get(None if (endTime is None) else max(0.0, endTime - time.monotonic()))
+                for result in results]
+
+    def close(self):
+        """
+        Stop all worker processes after finishing outstanding jobs.
+        """
+        for name in list(self._templates.keys()):
+            self.removeTemplate(name)
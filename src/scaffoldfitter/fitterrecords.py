@@ -0,0 +1,80 @@
+"""
+Helpers for scaffoldfitter binary containers made of magic bytes then records, each with a 1 byte type,
+8 byte little-endian payload length and payload. Arrays are stored as little-endian uint32 "I" or
+float64 "d" values.
+"""
+from array import array
+import struct
+import sys
+
+
+_recordHeader = struct.Struct("<cQ")
+_arrayItemSizes = {"I": 4, "d": 8}
+
+
+def toLittleEndian(values):
+    """
+    :param values: array("I") or array("d").
+    :return: Bytes of values in little-endian order.
+    """
+    assert values.itemsize == _arrayItemSizes[values.typecode], \
+        "toLittleEndian:  Unsupported array type " + values.typecode + " size " + str(values.itemsize)
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def fromLittleEndian(typecode, buffer):
+    """
+    :param typecode: Array typecode "I" or "d".
+    :param buffer: Bytes of little-endian values from toLittleEndian().
+    :return: array of values.
+    """
+    values = array(typecode)
+    assert values.itemsize == _arrayItemSizes[typecode], \
+        "fromLittleEndian:  Unsupported array type " + typecode + " size " + str(values.itemsize)
+    values.frombytes(buffer)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def encodeRecord(recordType, payload):
+    """
+    :param recordType: 1 byte record type e.g. b"H".
+    :param payload: Bytes of record payload.
+    :return: Bytes of record.
+    """
+    return _recordHeader.pack(recordType, len(payload)) + payload
+
+
+def decodeRecords(buffer, magic, description, allowTruncated=False):
+    """
+    Check magic bytes at start of buffer and get records following them.
+    :param buffer: Bytes of container.
+    :param magic: Magic bytes the container must start with.
+    :param description: Description of container for error messages e.g. "delta file".
+    :param allowTruncated: Set to True to ignore incomplete record at end, e.g. of file being written,
+    otherwise ValueError is raised.
+    :return: List of (recordType, payload) in order.
+    """
+    if buffer[:len(magic)] != magic:
+        raise ValueError("Not a scaffoldfitter " + description)
+    records = []
+    offset = len(magic)
+    while offset < len(buffer):
+        if (offset + _recordHeader.size) > len(buffer):
+            if allowTruncated:
+                break
+            raise ValueError("Truncated scaffoldfitter " + description)
+        recordType, length = _recordHeader.unpack_from(buffer, offset)
+        offset += _recordHeader.size
+        payload = buffer[offset:offset + length]
+        if len(payload) < length:
+            if allowTruncated:
+                break
+            raise ValueError("Truncated scaffoldfitter " + description)
+        offset += length
+        records.append((recordType, payload))
+    return records
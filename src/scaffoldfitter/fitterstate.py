@@ -0,0 +1,74 @@
+"""
+Compact binary archive of fitter state, for resuming fitting without replaying completed fitter steps.
+
+Layout: magic bytes then records, each with a 1 byte type, 8 byte little-endian payload length
+and payload:
+  b"H": UTF-8 JSON header with settings and other non-array state.
+  b"A": named array: uint16 name length, UTF-8 name, 1 byte array typecode "I" or "d", then
+        little-endian uint32 or float64 values.
+"""
+from array import array
+import json
+import struct
+
+from scaffoldfitter.fitterrecords import decodeRecords, encodeRecord, fromLittleEndian, toLittleEndian
+
+
+_stateMagic = b"SFSTATE\x01"
+_arrayHeader = struct.Struct("<H")
+
+
+def encodeStateArchive(header: dict, arrays: dict):
+    """
+    Encode state archive.
+    :param header: JSON-serialisable dict of state.
+    :param arrays: dict mapping name to array("I") or array("d") of state values.
+    :return: Bytes.
+    """
+    records = [_stateMagic, encodeRecord(b"H", json.dumps(header).encode("utf-8"))]
+    for name, values in arrays.items():
+        assert values.typecode in ("I", "d"), "encodeStateArchive:  Unsupported array type " + values.typecode
+        encodedName = name.encode("utf-8")
+        records.append(encodeRecord(b"A", _arrayHeader.pack(len(encodedName)) + encodedName +
+                                    values.typecode.encode("ascii") + toLittleEndian(values)))
+    return b"".join(records)
+
+
+def decodeStateArchive(buffer):
+    """
+    Decode state archive.
+    :param buffer: Bytes of uncompressed state archive.
+    :return: header dict, dict mapping name to array of values.
+    """
+    header = None
+    arrays = {}
+    for recordType, payload in decodeRecords(buffer, _stateMagic, "state archive"):
+        if recordType == b"H":
+            header = json.loads(payload.decode("utf-8"))
+        elif recordType == b"A":
+            nameLength, = _arrayHeader.unpack_from(payload)
+            start = _arrayHeader.size
+            name = payload[start:start + nameLength].decode("utf-8")
+            typecode = payload[start + nameLength:start + nameLength + 1].decode("ascii")
+            arrays[name] = fromLittleEndian(typecode, payload[start + nameLength + 1:])
+    if header is None:
+        raise ValueError("State archive is missing header")
+    return header, arrays
+
+
+def identifierRangesToArray(identifierRanges):
+    """
+    :param identifierRanges: List of [first, last] identifier ranges.
+    :return: array("I") of first, last identifiers in each range.
+    """
+    values = array("I", [identifier for identifierRange in identifierRanges for identifier in identifierRange])
+    assert values.itemsize == 4, "identifierRangesToArray:  array('I') is not 4 bytes"
+    return values
+
+
+def arrayToIdentifierRanges(values):
+    """
+    :param values: array("I") from identifierRangesToArray().
+    :return: List of [first, last] identifier ranges.
+    """
+    return [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
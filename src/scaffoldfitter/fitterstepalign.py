@@ -321,6 +321,7 @@ class FitterStepAlign(FitterStep):
             fieldassignment = model_coordinates.createFieldassignment(model_coordinates_transformed)
             result = fieldassignment.assign()
             assert result in [RESULT_OK, RESULT_WARNING_PART_DONE], "Align:  Failed to transform model"
+            self._fitter.notifyModelParametersChanged()
             self._fitter.updateModelReferenceCoordinates()
             del fieldassignment
             del model_coordinates_transformed
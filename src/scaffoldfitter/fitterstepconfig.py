@@ -15,7 +15,10 @@ class FitterStepConfig(FitterStep):
     _jsonTypeId = "_FitterStepConfig"
     _centralProjectionToken = "centralProjection"
     _dataProportionToken = "dataProportion"
+    _dataVoxelSizeToken = "dataVoxelSize"
     _outlierLengthToken = "outlierLength"
+    _outlierMADFactorToken = "outlierMADFactor"
+    _outlierPercentileToken = "outlierPercentile"
     _projectionSubgroupToken = "projectionSubgroup"
 
     def __init__(self):
@@ -113,6 +116,44 @@ class FitterStepConfig(FitterStep):
                 proportion = 1.0
         self.setGroupSetting(groupName, self._dataProportionToken, proportion)
 
+    def clearGroupDataVoxelSize(self, groupName):
+        """
+        Clear local group data voxel size so fall back to last config or global default.
+        :param groupName:  Exact model group name, or None for default group.
+        """
+        self.clearGroupSetting(groupName, self._dataVoxelSizeToken)
+
+    def getGroupDataVoxelSize(self, groupName):
+        """
+        Get size of cubic voxels, as a proportion of the data scale, used to decimate group data
+        points to the single point nearest to the centre of each voxel, plus flags indicating where
+        it has been set. Gives spatially uniform data density on unevenly sampled data.
+        Applied before data proportion.
+        If not set or inherited, gets value from default group.
+        :param groupName:  Exact model group name, or None for default group.
+        :return:  Voxel size, setLocally, inheritable.
+        Voxel size > 0.0, or 0.0 to not decimate (default).
+        The second return value is True if the value is set locally to a value
+        or None if reset locally.
+        The third return value is True if a previous config has set the value.
+        """
+        return self.getGroupSetting(groupName, self._dataVoxelSizeToken, 0.0)
+
+    def setGroupDataVoxelSize(self, groupName, voxelSize):
+        """
+        Set size of cubic voxels, as a proportion of the data scale, used to decimate group data
+        points to the single point nearest to the centre of each voxel, or reset to global default.
+        :param groupName:  Exact model group name, or None for default group.
+        :param voxelSize:  Float valued voxel size > 0.0 as proportion of data scale, 0.0 to not
+        decimate, or None to reset to global default (0.0). Function ensures value is valid.
+        """
+        if voxelSize is not None:
+            if not isinstance(voxelSize, float):
+                voxelSize = self.getGroupDataVoxelSize(groupName)[0]
+            elif voxelSize < 0.0:
+                voxelSize = 0.0
+        self.setGroupSetting(groupName, self._dataVoxelSizeToken, voxelSize)
+
     def clearGroupOutlierLength(self, groupName):
         """
         Clear local group outlier length so fall back to last config or global default.
@@ -155,6 +196,80 @@ class FitterStepConfig(FitterStep):
                 outlierLength = -1.0
         self.setGroupSetting(groupName, self._outlierLengthToken, outlierLength)
 
+    def clearGroupOutlierMADFactor(self, groupName):
+        """
+        Clear local group outlier MAD factor so fall back to last config or global default.
+        :param groupName:  Exact model group name, or None for default group.
+        """
+        self.clearGroupSetting(groupName, self._outlierMADFactorToken)
+
+    def getGroupOutlierMADFactor(self, groupName):
+        """
+        Get factor multiplying the median absolute deviation (MAD) of data projection lengths, scaled
+        by 1.4826 to estimate standard deviation, which added to the median length gives the length
+        above which data points are treated as outliers, plus flags indicating where it has been set.
+        Robust to the outliers themselves, unlike the maximum used for negative outlier lengths.
+        If not set or inherited, gets value from default group.
+        :param groupName:  Exact model group name, or None for default group.
+        :return:  Outlier MAD factor, setLocally, inheritable.
+        Factor > 0.0, or 0.0 to disable (default).
+        The second return value is True if the value is set locally to a value
+        or None if reset locally.
+        The third return value is True if a previous config has set the value.
+        """
+        return self.getGroupSetting(groupName, self._outlierMADFactorToken, 0.0)
+
+    def setGroupOutlierMADFactor(self, groupName, outlierMADFactor):
+        """
+        Set factor multiplying the scaled median absolute deviation of data projection lengths, which
+        added to the median length gives the length above which data points are treated as outliers.
+        :param groupName:  Exact model group name, or None for default group.
+        :param outlierMADFactor:  Float factor > 0.0, e.g. 3.0, 0.0 to disable, or None to reset to global
+        default (0.0). Function ensures value is valid.
+        """
+        if outlierMADFactor is not None:
+            if not isinstance(outlierMADFactor, float):
+                outlierMADFactor = self.getGroupOutlierMADFactor(groupName)[0]
+            elif outlierMADFactor < 0.0:
+                outlierMADFactor = 0.0
+        self.setGroupSetting(groupName, self._outlierMADFactorToken, outlierMADFactor)
+
+    def clearGroupOutlierPercentile(self, groupName):
+        """
+        Clear local group outlier percentile so fall back to last config or global default.
+        :param groupName:  Exact model group name, or None for default group.
+        """
+        self.clearGroupSetting(groupName, self._outlierPercentileToken)
+
+    def getGroupOutlierPercentile(self, groupName):
+        """
+        Get percentile of data projection lengths above which data points are treated as outliers
+        and not included in the fit, plus flags indicating where it has been set.
+        e.g. 90.0 excludes data points with the longest 10% of projections.
+        If not set or inherited, gets value from default group.
+        :param groupName:  Exact model group name, or None for default group.
+        :return:  Outlier percentile, setLocally, inheritable.
+        Percentile from > 0.0 to < 100.0, or 0.0 to disable (default).
+        The second return value is True if the value is set locally to a value
+        or None if reset locally.
+        The third return value is True if a previous config has set the value.
+        """
+        return self.getGroupSetting(groupName, self._outlierPercentileToken, 0.0)
+
+    def setGroupOutlierPercentile(self, groupName, outlierPercentile):
+        """
+        Set percentile of data projection lengths above which data points are treated as outliers.
+        :param groupName:  Exact model group name, or None for default group.
+        :param outlierPercentile:  Float percentile from > 0.0 to < 100.0, 0.0 or 100.0 to disable,
+        or None to reset to global default (0.0). Function ensures value is valid.
+        """
+        if outlierPercentile is not None:
+            if not isinstance(outlierPercentile, float):
+                outlierPercentile = self.getGroupOutlierPercentile(groupName)[0]
+            elif (outlierPercentile < 0.0) or (outlierPercentile >= 100.0):
+                outlierPercentile = 0.0
+        self.setGroupSetting(groupName, self._outlierPercentileToken, outlierPercentile)
+
     def clearGroupProjectionSubgroup(self, groupName):
         """
         Clear projection subgroup so fall back to last config or global default.
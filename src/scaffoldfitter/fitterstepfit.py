@@ -7,6 +7,7 @@ from cmlibs.zinc.optimisation import Optimisation
 from cmlibs.zinc.result import RESULT_OK
 from scaffoldfitter.fitterstep import FitterStep
 import sys
+import time
 
 
 class FitterStepFit(FitterStep):
@@ -23,6 +24,17 @@ class FitterStepFit(FitterStep):
         self._numberOfIterations = 1
         self._maximumSubIterations = 1
         self._updateReferenceState = False
+        self._dataProportionSchedule = []
+        self._localRefitErrorThreshold = 0.0
+        self._localRefitNeighbourRings = 1
+        self._inversionGuard = False
+        self._inversionGuardStepReductions = 2
+        self._inversionGuardReducedStepCount = 0
+        self._inversionGuardRolledBack = False
+        self._analyticCurvaturePenalty = False
+        self._smallStrainPenalty = False
+        self._timeBudget = 0.0
+        self._timeBudgetExhausted = False
 
     @classmethod
     def getJsonTypeId(cls):
@@ -39,6 +51,14 @@ class FitterStepFit(FitterStep):
         self._numberOfIterations = dct["numberOfIterations"]
         self._maximumSubIterations = dct["maximumSubIterations"]
         self._updateReferenceState = dct["updateReferenceState"]
+        self._dataProportionSchedule = dct["dataProportionSchedule"]
+        self._localRefitErrorThreshold = dct["localRefitErrorThreshold"]
+        self._localRefitNeighbourRings = dct["localRefitNeighbourRings"]
+        self._inversionGuard = dct["inversionGuard"]
+        self._inversionGuardStepReductions = dct["inversionGuardStepReductions"]
+        self._analyticCurvaturePenalty = dct["analyticCurvaturePenalty"]
+        self._smallStrainPenalty = dct["smallStrainPenalty"]
+        self._timeBudget = dct["timeBudget"]
 
     def encodeSettingsJSONDict(self) -> dict:
         """
@@ -49,7 +69,15 @@ class FitterStepFit(FitterStep):
         dct.update({
             "numberOfIterations": self._numberOfIterations,
             "maximumSubIterations": self._maximumSubIterations,
-            "updateReferenceState": self._updateReferenceState
+            "updateReferenceState": self._updateReferenceState,
+            "dataProportionSchedule": self._dataProportionSchedule,
+            "localRefitErrorThreshold": self._localRefitErrorThreshold,
+            "localRefitNeighbourRings": self._localRefitNeighbourRings,
+            "inversionGuard": self._inversionGuard,
+            "inversionGuardStepReductions": self._inversionGuardStepReductions,
+            "analyticCurvaturePenalty": self._analyticCurvaturePenalty,
+            "smallStrainPenalty": self._smallStrainPenalty,
+            "timeBudget": self._timeBudget
             })
         return dct
 
@@ -314,30 +342,295 @@ class FitterStepFit(FitterStep):
             return True
         return False
 
+    def getDataProportionSchedule(self):
+        """
+        :return: List of proportions of active data used in successive iterations; see setDataProportionSchedule.
+        """
+        return self._dataProportionSchedule
+
+    def setDataProportionSchedule(self, dataProportionSchedule):
+        """
+        Set coarse-to-fine schedule of proportions of active data fitted in successive iterations,
+        e.g. [0.05, 0.2] fits 5% of data in iteration 1, 20% in iteration 2 and all data in later
+        iterations. Subsets are spatially stratified and nested so each contains the previous.
+        All data is always projected after the final iteration.
+        :param dataProportionSchedule: List of float proportions > 0.0 and <= 1.0, or empty list to
+        use all data in every iteration (default).
+        :return: True if schedule changed, otherwise False.
+        """
+        assert isinstance(dataProportionSchedule, list), \
+            "FitterStepFit: setDataProportionSchedule requires a list of float"
+        for proportion in dataProportionSchedule:
+            assert isinstance(proportion, float) and (0.0 < proportion <= 1.0), \
+                "FitterStepFit: setDataProportionSchedule requires float proportions > 0.0 and <= 1.0"
+        if dataProportionSchedule != self._dataProportionSchedule:
+            self._dataProportionSchedule = list(dataProportionSchedule)
+            return True
+        return False
+
+    def getLocalRefitErrorThreshold(self):
+        """
+        :return: Element data RMS error above which local refit is performed, or 0.0 to fit whole model.
+        """
+        return self._localRefitErrorThreshold
+
+    def setLocalRefitErrorThreshold(self, localRefitErrorThreshold):
+        """
+        Set to refit only the model around elements with high errors, for touching up a prior fit.
+        Only nodes of elements of the highest dimension mesh with RMS error of active data located in them
+        exceeding the threshold, plus the local refit neighbour rings, are fitted; objectives are evaluated
+        only over elements using those nodes, and only data located in them is re-projected.
+        :param localRefitErrorThreshold: Float error threshold in units of model coordinates, or 0.0 to
+        fit the whole model (default).
+        :return: True if threshold changed, otherwise False.
+        """
+        assert isinstance(localRefitErrorThreshold, float), \
+            "FitterStepFit: setLocalRefitErrorThreshold requires a float"
+        if localRefitErrorThreshold < 0.0:
+            localRefitErrorThreshold = 0.0
+        if localRefitErrorThreshold != self._localRefitErrorThreshold:
+            self._localRefitErrorThreshold = localRefitErrorThreshold
+            return True
+        return False
+
+    def getLocalRefitNeighbourRings(self):
+        """
+        :return: Number of rings of neighbouring elements also fitted in local refit.
+        """
+        return self._localRefitNeighbourRings
+
+    def setLocalRefitNeighbourRings(self, localRefitNeighbourRings):
+        """
+        :param localRefitNeighbourRings: Number of rings of elements sharing nodes with high error elements
+        to also fit in local refit, >= 0. Default 1.
+        :return: True if number changed, otherwise False.
+        """
+        assert localRefitNeighbourRings >= 0
+        if localRefitNeighbourRings != self._localRefitNeighbourRings:
+            self._localRefitNeighbourRings = localRefitNeighbourRings
+            return True
+        return False
+
+    def isInversionGuard(self):
+        return self._inversionGuard
+
+    def setInversionGuard(self, inversionGuard):
+        """
+        Set whether to check for newly inverted elements after each iteration. If any element in the model fit
+        group which was not inverted before the fit has minimum jacobian <= 0.0, the iteration's parameter
+        change is halved up to the number of step reductions, and if still inverted the model is rolled back
+        to the previous iteration's parameters and the fit stops. See getInversionGuardReducedStepCount() and
+        isInversionGuardRolledBack().
+        :param inversionGuard: True to check for inversion, False to not check (default).
+        :return: True if setting changed, otherwise False.
+        """
+        if inversionGuard != self._inversionGuard:
+            self._inversionGuard = inversionGuard
+            return True
+        return False
+
+    def getInversionGuardStepReductions(self):
+        return self._inversionGuardStepReductions
+
+    def setInversionGuardStepReductions(self, inversionGuardStepReductions):
+        """
+        :param inversionGuardStepReductions: Number of times to halve the iteration's parameter change to
+        remove inversion before rolling back and stopping, >= 0. Default 2.
+        :return: True if number changed, otherwise False.
+        """
+        assert inversionGuardStepReductions >= 0
+        if inversionGuardStepReductions != self._inversionGuardStepReductions:
+            self._inversionGuardStepReductions = inversionGuardStepReductions
+            return True
+        return False
+
+    def getInversionGuardReducedStepCount(self):
+        """
+        :return: Number of iterations in last run whose parameter change was reduced by the inversion guard,
+        including any rolled back iteration.
+        """
+        return self._inversionGuardReducedStepCount
+
+    def isInversionGuardRolledBack(self):
+        """
+        :return: True if last run was stopped by the inversion guard rolling back an iteration.
+        """
+        return self._inversionGuardRolledBack
+
+    def isAnalyticCurvaturePenalty(self):
+        return self._analyticCurvaturePenalty
+
+    def setAnalyticCurvaturePenalty(self, analyticCurvaturePenalty):
+        """
+        Set whether to evaluate the curvature penalty from analytic second derivatives of the model coordinates
+        w.r.t. xi and a precomputed reference curvature basis, instead of the gradient of gradient of the model
+        coordinates w.r.t. reference coordinates. Results are equivalent; the analytic path avoids slow finite
+        difference evaluation of gradients with a fibre field, e.g. for surface meshes in 3-D coordinates.
+        :param analyticCurvaturePenalty: True to use analytic curvature penalty, False for gradient of gradient
+        (default).
+        :return: True if setting changed, otherwise False.
+        """
+        if analyticCurvaturePenalty != self._analyticCurvaturePenalty:
+            self._analyticCurvaturePenalty = analyticCurvaturePenalty
+            return True
+        return False
+
+    def isSmallStrainPenalty(self):
+        return self._smallStrainPenalty
+
+    def setSmallStrainPenalty(self, smallStrainPenalty):
+        """
+        Set whether strain penalty uses linear small strain F + F^T - 2I instead of large strain C - I, where
+        F is the deformation gradient in reference fibre axes. The small strain penalty is quadratic in the
+        model parameters so is cheaper to assemble and converges in one Newton solve, suiting early coarse
+        steps before switching to large strain. It is not invariant to rotation so is only valid for small
+        rotations from the reference state. Terms are scaled to equal C - I for small displacements.
+        :param smallStrainPenalty: True to use small strain penalty, False for large strain (default).
+        :return: True if setting changed, otherwise False.
+        """
+        if smallStrainPenalty != self._smallStrainPenalty:
+            self._smallStrainPenalty = smallStrainPenalty
+            return True
+        return False
+
+    def getTimeBudget(self):
+        return self._timeBudget
+
+    def setTimeBudget(self, timeBudget):
+        """
+        Set maximum wall time for running this step. It is checked between iterations so Newton
+        sub-iterations converge as without a budget; when exhausted the step stops, keeping the parameters
+        from the last completed iteration with data projections recalculated for them. The fitter's run time budget also
+        applies. See isTimeBudgetExhausted().
+        :param timeBudget: Time in seconds > 0.0, or 0.0 for unlimited (default).
+        :return: True if time budget changed, otherwise False.
+        """
+        assert timeBudget >= 0.0
+        if timeBudget != self._timeBudget:
+            self._timeBudget = timeBudget
+            return True
+        return False
+
+    def isTimeBudgetExhausted(self):
+        """
+        :return: True if last run stopped early because this step's or the fitter's time budget was exhausted.
+        """
+        return self._timeBudgetExhausted
+
+    def _applyInversionGuard(self, fieldparameters, previousParameters, guardMeshGroup, invertedElementIdentifiers):
+        """
+        Reduce latest change to model coordinates parameters or roll back if new elements are inverted.
+        Records reduction and roll back for getInversionGuardReducedStepCount(), isInversionGuardRolledBack().
+        :param fieldparameters: Fieldparameters for model coordinates.
+        :param previousParameters: Parameters before latest iteration.
+        :param guardMeshGroup: Mesh group to check for inversion, or None for whole mesh.
+        :param invertedElementIdentifiers: Set of identifiers of elements allowed to be inverted in guardMeshGroup.
+        :return: True if parameters are acceptable, False if rolled back to previousParameters.
+        """
+        fieldmodule = self._fitter.getFieldmodule()
+        parametersCount = len(previousParameters)
+        if self._fitter.getInvertedElementIdentifiers(guardMeshGroup) <= invertedElementIdentifiers:
+            return True
+        self._inversionGuardReducedStepCount += 1
+        result, parameters = fieldparameters.getParameters(parametersCount)
+        assert result == RESULT_OK
+        stepScale = 1.0
+        for reduction in range(self._inversionGuardStepReductions):
+            stepScale *= 0.5
+            if self.getDiagnosticLevel() > 0:
+                print("Inversion guard: elements inverted, reducing step to", stepScale)
+            with ChangeManager(fieldmodule):
+                fieldparameters.setParameters(
+                    [previousValue + stepScale * (value - previousValue)
+                     for value, previousValue in zip(parameters, previousParameters)])
+            self._fitter.notifyModelParametersChanged()
+            if self._fitter.getInvertedElementIdentifiers(guardMeshGroup) <= invertedElementIdentifiers:
+                return True
+        if self.getDiagnosticLevel() > 0:
+            print("Inversion guard: elements inverted, rolling back to previous iteration and stopping")
+        self._inversionGuardRolledBack = True
+        with ChangeManager(fieldmodule):
+            fieldparameters.setParameters(previousParameters)
+        self._fitter.notifyModelParametersChanged()
+        return False
+
+    def _getIterationDataProportion(self, iterationIndex):
+        """
+        :param iterationIndex: Index of iteration from 0.
+        :return: Proportion of active data to fit in iteration, 1.0 for last iteration.
+        """
+        if iterationIndex < min(len(self._dataProportionSchedule), self._numberOfIterations - 1):
+            return self._dataProportionSchedule[iterationIndex]
+        return 1.0
+
     def run(self, modelFileNameStem=None):
         """
         Fit model geometry parameters to data.
         :param modelFileNameStem: Optional name stem of intermediate output file to write.
         """
+        startTime = time.perf_counter()
+        deadline = self._fitter.getDeadline()
+        if self._timeBudget > 0.0:
+            stepDeadline = startTime + self._timeBudget
+            deadline = min(deadline, stepDeadline) if deadline else stepDeadline
+        self._timeBudgetExhausted = False
+        self._inversionGuardReducedStepCount = 0
+        self._inversionGuardRolledBack = False
         self._fitter.assignDataWeights(self)
         deformActiveMeshGroup, strainActiveMeshGroup, curvatureActiveMeshGroup = \
             self._fitter.assignDeformationPenalties(self)
 
         fieldmodule = self._fitter.getFieldmodule()
+        localFitGroup = localObjectiveGroup = localDataNodesetGroup = None
+        if self._localRefitErrorThreshold > 0.0:
+            localFitGroup, localObjectiveGroup = self._fitter.createLocalFitGroups(
+                self._localRefitErrorThreshold, self._localRefitNeighbourRings)
+            if localObjectiveGroup.getMeshGroup(self._fitter.getHighestDimensionMesh()).getSize() == 0:
+                if self.getDiagnosticLevel() > 0:
+                    print("No elements exceed local refit error threshold")
+                self.setHasRun(True)
+                return
+            with ChangeManager(fieldmodule):
+                # penalties only change over elements using refitted nodes
+                notLocalObjectiveGroup = fieldmodule.createFieldNot(localObjectiveGroup)
+                for meshGroup in (deformActiveMeshGroup, strainActiveMeshGroup, curvatureActiveMeshGroup):
+                    meshGroup.removeElementsConditional(notLocalObjectiveGroup)
+                del notLocalObjectiveGroup
+                localDataGroup = fieldmodule.createFieldGroup()
+                localDataNodesetGroup = localDataGroup.createNodesetGroup(
+                    self._fitter.getActiveDataNodesetGroup().getMasterNodeset())
+            self._updateLocalDataNodesetGroup(localObjectiveGroup, localDataNodesetGroup)
+
         optimisation = fieldmodule.createOptimisation()
         optimisation.setMethod(Optimisation.METHOD_NEWTON)
         optimisation.addDependentField(self._fitter.getModelCoordinatesField())
-        if self._fitter.getModelFitGroup():
+        if localFitGroup:
+            conditionalField = localFitGroup
+            if self._fitter.getModelFitGroup():
+                conditionalField = fieldmodule.createFieldAnd(localFitGroup, self._fitter.getModelFitGroup())
+            optimisation.setConditionalField(self._fitter.getModelCoordinatesField(), conditionalField)
+        elif self._fitter.getModelFitGroup():
             optimisation.setConditionalField(self._fitter.getModelCoordinatesField(), self._fitter.getModelFitGroup())
         optimisation.setAttributeInteger(Optimisation.ATTRIBUTE_MAXIMUM_ITERATIONS, self._maximumSubIterations)
 
         deformationPenaltyObjective = None
         with ChangeManager(fieldmodule):
-            dataObjective = self.createDataObjectiveField()
+            # reuse objective fields from earlier steps with the same structure; the local data group is temporary
+            if localDataNodesetGroup:
+                dataObjective = self.createDataObjectiveField(localDataNodesetGroup)
+            else:
+                dataObjective = self._fitter.getObjectiveField(("data",), self.createDataObjectiveField)
             result = optimisation.addObjectiveField(dataObjective)
             assert result == RESULT_OK, "Fit Geometry:  Could not add data objective field"
-            deformationPenaltyObjective = self.createDeformationPenaltyObjectiveField(
-                deformActiveMeshGroup, strainActiveMeshGroup, curvatureActiveMeshGroup)
+            if deformActiveMeshGroup.getSize() > 0:
+                # ensure reference fields are current before finding objective using them
+                self._fitter.getReferenceDeformationFields(
+                    curvatureBasis=self._analyticCurvaturePenalty and (curvatureActiveMeshGroup.getSize() > 0))
+            deformationPenaltyObjective = self._fitter.getObjectiveField(
+                ("deformation", deformActiveMeshGroup.getSize() > 0, strainActiveMeshGroup.getSize() > 0,
+                 curvatureActiveMeshGroup.getSize() > 0, self._smallStrainPenalty, self._analyticCurvaturePenalty),
+                lambda: self.createDeformationPenaltyObjectiveField(
+                    deformActiveMeshGroup, strainActiveMeshGroup, curvatureActiveMeshGroup))
             if deformationPenaltyObjective:
                 result = optimisation.addObjectiveField(deformationPenaltyObjective)
                 assert result == RESULT_OK, "Fit Geometry:  Could not add strain/curvature penalty objective field"
@@ -347,43 +640,87 @@ class FitterStepFit(FitterStep):
                 assert result == RESULT_OK, "Fit Geometry:  Could not add flatten group objective field"
 
         fieldcache = fieldmodule.createFieldcache()
-        objectiveFormat = "{:12e}"
+        diagnosticObjectives = None
+        if (self.getDiagnosticLevel() > 0) or self._fitter.getProgressCallback():
+            diagnosticObjectives = self._getDiagnosticObjectives(
+                dataObjective, deformationPenaltyObjective, flattenGroupObjective)
+        writeDelta = modelFileNameStem and self._fitter.isIntermediateOutputDelta()
+        if writeDelta:
+            self._fitter.startModelDelta(modelFileNameStem + "_fit.exfdelta")
+        dataProportion = self._getIterationDataProportion(0)
+        if dataProportion < 1.0:
+            self._fitter.calculateDataProjections(self, dataProportion, localObjectiveGroup)
+            if localDataNodesetGroup:
+                self._updateLocalDataNodesetGroup(localObjectiveGroup, localDataNodesetGroup)
+        if self._inversionGuard:
+            guardMeshGroup = None
+            if self._fitter.getModelFitGroup():
+                guardMeshGroup = self._fitter.getModelFitGroup().getMeshGroup(self._fitter.getHighestDimensionMesh())
+            # only guard against elements inverted by this fit
+            invertedElementIdentifiers = self._fitter.getInvertedElementIdentifiers(guardMeshGroup)
+            fieldparameters = self._fitter.getModelCoordinatesField().getFieldparameters()
+            parametersCount = fieldparameters.getNumberOfParameters()
+        # the Newton optimiser does not report objective values, so each term is evaluated as a separate integral
+        # before the first iteration and after each iteration, shared by diagnostics and progress events
+        objectiveValues = self._evaluateDiagnosticObjectives(diagnosticObjectives, fieldcache)
         for iterationIndex in range(self._numberOfIterations):
+            self._fitter.checkCancelled()
+            if deadline and (time.perf_counter() >= deadline):
+                self._timeBudgetExhausted = True
+                if dataProportion < 1.0:
+                    self._fitter.calculateDataProjections(self, 1.0, localObjectiveGroup)
+                    objectiveValues = self._evaluateDiagnosticObjectives(diagnosticObjectives, fieldcache)
+                break
             iterName = str(iterationIndex + 1)
             if self.getDiagnosticLevel() > 0:
                 print("-------- Iteration " + iterName)
-            if self.getDiagnosticLevel() > 0:
-                result, objective = dataObjective.evaluateReal(fieldcache, 1)
-                print("    Data objective", objectiveFormat.format(objective))
-                if deformationPenaltyObjective:
-                    result, objective = deformationPenaltyObjective.evaluateReal(
-                        fieldcache, deformationPenaltyObjective.getNumberOfComponents())
-                    print("    Deformation penalty objective", objectiveFormat.format(objective))
-                if flattenGroupObjective:
-                    result, objective = flattenGroupObjective.evaluateReal(
-                        fieldcache, flattenGroupObjective.getNumberOfComponents())
-                    print("    Flatten group objective", objectiveFormat.format(objective))
+                self._printDiagnosticObjective(objectiveValues, "    ")
+            progressInfo = {"iteration": iterationIndex + 1, "iterationCount": self._numberOfIterations}
+            self._fitter.notifyProgress("iterationStart", dict(progressInfo, objectives=objectiveValues))
+            if self._inversionGuard:
+                result, previousParameters = fieldparameters.getParameters(parametersCount)
+                assert result == RESULT_OK
             result = optimisation.optimise()
+            self._fitter.notifyModelParametersChanged()
             if self.getDiagnosticLevel() > 1:
                 solutionReport = optimisation.getSolutionReport()
                 print(solutionReport)
             assert result == RESULT_OK, "Fit Geometry:  Optimisation failed with result " + str(result)
-            self._fitter.calculateDataProjections(self)
-            if modelFileNameStem:
-                self._fitter.writeModel(modelFileNameStem + "_fit" + iterName + ".exf")
+            if deadline and (time.perf_counter() >= deadline):
+                self._timeBudgetExhausted = True
+            inverted = self._inversionGuard and not self._applyInversionGuard(
+                fieldparameters, previousParameters, guardMeshGroup, invertedElementIdentifiers)
+            if inverted:
+                # projections are for restored parameters unless data proportion was reduced
+                if dataProportion < 1.0:
+                    self._fitter.calculateDataProjections(self, 1.0, localObjectiveGroup)
+            else:
+                # project all data if stopping early as time budget is exhausted
+                dataProportion = \
+                    1.0 if self._timeBudgetExhausted else self._getIterationDataProportion(iterationIndex + 1)
+                self._fitter.calculateDataProjections(self, dataProportion, localObjectiveGroup)
+                if localDataNodesetGroup:
+                    self._updateLocalDataNodesetGroup(localObjectiveGroup, localDataNodesetGroup)
+                if writeDelta:
+                    self._fitter.writeModelDeltaInBackground(iterationIndex + 1)
+                elif modelFileNameStem:
+                    self._fitter.writeModelInBackground(modelFileNameStem + "_fit" + iterName + ".exf")
+            objectiveValues = self._evaluateDiagnosticObjectives(diagnosticObjectives, fieldcache)
+            self._fitter.notifyProgress("iterationEnd", dict(progressInfo, objectives=objectiveValues))
+            if inverted or self._timeBudgetExhausted:
+                break
+
+        if self._timeBudgetExhausted and (self.getDiagnosticLevel() > 0):
+            rmsError, maxError = self._fitter.getDataRMSAndMaximumProjectionError()
+            print("Time budget exhausted after " + "{:.3f}".format(time.perf_counter() - startTime) +
+                  " s; data projection RMS error " + str(rmsError) + " Max error " + str(maxError))
+
+        if modelFileNameStem:
+            self._fitter.flushFileWrites()
 
         if self.getDiagnosticLevel() > 0:
             print("--------")
-            result, objective = dataObjective.evaluateReal(fieldcache, 1)
-            print("    END Data objective", objectiveFormat.format(objective))
-            if deformationPenaltyObjective:
-                result, objective = deformationPenaltyObjective.evaluateReal(
-                    fieldcache, deformationPenaltyObjective.getNumberOfComponents())
-                print("    END Deformation penalty objective", objectiveFormat.format(objective))
-            if flattenGroupObjective:
-                result, objective = flattenGroupObjective.evaluateReal(
-                    fieldcache, flattenGroupObjective.getNumberOfComponents())
-                print("    Flatten group objective", objectiveFormat.format(objective))
+            self._printDiagnosticObjective(objectiveValues, "    END ")
             if self.getDiagnosticLevel() > 1:
                 self._fitter.print_log()
 
@@ -392,10 +729,67 @@ class FitterStepFit(FitterStep):
 
         self.setHasRun(True)
 
-    def createDataObjectiveField(self):
+    def _getDiagnosticObjectives(self, dataObjective, deformationPenaltyObjective, flattenGroupObjective):
+        """
+        Get objective terms to report for diagnostics and progress, since the Newton optimiser does not report them.
+        :param dataObjective: Data objective field.
+        :param deformationPenaltyObjective: Deformation penalty objective field or None.
+        :param flattenGroupObjective: Flatten group objective field or None.
+        :return: list of (name, objective field).
+        """
+        return [(name, objective) for objective, name in (
+            (dataObjective, "Data objective"),
+            (deformationPenaltyObjective, "Deformation penalty objective"),
+            (flattenGroupObjective, "Flatten group objective")) if objective]
+
+    def _evaluateDiagnosticObjectives(self, diagnosticObjectives, fieldcache):
+        """
+        Evaluate all objective terms.
+        :param diagnosticObjectives: List of (name, objective field) from _getDiagnosticObjectives, or None if
+        not reporting objectives.
+        :param fieldcache: Zinc Fieldcache to evaluate with.
+        :return: dict objective name -> value, or None if not evaluated or failed.
+        """
+        if not diagnosticObjectives:
+            return None
+        objectiveValues = {}
+        for name, objective in diagnosticObjectives:
+            result, objectiveValues[name] = objective.evaluateReal(fieldcache, 1)
+            if result != RESULT_OK:
+                return None
+        return objectiveValues
+
+    def _printDiagnosticObjective(self, objectiveValues, prefix):
+        """
+        Print all objective terms.
+        :param objectiveValues: dict objective name -> value from _evaluateDiagnosticObjectives.
+        :param prefix: String to print before each objective name.
+        """
+        if objectiveValues is None:
+            print(prefix + "Failed to evaluate objective")
+            return
+        for name, value in objectiveValues.items():
+            print(prefix + name, "{:12e}".format(value))
+
+    def _updateLocalDataNodesetGroup(self, localObjectiveGroup, localDataNodesetGroup):
+        """
+        Fill nodeset group with active data and marker points located in elements of local objective group.
+        :param localObjectiveGroup: FieldGroup containing elements over which local refit objectives apply.
+        :param localDataNodesetGroup: Data NodesetGroup to fill.
+        """
+        fieldmodule = self._fitter.getFieldmodule()
+        with ChangeManager(fieldmodule):
+            localDataNodesetGroup.removeAllNodes()
+            activeDataNodesetGroup = self._fitter.getActiveDataNodesetGroup()
+            localDataNodesetGroup.addNodesConditional(fieldmodule.createFieldAnd(
+                activeDataNodesetGroup.getFieldGroup(),
+                fieldmodule.createFieldEmbedded(localObjectiveGroup, self._fitter.getDataHostLocationField())))
+
+    def createDataObjectiveField(self, dataNodesetGroup=None):
         """
         Get FieldNodesetSum objective for data projected onto mesh, including markers with fixed locations.
         Assumes ChangeManager(fieldmodule) is in effect.
+        :param dataNodesetGroup: Optional data NodesetGroup to sum over instead of all active data.
         :return: Zinc FieldNodesetSum.
         """
         fieldmodule = self._fitter.getFieldmodule()
@@ -411,7 +805,7 @@ class FitterStepFit(FitterStep):
         deltaSq = fieldmodule.createFieldMultiply(orientedDelta, orientedDelta)
         weightedDeltaSq = fieldmodule.createFieldDotProduct(weight, deltaSq)
         dataProjectionObjective = fieldmodule.createFieldNodesetSum(
-            weightedDeltaSq, self._fitter.getActiveDataNodesetGroup())
+            weightedDeltaSq, dataNodesetGroup if dataNodesetGroup else self._fitter.getActiveDataNodesetGroup())
         dataProjectionObjective.setElementMapField(self._fitter.getDataHostLocationField())
         return dataProjectionObjective
 
@@ -441,44 +835,81 @@ class FitterStepFit(FitterStep):
         coordinatesCount = modelCoordinates.getNumberOfComponents()
         assert (coordinatesCount == dimension) or fibreField, \
             "Must supply a fibre field to use strain/curvature penalties with mesh dimension < coordinate components."
-        deformationGradient1 = deformationGradient1raw = fieldmodule.createFieldGradient(
-            modelCoordinates, modelReferenceCoordinates)
-        fibreAxes = None
-        fibreAxesT = None
-        if fibreField:
-            # convert to local fibre directions, with possible dimension reduction for 2D, 1D
-            fibreAxes = fieldmodule.createFieldFibreAxes(fibreField, modelReferenceCoordinates)
-            if not fibreAxes.isValid():
-                self.getFitter().print_log()
-            if dimension == 3:
-                fibreAxesT = fieldmodule.createFieldTranspose(3, fibreAxes)
-            elif dimension == 2:
-                fibreAxesT = fieldmodule.createFieldComponent(
-                    fibreAxes, [1, 4, 2, 5, 3, 6] if (coordinatesCount == 3) else [1, 4, 2, 5])
-            else:  # dimension == 1
-                fibreAxesT = fieldmodule.createFieldComponent(
-                    fibreAxes, [1, 2, 3] if (coordinatesCount == 3) else [1, 2] if (coordinatesCount == 2) else [1])
+        # reference state fibre axes, inverse jacobian and integration weights are precomputed at Gauss points
+        referenceFields = self._fitter.getReferenceDeformationFields(
+            numberOfGaussPoints, self._analyticCurvaturePenalty and applyCurvaturePenalty)
+        if referenceFields:
+            referenceBasis, fibreAxesT, referenceWeight, referenceCurvatureBasis = referenceFields
+        else:
+            # unsupported element shapes: evaluate reference state at each Gauss point
+            referenceBasis = referenceWeight = referenceCurvatureBasis = None
+            fibreAxesT = None
+            if fibreField:
+                # convert to local fibre directions, with possible dimension reduction for 2D, 1D
+                fibreAxes = fieldmodule.createFieldFibreAxes(fibreField, modelReferenceCoordinates)
+                if not fibreAxes.isValid():
+                    self.getFitter().print_log()
+                if dimension == 3:
+                    fibreAxesT = fieldmodule.createFieldTranspose(3, fibreAxes)
+                elif dimension == 2:
+                    fibreAxesT = fieldmodule.createFieldComponent(
+                        fibreAxes, [1, 4, 2, 5, 3, 6] if (coordinatesCount == 3) else [1, 4, 2, 5])
+                else:  # dimension == 1
+                    fibreAxesT = fieldmodule.createFieldComponent(
+                        fibreAxes, [1, 2, 3] if (coordinatesCount == 3) else [1, 2] if (coordinatesCount == 2) else [1])
+        analyticCurvaturePenalty = self._analyticCurvaturePenalty and (referenceCurvatureBasis is not None)
         deformationTerm = None
+        dxdxiT = fieldmodule.createFieldConcatenate(
+            [fieldmodule.createFieldDerivative(modelCoordinates, d + 1) for d in range(dimension)])
         if applyStrainPenalty:
             # large strain
-            if fibreField:
-                deformationGradient1 = fieldmodule.createFieldMatrixMultiply(
-                    coordinatesCount, deformationGradient1raw, fibreAxesT)
-            deformationGradient1T = fieldmodule.createFieldTranspose(coordinatesCount, deformationGradient1)
-            C = fieldmodule.createFieldMatrixMultiply(dimension, deformationGradient1T, deformationGradient1)
+            if referenceBasis:
+                # deformation gradient in fibre axes is dx/dxi . dxi/dX . fibreAxesT = dx/dxi . referenceBasis
+                dxdxi = fieldmodule.createFieldTranspose(dimension, dxdxiT)
+                deformationGradient1 = fieldmodule.createFieldMatrixMultiply(coordinatesCount, dxdxi, referenceBasis)
+            else:
+                deformationGradient1 = fieldmodule.createFieldGradient(modelCoordinates, modelReferenceCoordinates)
+                if fibreAxesT:
+                    deformationGradient1 = fieldmodule.createFieldMatrixMultiply(
+                        coordinatesCount, deformationGradient1, fibreAxesT)
             alpha = self._fitter.getStrainPenaltyField()
             I = fieldmodule.createFieldConstant(
                 [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0] if (dimension == 3) else
                 [1.0, 0.0, 0.0, 1.0] if (dimension == 2) else
                 [1.0])
-            E2 = C - I
+            if self._smallStrainPenalty:
+                # linear small strain: symmetric part of F in reference fibre axes, doubled to match C - I
+                if fibreAxesT:
+                    fibreAxes = fieldmodule.createFieldTranspose(coordinatesCount, fibreAxesT)
+                    deformationGradient1 = fieldmodule.createFieldMatrixMultiply(
+                        dimension, fibreAxes, deformationGradient1)
+                deformationGradient1T = fieldmodule.createFieldTranspose(dimension, deformationGradient1)
+                E2 = deformationGradient1 + deformationGradient1T - I - I
+            else:
+                deformationGradient1T = fieldmodule.createFieldTranspose(coordinatesCount, deformationGradient1)
+                C = fieldmodule.createFieldMatrixMultiply(dimension, deformationGradient1T, deformationGradient1)
+                E2 = C - I
             wtSqE2 = fieldmodule.createFieldDotProduct(alpha, E2 * E2)
             deformationTerm = wtSqE2
         if applyCurvaturePenalty:
             # second order Sobolev smoothing terms
-            # don't do gradient of deformationGradient1 with fibres due to slow finite difference evaluation
-            deformationGradient2 = fieldmodule.createFieldGradient(deformationGradient1raw, modelReferenceCoordinates)
-            if fibreField:
+            if analyticCurvaturePenalty:
+                # second derivatives w.r.t. fibre axes from analytic derivatives w.r.t. xi and reference curvature
+                # basis, transposed to same component order as gradient of gradient
+                d2xdxi2T = fieldmodule.createFieldConcatenate(
+                    [fieldmodule.createFieldDerivative(
+                        fieldmodule.createFieldDerivative(modelCoordinates, i + 1), j + 1)
+                     for i in range(dimension) for j in range(dimension)])
+                deformationGradient2T = fieldmodule.createFieldMatrixMultiply(
+                    dimension * dimension, referenceCurvatureBasis,
+                    fieldmodule.createFieldConcatenate([d2xdxi2T, dxdxiT]))
+                deformationGradient2 = fieldmodule.createFieldTranspose(dimension * dimension, deformationGradient2T)
+            else:
+                # don't do gradient of deformationGradient1 with fibres due to slow finite difference evaluation
+                deformationGradient1raw = fieldmodule.createFieldGradient(modelCoordinates, modelReferenceCoordinates)
+                deformationGradient2 = fieldmodule.createFieldGradient(
+                    deformationGradient1raw, modelReferenceCoordinates)
+            if fibreField and not analyticCurvaturePenalty:
                 # convert to local fibre directions
                 deformationGradient2a = fieldmodule.createFieldMatrixMultiply(
                     coordinatesCount*coordinatesCount, deformationGradient2, fibreAxesT)
@@ -509,14 +940,20 @@ class FitterStepFit(FitterStep):
                 self.getFitter().print_log()
                 raise AssertionError("Scaffoldfitter: Failed to get deformation term")
 
-        deformationPenaltyObjective = fieldmodule.createFieldMeshIntegral(
-            deformationTerm, self._fitter.getModelReferenceCoordinatesField(), deformActiveMeshGroup)
+        if referenceWeight:
+            # integrate over xi with precomputed reference volume/area/length element
+            deformationPenaltyObjective = fieldmodule.createFieldMeshIntegral(
+                deformationTerm * referenceWeight, fieldmodule.findFieldByName("xi"), deformActiveMeshGroup)
+        else:
+            deformationPenaltyObjective = fieldmodule.createFieldMeshIntegral(
+                deformationTerm, modelReferenceCoordinates, deformActiveMeshGroup)
         deformationPenaltyObjective.setNumbersOfPoints(numberOfGaussPoints)
         return deformationPenaltyObjective
 
     def createFlattenGroupObjectiveField(self):
         """
-        Get flatten group penalty mesh integral field, if any.
+        Get flatten group penalty mesh integral field, if any. Assigns this step's flatten group weight and
+        reuses the field cached by the fitter if already created for the same group and mesh dimension.
         Assumes ChangeManager(fieldmodule) is in effect.
         :return: Zinc FieldMeshIntegral, or None if not applied.
         """
@@ -541,13 +978,22 @@ class FitterStepFit(FitterStep):
             return None
 
         fieldmodule = self._fitter.getFieldmodule()
-        modelCoordinates = self._fitter.getModelCoordinatesField()
-        flattenComponent = fieldmodule.createFieldComponent(modelCoordinates, modelCoordinates.getNumberOfComponents())
-        flattenWeight = fieldmodule.createFieldConstant([weight])
-        flattenComponentWeighted = flattenWeight * flattenComponent
-        flattenIntegrand = flattenComponentWeighted * flattenComponentWeighted
-        numberOfGaussPoints = 3  # assuming some data applied around edges
-        flattenGroupObjective = fieldmodule.createFieldMeshIntegral(
-            flattenIntegrand, self._fitter.getModelReferenceCoordinatesField(), flattenMeshGroup)
-        flattenGroupObjective.setNumbersOfPoints(numberOfGaussPoints)
-        return flattenGroupObjective
+        flattenWeight = self._fitter.getFlattenWeightField()
+        fieldcache = fieldmodule.createFieldcache()
+        flattenWeight.assignReal(fieldcache, [weight])
+
+        def createFlattenGroupObjective():
+            modelCoordinates = self._fitter.getModelCoordinatesField()
+            flattenComponent = fieldmodule.createFieldComponent(
+                modelCoordinates, modelCoordinates.getNumberOfComponents())
+            flattenComponentWeighted = flattenWeight * flattenComponent
+            flattenIntegrand = flattenComponentWeighted * flattenComponentWeighted
+            numberOfGaussPoints = 3  # assuming some data applied around edges
+            flattenGroupObjective = fieldmodule.createFieldMeshIntegral(
+                flattenIntegrand, self._fitter.getModelReferenceCoordinatesField(), flattenMeshGroup)
+            flattenGroupObjective.setNumbersOfPoints(numberOfGaussPoints)
+            return flattenGroupObjective
+
+        return self._fitter.getObjectiveField(
+            ("flatten", flattenGroupName, flattenMeshGroup.getMasterMesh().getDimension()),
+            createFlattenGroupObjective)
@@ -0,0 +1,200 @@
+"""
+Parameter sweep over FitterStepFit group settings for tuning penalties and data weights.
+Alignment and config steps before the first fit step are run once, and their result is shared by all
+configurations, whose fits are run in parallel over a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import math
+import multiprocessing
+import random
+import time
+
+from cmlibs.zinc.result import RESULT_OK
+from scaffoldfitter.fitter import Fitter
+from scaffoldfitter.fitterjson import decodeJSONFitterSteps
+from scaffoldfitter.fitterstepfit import FitterStepFit
+
+
+_listSettingNames = ("strainPenalty", "curvaturePenalty")
+
+
+def _getCheckpointStepIndex(fitter):
+    """
+    :return: Index of last fitter step before the first FitterStepFit.
+    """
+    for index, fitterStep in enumerate(fitter.getFitterSteps()):
+        if isinstance(fitterStep, FitterStepFit):
+            return index - 1
+    return len(fitter.getFitterSteps()) - 1
+
+
+def _loadFitter(zincModelFileName, zincDataFileName, settingsJSON):
+    fitter = Fitter(zincModelFileName, zincDataFileName)
+    fitter.decodeSettingsJSON(settingsJSON, decodeJSONFitterSteps)
+    fitter.load()
+    return fitter
+
+
+def _runSweepConfiguration(zincModelFileName, zincDataFileName, settingsJSON, checkpointParameters, overrides):
+    """
+    Load fitter, restore model to checkpoint after alignment and config, apply group setting overrides to
+    all fit steps and run them. Module function so it can be run in a worker process.
+    :return: dict of results for configuration.
+    """
+    startTime = time.perf_counter()
+    fitter = _loadFitter(zincModelFileName, zincDataFileName, settingsJSON)
+    fitterSteps = fitter.getFitterSteps()
+    checkpointStepIndex = _getCheckpointStepIndex(fitter)
+    fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+    # note: must get number of parameters before they can be set
+    assert fieldparameters.getNumberOfParameters() == len(checkpointParameters), \
+        "FitterSweep:  Checkpoint parameters do not match model"
+    result = fieldparameters.setParameters(checkpointParameters)
+    assert result == RESULT_OK, "FitterSweep:  Failed to restore checkpoint parameters"
+    fitter.notifyModelParametersChanged()
+    fitter.updateModelReferenceCoordinates()
+    for fitterStep in fitterSteps[1:checkpointStepIndex + 1]:
+        fitterStep.setHasRun(True)
+    fitter.calculateDataProjections(fitterSteps[checkpointStepIndex])
+    for fitterStep in fitterSteps[checkpointStepIndex + 1:]:
+        if isinstance(fitterStep, FitterStepFit):
+            for (groupName, settingName), value in overrides.items():
+                setter = getattr(fitterStep, "setGroup" + settingName[0].upper() + settingName[1:])
+                setter(groupName, value)
+    fitter.run()
+    rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+    minimumJacobianElementIdentifier, minimumJacobian = fitter.getLowestElementJacobian()
+    fitter.cleanup()
+    return {
+        "rmsError": rmsError,
+        "maxError": maxError,
+        "minimumJacobian": minimumJacobian,
+        "minimumJacobianElement": minimumJacobianElementIdentifier,
+        "time": time.perf_counter() - startTime
+    }
+
+
+class FitterSweep:
+    """
+    Runs fits for a set of configurations overriding FitterStepFit group settings in base settings, and
+    tabulates data errors, minimum jacobian and timing for each.
+    """
+
+    def __init__(self, zincModelFileName: str, zincDataFileName: str, settingsJSON: str):
+        """
+        :param zincModelFileName: Name of zinc file supplying model to fit.
+        :param zincDataFileName: Name of zinc file supplying data to fit to.
+        :param settingsJSON: Base Fitter settings JSON as output by Fitter.encodeSettingsJSON(), containing
+        at least one FitterStepFit.
+        """
+        self._zincModelFileName = zincModelFileName
+        self._zincDataFileName = zincDataFileName
+        self._settingsJSON = settingsJSON
+        self._configurations = []  # list of dict (group name or None, setting name) -> value
+        self._results = []
+
+    def getConfigurations(self):
+        """
+        :return: List of dicts mapping (group name or None for default group, setting name) to override value.
+        """
+        return self._configurations
+
+    def addConfiguration(self, overrides: dict):
+        """
+        Add a configuration overriding group settings in all FitterStepFit steps.
+        :param overrides: dict mapping (group name or None for default group, setting name) to value, where
+        setting name is one of dataWeight, dataSlidingFactor, dataStretch, strainPenalty or curvaturePenalty,
+        with value as for the corresponding FitterStepFit.setGroup~ method.
+        """
+        self._configurations.append(dict(overrides))
+
+    def addGridConfigurations(self, grid: dict):
+        """
+        Add configurations for all combinations of values.
+        :param grid: dict mapping (group name or None, setting name) to list of values to try.
+        """
+        keys = list(grid.keys())
+        for values in itertools.product(*(grid[key] for key in keys)):
+            self.addConfiguration(dict(zip(keys, values)))
+
+    def addRandomConfigurations(self, ranges: dict, count, seed=None, logarithmic=True):
+        """
+        Add configurations with values sampled uniformly in ranges.
+        :param ranges: dict mapping (group name or None, setting name) to (minimum, maximum) value.
+        Penalty values are applied to all components.
+        :param count: Number of configurations to add.
+        :param seed: Optional seed for repeatable sampling.
+        :param logarithmic: If True sample uniformly in log of value, suiting penalties and weights spanning
+        orders of magnitude; minimum must be > 0.0.
+        """
+        generator = random.Random(seed)
+        for i in range(count):
+            overrides = {}
+            for key, (minimum, maximum) in ranges.items():
+                if logarithmic:
+                    assert minimum > 0.0, "FitterSweep:  Minimum must be positive for logarithmic sampling"
+                    value = math.exp(generator.uniform(math.log(minimum), math.log(maximum)))
+                else:
+                    value = generator.uniform(minimum, maximum)
+                overrides[key] = [value] if (key[1] in _listSettingNames) else value
+            self.addConfiguration(overrides)
+
+    def run(self, processCount=None):
+        """
+        Run alignment and config steps up to first fit step once, then fit all configurations from there.
+        :param processCount: Number of worker processes, or None for number of CPUs. If 1, configurations are
+        run in this process.
+        :return: List of results dicts for each configuration, in order added, with keys overrides, rmsError,
+        maxError, minimumJacobian, minimumJacobianElement and time in seconds for loading and fitting.
+        """
+        fitter = _loadFitter(self._zincModelFileName, self._zincDataFileName, self._settingsJSON)
+        checkpointStepIndex = _getCheckpointStepIndex(fitter)
+        assert checkpointStepIndex < (len(fitter.getFitterSteps()) - 1), "FitterSweep:  No fit steps to sweep"
+        fitter.run(fitter.getFitterSteps()[checkpointStepIndex])
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        result, checkpointParameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+        assert result == RESULT_OK, "FitterSweep:  Failed to get checkpoint parameters"
+        fitter.cleanup()
+        args = [(self._zincModelFileName, self._zincDataFileName, self._settingsJSON, checkpointParameters, overrides)
+                for overrides in self._configurations]
+        if processCount == 1:
+            results = [_runSweepConfiguration(*arg) for arg in args]
+        else:
+            # spawn fresh workers as forking a process holding Zinc objects and threads is unsafe
+            with ProcessPoolExecutor(max_workers=processCount,
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(_runSweepConfiguration, *zip(*args)))
+        self._results = []
+        for overrides, result in zip(self._configurations, results):
+            result["overrides"] = overrides
+            self._results.append(result)
+        return self._results
+
+    def getResults(self):
+        """
+        :return: Results from last run, see run().
+        """
+        return self._results
+
+    def writeResults(self, fileName):
+        """
+        Write table of results from last run to CSV file, with a column for each override setting.
+        :param fileName: Name of CSV file to write.
+        """
+        keys = []
+        for overrides in self._configurations:
+            for key in overrides:
+                if key not in keys:
+                    keys.append(key)
+        with open(fileName, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["configuration"] + [(groupName if groupName else "default") + " " + settingName
+                                                 for groupName, settingName in keys] +
+                            ["rms error", "max error", "minimum jacobian", "minimum jacobian element", "time"])
+            for index, result in enumerate(self._results):
+                overrides = result["overrides"]
+                writer.writerow([index + 1] + [overrides.get(key, "") for key in keys] +
+                                [result["rmsError"], result["maxError"], result["minimumJacobian"],
+                                 result["minimumJacobianElement"], result["time"]])
@@ -0,0 +1,125 @@
+"""
+Background writer and compression utilities for fitter output files.
+"""
+import gzip
+import queue
+import threading
+
+
+_gzipMagic = b"\x1f\x8b"
+_zstdMagic = b"\x28\xb5\x2f\xfd"
+
+
+def _getZstdModule():
+    """
+    :return: Module providing zstd compress/decompress functions. Raises ImportError if not installed.
+    """
+    try:
+        from compression import zstd  # Python >= 3.14
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package or Python >= 3.14")
+    return zstd
+
+
+def compressBuffer(buffer, compression=None):
+    """
+    Compress buffer with the named compression.
+    :param buffer: Bytes to compress.
+    :param compression: None for no compression, "gzip" or "zstd". Note "zstd" requires the zstandard
+    package if Python < 3.14.
+    :return: Compressed bytes.
+    """
+    if compression is None:
+        return buffer
+    if compression == "gzip":
+        return gzip.compress(buffer, compresslevel=6)
+    if compression == "zstd":
+        return _getZstdModule().compress(buffer)
+    raise ValueError("Unsupported compression '" + str(compression) + "'")
+
+
+def decompressBuffer(buffer):
+    """
+    Decompress buffer, detecting gzip or zstd compression from its header.
+    :param buffer: Bytes to decompress.
+    :return: Uncompressed bytes; buffer is returned unchanged if not compressed.
+    """
+    if buffer[:2] == _gzipMagic:
+        return gzip.decompress(buffer)
+    if buffer[:4] == _zstdMagic:
+        return _getZstdModule().decompress(buffer)
+    return buffer
+
+
+class FitterFileWriter:
+    """
+    Writes in-memory buffers to files on a background thread so the fit does not wait for disk I/O.
+    Uses a bounded queue so producers block if writes fall too far behind.
+    """
+
+    def __init__(self, maximumQueueSize=4):
+        """
+        :param maximumQueueSize: Maximum number of buffers waiting to be written before write() blocks.
+        """
+        assert maximumQueueSize > 0
+        self._queue = queue.Queue(maxsize=maximumQueueSize)
+        self._thread = None
+        self._error = None
+
+    def write(self, fileName, buffer, append=False, compression=None):
+        """
+        Queue buffer for writing to file. Blocks while queue is full.
+        :param fileName: Name of file to write.
+        :param buffer: Bytes to write.
+        :param append: Set to True to append to file, otherwise file is overwritten.
+        :param compression: Optional compression to apply on the writer thread; see compressBuffer().
+        """
+        self._raiseError()
+        if not (self._thread and self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name="FitterFileWriter", daemon=True)
+            self._thread.start()
+        self._queue.put((fileName, buffer, append, compression))
+
+    def flush(self):
+        """
+        Wait until all queued buffers have been written.
+        Re-raises the first error encountered while writing, if any.
+        """
+        if self._thread:
+            self._queue.join()
+        self._raiseError()
+
+    def close(self):
+        """
+        Flush remaining buffers and stop the writer thread.
+        """
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+        self._raiseError()
+
+    def _raiseError(self):
+        error = self._error
+        if error:
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                fileName, buffer, append, compression = item
+                if not self._error:
+                    buffer = compressBuffer(buffer, compression)
+                    with open(fileName, "ab" if append else "wb") as f:
+                        f.write(buffer)
+            except (OSError, ImportError, ValueError) as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
@@ -1,10 +1,17 @@
 import logging
 import os
 import sys
+import tempfile
 import unittest
-from cmlibs.utils.zinc.field import createFieldMeshIntegral
+from cmlibs.utils.zinc.field import createFieldMeshIntegral, find_or_create_field_coordinates
+from cmlibs.utils.zinc.general import ChangeManager
+from cmlibs.zinc.context import Context
+from cmlibs.zinc.element import Element, Elementbasis
+from cmlibs.zinc.field import Field, FieldGroup
+from cmlibs.zinc.node import Node
 from cmlibs.zinc.result import RESULT_OK
 from scaffoldfitter.fitter import Fitter
+from scaffoldfitter.fitterstepconfig import FitterStepConfig
 from scaffoldfitter.fitterstepfit import FitterStepFit
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -64,6 +71,149 @@ class Fit2dTestCase(unittest.TestCase):
         self.assertEqual(result, RESULT_OK)
         self.assertAlmostEqual(surfaceArea, 104501.36293993103, delta=1.0E-1)
 
+        # reference state fields are cached until reference coordinates change
+        referenceFields = fitter.getReferenceDeformationFields()
+        basis, fibreAxes, weight, curvatureBasis = referenceFields
+        self.assertEqual(4, basis.getNumberOfComponents())
+        self.assertEqual(6, fibreAxes.getNumberOfComponents())
+        self.assertEqual(1, weight.getNumberOfComponents())
+        # curvature basis is only calculated for analytic curvature penalty
+        self.assertIsNone(curvatureBasis)
+        self.assertIs(referenceFields, fitter.getReferenceDeformationFields())
+        referenceAreaField = createFieldMeshIntegral(
+            fitter.getModelReferenceCoordinatesField(), fitter.getMesh(2), number_of_points=3)
+        weightIntegralField = fieldmodule.createFieldMeshIntegral(
+            weight, fieldmodule.findFieldByName("xi"), fitter.getMesh(2))
+        weightIntegralField.setNumbersOfPoints(3)
+        result, referenceArea = referenceAreaField.evaluateReal(fieldcache, 1)
+        self.assertEqual(result, RESULT_OK)
+        result, weightIntegral = weightIntegralField.evaluateReal(fieldcache, 1)
+        self.assertEqual(result, RESULT_OK)
+        self.assertAlmostEqual(weightIntegral, referenceArea, delta=1.0E-6 * referenceArea)
+
+        # deformation objective with analytic curvature matches gradient of gradient formulation
+        mesh1d = fitter.getMesh(1)
+        mesh2d = fitter.getMesh(2)
+        curvatureObjectiveField = fit1.createDeformationPenaltyObjectiveField(mesh2d, mesh1d, mesh2d)
+        self.assertFalse(fit1.isAnalyticCurvaturePenalty())
+        self.assertTrue(fit1.setAnalyticCurvaturePenalty(True))
+        self.assertFalse(fit1.setAnalyticCurvaturePenalty(True))
+        analyticCurvatureObjectiveField = fit1.createDeformationPenaltyObjectiveField(mesh2d, mesh1d, mesh2d)
+        referenceFields = fitter.getReferenceDeformationFields()
+        self.assertEqual(24, referenceFields[3].getNumberOfComponents())
+        self.assertIs(referenceFields, fitter.getReferenceDeformationFields(curvatureBasis=True))
+        result, curvatureObjective = curvatureObjectiveField.evaluateReal(fieldcache, 1)
+        self.assertEqual(result, RESULT_OK)
+        result, analyticCurvatureObjective = analyticCurvatureObjectiveField.evaluateReal(fieldcache, 1)
+        self.assertEqual(result, RESULT_OK)
+        self.assertGreater(curvatureObjective, 0.0)
+        self.assertAlmostEqual(analyticCurvatureObjective, curvatureObjective, delta=1.0E-8 * curvatureObjective)
+
+        fitter.updateModelReferenceCoordinates()
+        self.assertIsNot(referenceFields, fitter.getReferenceDeformationFields())
+
+    def test_small_strain_breast2d(self):
+        """
+        Test small strain penalty on surface with fibres is zero in reference state and approximates large strain
+        penalty for small deformations.
+        """
+        zinc_model_file = os.path.join(here, "resources", "breast_plate.exf")
+        zinc_data_file = os.path.join(here, "resources", "breast_data.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        fitter.setFibreField(fitter.getFieldmodule().findFieldByName("zero fibres"))
+        fitter.load()
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupStrainPenalty(None, [1.0])
+        fitter.assignDeformationPenalties(fit1)
+        fieldmodule = fitter.getFieldmodule()
+        fieldcache = fieldmodule.createFieldcache()
+        mesh2d = fitter.getMesh(2)
+        emptyMeshGroup = fieldmodule.createFieldGroup().createMeshGroup(mesh2d)
+        strainObjectives = []
+        for smallStrain in (False, True):
+            fit1.setSmallStrainPenalty(smallStrain)
+            strainObjectiveField = fit1.createDeformationPenaltyObjectiveField(mesh2d, mesh2d, emptyMeshGroup)
+            result, strainObjective = strainObjectiveField.evaluateReal(fieldcache, 1)
+            self.assertEqual(RESULT_OK, result)
+            strainObjectives.append(strainObjective)
+        self.assertAlmostEqual(strainObjectives[0], 0.0, delta=1.0E-12)
+        self.assertAlmostEqual(strainObjectives[1], 0.0, delta=1.0E-12)
+
+        # compare penalties for uniform 0.1% stretch: C - I = 0.002001, F + F^T - 2I = 0.002 in both fibre axes
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        parametersCount = fieldparameters.getNumberOfParameters()
+        result, parameters = fieldparameters.getParameters(parametersCount)
+        self.assertEqual(RESULT_OK, result)
+        fieldparameters.setParameters([1.001 * value for value in parameters])
+        referenceAreaField = createFieldMeshIntegral(
+            fitter.getModelReferenceCoordinatesField(), mesh2d, number_of_points=3)
+        result, referenceArea = referenceAreaField.evaluateReal(fieldcache, 1)
+        self.assertEqual(RESULT_OK, result)
+        strainObjectives = []
+        for smallStrain in (False, True):
+            fit1.setSmallStrainPenalty(smallStrain)
+            strainObjectiveField = fit1.createDeformationPenaltyObjectiveField(mesh2d, mesh2d, emptyMeshGroup)
+            result, strainObjective = strainObjectiveField.evaluateReal(fieldcache, 1)
+            self.assertEqual(RESULT_OK, result)
+            strainObjectives.append(strainObjective)
+        self.assertAlmostEqual(strainObjectives[0], 2 * 0.002001 * 0.002001 * referenceArea,
+                               delta=1.0E-6 * strainObjectives[0])
+        self.assertAlmostEqual(strainObjectives[1], 2 * 0.002 * 0.002 * referenceArea,
+                               delta=1.0E-6 * strainObjectives[1])
+
+    def test_fit_triangles(self):
+        """
+        Test deformation penalties use reference coordinates gradients for elements not supporting reference
+        deformation fields.
+        """
+        context = Context("triangles")
+        region = context.getDefaultRegion()
+        fieldmodule = region.getFieldmodule()
+        with ChangeManager(fieldmodule):
+            coordinates = find_or_create_field_coordinates(fieldmodule)
+            nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            nodetemplate = nodes.createNodetemplate()
+            nodetemplate.defineField(coordinates)
+            fieldcache = fieldmodule.createFieldcache()
+            for x in ([0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0]):
+                node = nodes.createNode(-1, nodetemplate)
+                fieldcache.setNode(node)
+                coordinates.setNodeParameters(fieldcache, -1, Node.VALUE_LABEL_VALUE, 1, x)
+            mesh2d = fieldmodule.findMeshByDimension(2)
+            eft = mesh2d.createElementfieldtemplate(
+                fieldmodule.createElementbasis(2, Elementbasis.FUNCTION_TYPE_LINEAR_SIMPLEX))
+            elementtemplate = mesh2d.createElementtemplate()
+            elementtemplate.setElementShapeType(Element.SHAPE_TYPE_TRIANGLE)
+            elementtemplate.defineField(coordinates, -1, eft)
+            for nodeIdentifiers in ([1, 2, 3], [4, 3, 2]):
+                element = mesh2d.createElement(-1, elementtemplate)
+                element.setNodesByIdentifier(eft, nodeIdentifiers)
+            group = fieldmodule.createFieldGroup()
+            group.setName("square")
+            group.setManaged(True)
+            group.setSubelementHandlingMode(FieldGroup.SUBELEMENT_HANDLING_MODE_FULL)
+            group.createMeshGroup(mesh2d).addElementsConditional(fieldmodule.createFieldConstant([1.0]))
+        with tempfile.TemporaryDirectory() as tempDirName:
+            zinc_model_file = os.path.join(tempDirName, "triangles.exf")
+            self.assertEqual(RESULT_OK, region.writeFile(zinc_model_file))
+            zinc_data_file = os.path.join(here, "resources", "square_error_data.exf")
+            fitter = Fitter(zinc_model_file, zinc_data_file)
+            fitter.load()
+            fitter.setFibreField(fitter.getFieldmodule().findFieldByName("zero fibres"))
+            fitter.load()
+        self.assertIsNone(fitter.getReferenceDeformationFields())
+
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupStrainPenalty(None, [0.1])
+        fit1.run()
+        rmsErrorValue, maxErrorValue = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsErrorValue, 0.03581855535591005, delta=1.0E-6)
+        self.assertAlmostEqual(maxErrorValue, 0.05692238092549143, delta=1.0E-6)
+        fitter.cleanup()
+
     def test_projection_error(self):
         """
         Test data projection RMS and maximum error calculations.
@@ -78,6 +228,39 @@ class Fit2dTestCase(unittest.TestCase):
         self.assertAlmostEqual(rmsErrorValue, 0.34641016151377546, delta=TOL)  # sqrt(0.12)
         self.assertAlmostEqual(maxErrorValue, 0.5, delta=TOL)
 
+    def test_local_projection_data_proportion(self):
+        """
+        Test local re-projection selects the same proportion of data and outliers as a full projection.
+        """
+        zinc_model_file = os.path.join(here, "resources", "breast_plate.exf")
+        zinc_data_file = os.path.join(here, "resources", "breast_data.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        config1 = FitterStepConfig()
+        fitter.addFitterStep(config1)
+        config1.setGroupDataProportion(None, 0.3)
+        config1.setGroupOutlierLength(None, -0.2)
+        config1.run()
+        activeDataNodesetGroup = fitter.getActiveDataNodesetGroup()
+
+        def getActiveDataIdentifiers():
+            identifiers = []
+            nodeIter = activeDataNodesetGroup.createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                identifiers.append(node.getIdentifier())
+                node = nodeIter.next()
+            return identifiers
+
+        globalIdentifiers = getActiveDataIdentifiers()
+        self.assertEqual(88, len(globalIdentifiers))
+        # re-project only data in one element, which must keep the same selection
+        mesh = fitter.getMesh(2)
+        localGroup = fitter.getFieldmodule().createFieldGroup()
+        localGroup.createMeshGroup(mesh).addElement(mesh.findElementByIdentifier(2))
+        fitter.calculateDataProjections(config1, localGroup=localGroup)
+        self.assertEqual(globalIdentifiers, getActiveDataIdentifiers())
+
 
 if __name__ == "__main__":
     unittest.main()
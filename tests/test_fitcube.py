@@ -1,8 +1,12 @@
+import asyncio
+import csv
 import json
 import logging
 import math
 import os
 import sys
+import tempfile
+import threading
 import unittest
 from cmlibs.utils.zinc.field import createFieldMeshIntegral
 from cmlibs.utils.zinc.finiteelement import evaluate_field_nodeset_mean, find_node_with_name, evaluate_field_nodeset_range
@@ -12,10 +16,14 @@ from cmlibs.zinc.field import Field
 from cmlibs.zinc.node import Node, Nodeset
 from cmlibs.zinc.result import RESULT_OK
 from scaffoldfitter.fitter import Fitter
+from scaffoldfitter.fitterasync import AsyncFitter
+from scaffoldfitter.fitterexceptions import FitterCancelled
 from scaffoldfitter.fitterjson import decodeJSONFitterSteps
+from scaffoldfitter.fitterpool import FitterPool
 from scaffoldfitter.fitterstepalign import FitterStepAlign, createFieldsTransformations
 from scaffoldfitter.fitterstepconfig import FitterStepConfig
 from scaffoldfitter.fitterstepfit import FitterStepFit
+from scaffoldfitter.fittersweep import FitterSweep
 
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -231,7 +239,7 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         # test json serialisation
         s = fitter.encodeSettingsJSON()
         settings_dct = json.loads(s)
-        self.assertEqual(len(settings_dct), 10)
+        self.assertEqual(len(settings_dct), 11)
         self.assertEqual(settings_dct['id'], 'scaffold fitter settings')
         self.assertEqual(settings_dct['version'], '1.0.0')
         self.assertEqual(settings_dct['modelCoordinatesField'], 'coordinates')
@@ -241,6 +249,7 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         self.assertEqual(settings_dct['dataCoordinatesField'], 'data_coordinates')
         self.assertEqual(settings_dct['markerGroup'], 'marker')
         self.assertEqual(settings_dct['diagnosticLevel'], 1)
+        self.assertEqual(settings_dct['timeBudget'], 0.0)
         self.assertEqual(len(settings_dct['fitterSteps']), 3)
         fitter2 = Fitter(zinc_model_file, zinc_data_file)
         fitter2.decodeSettingsJSON(s, decodeJSONFitterSteps)
@@ -451,6 +460,17 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         min_jac_el, min_jac_value = fitter.getLowestElementJacobian()
         self.assertEqual(1, min_jac_el)
         self.assertAlmostEqual(0.1869875394, min_jac_value)
+        # queries answered from cached per-element minimum jacobians
+        self.assertEqual(0, fitter.getInvertedElementCount())
+        self.assertEqual(2, fitter.getInvertedElementCount(None, 0.5))
+        self.assertEqual([0, 2, 0, 0], fitter.getElementJacobianHistogram([0.0, 0.5, 1.0]))
+        mesh_group = fitter.getFieldmodule().findFieldByName("two").castGroup().getMeshGroup(fitter.getMesh(3))
+        self.assertEqual([0, 1, 0, 0], fitter.getElementJacobianHistogram([0.0, 0.5, 1.0], mesh_group))
+        # cache is recalculated when reference coordinates parameters change
+        fitter.updateModelReferenceCoordinates()
+        self.assertEqual(0, fitter.getInvertedElementCount(None, 0.5))
+        min_jac_el, min_jac_value = fitter.getLowestElementJacobian()
+        self.assertAlmostEqual(1.0, min_jac_value)
 
     def test_fitRegularDataGroupWeight(self):
         """
@@ -545,6 +565,661 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         self.assertEqual(1, min_jac_el)
         self.assertAlmostEqual(1.0, min_jac_value)
 
+    def test_fitDataProportionSchedule(self):
+        """
+        Test fitting with coarse-to-fine schedule of nested, spatially stratified data subsets.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        activeNodeset = fitter.getActiveDataNodesetGroup()
+        self.assertEqual(166, activeNodeset.getSize())
+
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        self.assertEqual([], fit1.getDataProportionSchedule())
+        self.assertTrue(fit1.setDataProportionSchedule([0.05, 0.2]))
+        self.assertFalse(fit1.setDataProportionSchedule([0.05, 0.2]))
+        self.assertEqual([0.05, 0.2], fit1.getDataProportionSchedule())
+        dct = fit1.encodeSettingsJSONDict()
+        self.assertEqual([0.05, 0.2], dct["dataProportionSchedule"])
+        fit2 = FitterStepFit()
+        fit2.decodeSettingsJSONDict(dct)
+        self.assertEqual([0.05, 0.2], fit2.getDataProportionSchedule())
+
+        # check subsets are nested
+        previousIdentifiers = set()
+        for scheduleProportion in (0.05, 0.2, 1.0):
+            fitter.calculateDataProjections(fit1, scheduleProportion)
+            identifiers = set()
+            nodeIter = activeNodeset.createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                identifiers.add(node.getIdentifier())
+                node = nodeIter.next()
+            self.assertTrue(previousIdentifiers < identifiers)
+            previousIdentifiers = identifiers
+        self.assertEqual(166, len(previousIdentifiers))
+
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(4)
+        fitter.run()
+        # all data is projected after the final iteration
+        self.assertEqual(166, activeNodeset.getSize())
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, 0.02033765136347444, delta=1.0E-4)
+        self.assertAlmostEqual(maxError, 0.05767684429918027, delta=1.0E-4)
+
+        # per-element data error map; model has a single element so matches overall errors
+        elementIdentifiers, counts, rmsErrors, maxErrors = fitter.getElementDataErrors()
+        self.assertEqual([1], elementIdentifiers)
+        self.assertEqual([166], counts)
+        self.assertAlmostEqual(rmsErrors[0], rmsError, delta=1.0E-12)
+        self.assertAlmostEqual(maxErrors[0], maxError, delta=1.0E-12)
+        self.assertEqual(166, len(fitter.getElementDataIdentifiers(1)))
+        self.assertEqual([], fitter.getElementDataIdentifiers(2))
+        elementDataErrorField = fitter.getElementDataErrorField()
+        self.assertEqual("element_data_error", elementDataErrorField.getName())
+        fieldcache = fitter.getFieldmodule().createFieldcache()
+        fieldcache.setElement(fitter.getHighestDimensionMesh().findElementByIdentifier(1))
+        result, values = elementDataErrorField.evaluateReal(fieldcache, 3)
+        self.assertEqual(RESULT_OK, result)
+        assertAlmostEqualList(self, values, [166.0, rmsError, maxError], delta=1.0E-12)
+
+        # cached errors are recalculated after notifying model parameters changed
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        result, parameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+        self.assertEqual(RESULT_OK, result)
+        self.assertEqual(RESULT_OK, fieldparameters.setParameters([1.01 * value for value in parameters]))
+        fitter.notifyModelParametersChanged()
+        scaledRmsError, scaledMaxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertNotAlmostEqual(scaledRmsError, rmsError, delta=1.0E-4)
+        elementIdentifiers, counts, rmsErrors, maxErrors = fitter.getElementDataErrors()
+        self.assertAlmostEqual(rmsErrors[0], scaledRmsError, delta=1.0E-12)
+        self.assertAlmostEqual(maxErrors[0], scaledMaxError, delta=1.0E-12)
+
+    def test_localRefit(self):
+        """
+        Test refitting only elements with high data projection errors.
+        """
+        zinc_model_file = os.path.join(here, "resources", "two_cubes_hermite_nocross_groups.exf")
+        zinc_data_file = os.path.join(here, "resources", "two_cubes_ellipsoid_data_regular.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.run()
+        elementIdentifiers, counts, rmsErrors, maxErrors = fitter.getElementDataErrors()
+        self.assertEqual([1, 2], elementIdentifiers)
+        self.assertEqual([213, 75], counts)
+        assertAlmostEqualList(self, rmsErrors, [0.14221379249218216, 0.40050843686705706], delta=1.0E-6)
+
+        fit2 = FitterStepFit()
+        fitter.addFitterStep(fit2)
+        self.assertEqual(0.0, fit2.getLocalRefitErrorThreshold())
+        self.assertTrue(fit2.setLocalRefitErrorThreshold(0.25))
+        self.assertEqual(1, fit2.getLocalRefitNeighbourRings())
+        self.assertTrue(fit2.setLocalRefitNeighbourRings(0))
+        dct = fit2.encodeSettingsJSONDict()
+        self.assertEqual(0.25, dct["localRefitErrorThreshold"])
+        self.assertEqual(0, dct["localRefitNeighbourRings"])
+        fit2.setNumberOfIterations(2)
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        parametersCount = fieldparameters.getNumberOfParameters()
+        parametersBefore = fieldparameters.getParameters(parametersCount)[1]
+        fit2.run()
+        parametersAfter = fieldparameters.getParameters(parametersCount)[1]
+        # only parameters of nodes in element 2 are refitted
+        mesh = fitter.getHighestDimensionMesh()
+        element2ParameterIndexes = set(fieldparameters.getElementParameterIndexes(
+            mesh.findElementByIdentifier(2), 96)[1])
+        for i in range(parametersCount):
+            if (i + 1) in element2ParameterIndexes:
+                continue
+            self.assertEqual(parametersBefore[i], parametersAfter[i])
+        self.assertNotEqual(parametersBefore, parametersAfter)
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, 0.1367691466282945, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.41610001033518174, delta=1.0E-6)
+
+    def test_inversionGuard(self):
+        """
+        Test fit step inversion guard reduces step or rolls back iterations inverting elements.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_regular.exf")
+        for stepReductions in (2, 0):
+            fitter = Fitter(zinc_model_file, zinc_data_file)
+            fitter.load()
+            # reflect marker data in z to force inversion when fitting markers only
+            fieldmodule = fitter.getFieldmodule()
+            dataCoordinates = fitter.getDataCoordinatesField()
+            fieldcache = fieldmodule.createFieldcache()
+            nodeIter = fitter.getMarkerDataFields()[0].createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                fieldcache.setNode(node)
+                result, x = dataCoordinates.evaluateReal(fieldcache, 3)
+                dataCoordinates.assignReal(fieldcache, [x[0], x[1], -x[2]])
+                node = nodeIter.next()
+            fit1 = FitterStepFit()
+            fitter.addFitterStep(fit1)
+            for groupName in ("bottom", "sides", "top"):
+                fit1.setGroupDataWeight(groupName, 0.0)
+            fit1.setGroupDataWeight("marker", 100.0)
+            fit1.setGroupCurvaturePenalty(None, [0.001])
+            fit1.setNumberOfIterations(2)
+            self.assertFalse(fit1.isInversionGuard())
+            self.assertTrue(fit1.setInversionGuard(True))
+            self.assertEqual(2, fit1.getInversionGuardStepReductions())
+            fit1.setInversionGuardStepReductions(stepReductions)
+            dct = fit1.encodeSettingsJSONDict()
+            self.assertTrue(dct["inversionGuard"])
+            self.assertEqual(stepReductions, dct["inversionGuardStepReductions"])
+            fit1.run()
+            # with step reductions both iterations are reduced, otherwise first is rolled back
+            self.assertEqual(2 if stepReductions else 1, fit1.getInversionGuardReducedStepCount())
+            self.assertEqual(stepReductions == 0, fit1.isInversionGuardRolledBack())
+            self.assertEqual(0, fitter.getInvertedElementCount())
+            self.assertEqual(set(), fitter.getInvertedElementIdentifiers())
+            min_jac_el, min_jac_value = fitter.getLowestElementJacobian()
+            # without guard minimum jacobian is -1.666
+            self.assertAlmostEqual(min_jac_value, 0.12375674959287392 if stepReductions else 1.0, delta=1.0E-6)
+
+    def test_smallStrainPenalty(self):
+        """
+        Test linear small strain penalty approximates large strain penalty for small deformations.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_regular.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupStrainPenalty(None, [0.1])
+        self.assertFalse(fit1.isSmallStrainPenalty())
+        self.assertTrue(fit1.setSmallStrainPenalty(True))
+        self.assertFalse(fit1.setSmallStrainPenalty(True))
+        self.assertTrue(fit1.encodeSettingsJSONDict()["smallStrainPenalty"])
+
+        # compare penalties for uniform 0.1% stretch: C - I = 0.002001, F + F^T - 2I = 0.002
+        fieldmodule = fitter.getFieldmodule()
+        fieldcache = fieldmodule.createFieldcache()
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        parametersCount = fieldparameters.getNumberOfParameters()
+        result, parameters = fieldparameters.getParameters(parametersCount)
+        self.assertEqual(RESULT_OK, result)
+        fieldparameters.setParameters([1.001 * value for value in parameters])
+        fitter.assignDeformationPenalties(fit1)
+        mesh3d = fitter.getMesh(3)
+        strainObjectives = []
+        for smallStrain in (False, True):
+            fit1.setSmallStrainPenalty(smallStrain)
+            strainObjectiveField = fit1.createDeformationPenaltyObjectiveField(mesh3d, mesh3d, fitter.getMesh(2))
+            result, strainObjective = strainObjectiveField.evaluateReal(fieldcache, 1)
+            self.assertEqual(RESULT_OK, result)
+            strainObjectives.append(strainObjective)
+        self.assertAlmostEqual(strainObjectives[0], 1.2012003000022593e-06, delta=1.0E-12)
+        self.assertAlmostEqual(strainObjectives[1], 1.2E-06, delta=1.0E-12)
+        fieldparameters.setParameters(parameters)
+
+        fit1.run()
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, 0.21300048629940938, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.5845366671814813, delta=1.0E-6)
+
+    def test_objectiveFieldCache(self):
+        """
+        Test objective fields are cached on the fitter and reused by later steps with the same structure.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_regular.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupStrainPenalty(None, [0.1])
+        fit1.run()
+        dataObjective = fitter.getObjectiveField(("data",), None)
+        self.assertIsNotNone(dataObjective)
+        fit2 = FitterStepFit()
+        fitter.addFitterStep(fit2)
+        fit2.run()
+        self.assertIs(dataObjective, fitter.getObjectiveField(("data",), None))
+        # changing reference state only rebuilds deformation objective
+        deformationObjectiveKey = ("deformation", True, True, False, False, False)
+        deformationObjective = fitter.getObjectiveField(deformationObjectiveKey, None)
+        self.assertIsNotNone(deformationObjective)
+        fitter.updateModelReferenceCoordinates()
+        fit2.run()
+        self.assertIs(dataObjective, fitter.getObjectiveField(("data",), None))
+        self.assertIsNot(deformationObjective, fitter.getObjectiveField(deformationObjectiveKey, None))
+
+    def test_parameterSweep(self):
+        """
+        Test sweep of fit step group settings from shared aligned checkpoint over a process pool.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_regular.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        align = FitterStepAlign()
+        fitter.addFitterStep(align)
+        align.setAlignMarkers(True)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(2)
+        settingsJSON = fitter.encodeSettingsJSON()
+        fitter.run()
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, 0.011343104382156962, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.040642734668919184, delta=1.0E-6)
+
+        sweep = FitterSweep(zinc_model_file, zinc_data_file, settingsJSON)
+        sweep.addGridConfigurations({(None, "curvaturePenalty"): [[0.01], [0.1]], ("top", "dataWeight"): [1.0, 2.0]})
+        self.assertEqual(4, len(sweep.getConfigurations()))
+        self.assertEqual({(None, "curvaturePenalty"): [0.1], ("top", "dataWeight"): 1.0}, sweep.getConfigurations()[2])
+        sweep.addRandomConfigurations({(None, "strainPenalty"): (0.001, 1.0)}, 2, seed=1)
+        self.assertEqual(6, len(sweep.getConfigurations()))
+        strainPenalty = sweep.getConfigurations()[4][(None, "strainPenalty")]
+        self.assertEqual(1, len(strainPenalty))
+        self.assertTrue(0.001 <= strainPenalty[0] <= 1.0)
+        results = sweep.run(processCount=2)
+        self.assertEqual(6, len(results))
+        expectedResults = [
+            (0.011343104382156962, 0.040642734668919184, 0.12051421720965616),
+            (0.011583384712557454, 0.04341774317483735, 0.05682839546561991),
+            (0.03144896929233715, 0.06251892004194397, 0.764920217119562),
+            (0.02946475351051475, 0.06138790026652787, 0.6928907233393683)]
+        for result, (expectedRmsError, expectedMaxError, expectedMinimumJacobian) in zip(results, expectedResults):
+            self.assertAlmostEqual(result["rmsError"], expectedRmsError, delta=1.0E-6)
+            self.assertAlmostEqual(result["maxError"], expectedMaxError, delta=1.0E-6)
+            self.assertAlmostEqual(result["minimumJacobian"], expectedMinimumJacobian, delta=1.0E-6)
+            self.assertGreater(result["time"], 0.0)
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, "sweep.csv")
+            sweep.writeResults(fileName)
+            with open(fileName, newline="") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(7, len(rows))
+        self.assertEqual(["configuration", "default curvaturePenalty", "top dataWeight", "default strainPenalty",
+                          "rms error", "max error", "minimum jacobian", "minimum jacobian element", "time"], rows[0])
+        self.assertEqual(["3", "[0.1]", "1.0", ""], rows[3][:4])
+
+    def test_fitterPool(self):
+        """
+        Test reloading data into a loaded fitter, and fitting with a pool of prepared fitters.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file_random = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        zinc_data_file_regular = os.path.join(here, "resources", "cube_to_sphere_data_regular.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file_random)
+        fitter.load()
+        align = FitterStepAlign()
+        fitter.addFitterStep(align)
+        align.setAlignMarkers(True)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(2)
+        settingsJSON = fitter.encodeSettingsJSON()
+        fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+        result, templateParameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+        self.assertEqual(RESULT_OK, result)
+        fitter.run()
+        expectedErrors = {
+            zinc_data_file_random: (0.011047126647547404, 0.02685588933149867),
+            zinc_data_file_regular: (0.011343104382156962, 0.040642734668919184)}
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, expectedErrors[zinc_data_file_random][0], delta=1.0E-6)
+        self.assertAlmostEqual(maxError, expectedErrors[zinc_data_file_random][1], delta=1.0E-6)
+
+        # restoring model and reloading data gives same fit as fresh load
+        self.assertEqual(RESULT_OK, fieldparameters.setParameters(templateParameters))
+        fitter.updateModelReferenceCoordinates()
+        fitter.reloadData(zinc_data_file_regular)
+        self.assertEqual(292, fitter.getActiveDataNodesetGroup().getSize())
+        self.assertFalse(fit1.hasRun())
+        fitter.run()
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, expectedErrors[zinc_data_file_regular][0], delta=1.0E-6)
+        self.assertAlmostEqual(maxError, expectedErrors[zinc_data_file_regular][1], delta=1.0E-6)
+        fitter.cleanup()
+
+        dataFileNames = [zinc_data_file_regular, zinc_data_file_random, zinc_data_file_regular]
+        with FitterPool() as pool:
+            pool.addTemplate("cube", zinc_model_file, zinc_data_file_random, settingsJSON, processCount=2,
+                             maximumJobsPerProcess=2)
+            self.assertEqual(["cube"], pool.getTemplateNames())
+            self.assertEqual(2, pool.getProcessCount("cube"))
+            health = pool.checkHealth("cube", timeout=60.0)
+            self.assertEqual(2, len(health))
+            self.assertTrue(all(workerHealth["loaded"] for workerHealth in health))
+            with tempfile.TemporaryDirectory() as directory:
+                modelFileName = os.path.join(directory, "fitted.exf")
+                jobs = [pool.submit("cube", dataFileName) for dataFileName in dataFileNames[:-1]]
+                jobs.append(pool.submit("cube", dataFileNames[-1], modelFileName))
+                results = [job.get(60.0) for job in jobs]
+                self.assertTrue(os.path.isfile(modelFileName))
+        for dataFileName, result in zip(dataFileNames, results):
+            self.assertAlmostEqual(result["rmsError"], expectedErrors[dataFileName][0], delta=1.0E-6)
+            self.assertAlmostEqual(result["maxError"], expectedErrors[dataFileName][1], delta=1.0E-6)
+            self.assertGreater(result["time"], 0.0)
+            self.assertTrue(1 <= result["jobCount"] <= 2)
+
+    def test_fitterPoolTemplateLoadFailure(self):
+        """
+        Test failure to load template in worker process is raised by jobs instead of hanging.
+        """
+        zinc_model_file = os.path.join(here, "resources", "missing_model.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        settingsJSON = Fitter(zinc_model_file, zinc_data_file).encodeSettingsJSON()
+        with FitterPool() as pool:
+            pool.addTemplate("missing", zinc_model_file, zinc_data_file, settingsJSON)
+            health = pool.checkHealth("missing", timeout=60.0)
+            self.assertFalse(health[0]["loaded"])
+            self.assertTrue(health[0]["loadError"].startswith("Failed to load model file"))
+            for i in range(2):
+                with self.assertRaises(AssertionError) as cm:
+                    pool.fit("missing", zinc_data_file, timeout=60.0)
+                self.assertTrue(str(cm.exception).startswith("Failed to load model file"))
+
+    def test_clone(self):
+        """
+        Test cloning fitter part way through fit and continuing clones independently.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        align = FitterStepAlign()
+        fitter.addFitterStep(align)
+        align.setAlignMarkers(True)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit2 = FitterStepFit()
+        fitter.addFitterStep(fit2)
+        fitter.run(fit1)
+        errors = fitter.getDataRMSAndMaximumProjectionError()
+
+        clone1 = fitter.clone()
+        clone2 = fitter.clone()
+        self.assertIsNot(fitter.getContext(), clone1.getContext())
+        self.assertEqual(fitter.encodeSettingsJSON(), clone1.encodeSettingsJSON())
+        self.assertEqual([True, True, True, False], [fitterStep.hasRun() for fitterStep in clone1.getFitterSteps()])
+        for clone in (clone1, clone2):
+            cloneErrors = clone.getDataRMSAndMaximumProjectionError()
+            self.assertAlmostEqual(cloneErrors[0], errors[0], delta=1.0E-12)
+            self.assertAlmostEqual(cloneErrors[1], errors[1], delta=1.0E-12)
+            self.assertEqual(fitter.getActiveDataNodesetGroup().getSize(),
+                             clone.getActiveDataNodesetGroup().getSize())
+        clone2.getFitterSteps()[3].setGroupCurvaturePenalty(None, [1.0])
+        self.assertEqual(([0.01], False, True), fit2.getGroupCurvaturePenalty(None))
+
+        for fitter_ in (fitter, clone1, clone2):
+            fitter_.run()
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        rmsError1, maxError1 = clone1.getDataRMSAndMaximumProjectionError()
+        rmsError2, maxError2 = clone2.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError1, rmsError, delta=1.0E-10)
+        self.assertAlmostEqual(maxError1, maxError, delta=1.0E-10)
+        self.assertGreater(rmsError2, rmsError + 1.0E-3)
+
+    def test_stateArchive(self):
+        """
+        Test writing fitter state archive part way through fit, and resuming from it in a new fitter.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        align = FitterStepAlign()
+        fitter.addFitterStep(align)
+        align.setAlignMarkers(True)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupStrainPenalty(None, [0.01])
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit2 = FitterStepFit()
+        fitter.addFitterStep(fit2)
+        fit2.setGroupStrainPenalty(None, [0.0])
+        fitter.run(fit1)
+        errors = fitter.getDataRMSAndMaximumProjectionError()
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, "state.bin")
+            fitter.writeStateArchive(fileName, compression="gzip")
+            resumedFitter = Fitter(zinc_model_file, zinc_data_file)
+            resumedFitter.readStateArchive(fileName)
+        self.assertEqual(fitter.encodeSettingsJSON(), resumedFitter.encodeSettingsJSON())
+        self.assertEqual([True, True, True, False],
+                         [fitterStep.hasRun() for fitterStep in resumedFitter.getFitterSteps()])
+        resumedErrors = resumedFitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(resumedErrors[0], errors[0], delta=1.0E-12)
+        self.assertAlmostEqual(resumedErrors[1], errors[1], delta=1.0E-12)
+        for fitter_ in (fitter, resumedFitter):
+            strainActiveGroup = fitter_.getFieldmodule().findFieldByName("strain_active_group.mesh3d").castGroup()
+            self.assertEqual(1, strainActiveGroup.getMeshGroup(fitter_.getMesh(3)).getSize())
+        # uncompressed archive is identical after round trip
+        self.assertEqual(fitter.writeStateArchive(), resumedFitter.writeStateArchive())
+        with self.assertRaises(ValueError):
+            resumedFitter.readStateArchive(buffer=fitter.writeModel())
+
+        fitter.run()
+        resumedFitter.run()
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        resumedRmsError, resumedMaxError = resumedFitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(resumedRmsError, rmsError, delta=1.0E-10)
+        self.assertAlmostEqual(resumedMaxError, maxError, delta=1.0E-10)
+
+    def test_timeBudget(self):
+        """
+        Test fit step and fitter run time budgets stop fitting early with best parameters so far.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        for timeBudget in (100.0, 1.0E-9):
+            fitter = Fitter(zinc_model_file, zinc_data_file)
+            fitter.load()
+            initialErrors = fitter.getDataRMSAndMaximumProjectionError()
+            fit1 = FitterStepFit()
+            fitter.addFitterStep(fit1)
+            fit1.setGroupCurvaturePenalty(None, [0.01])
+            fit1.setMaximumSubIterations(2)
+            self.assertEqual(0.0, fit1.getTimeBudget())
+            self.assertTrue(fit1.setTimeBudget(timeBudget))
+            self.assertEqual(timeBudget, fit1.encodeSettingsJSONDict()["timeBudget"])
+            fitter.run()
+            exhausted = timeBudget < 1.0
+            self.assertEqual(exhausted, fit1.isTimeBudgetExhausted())
+            self.assertEqual(exhausted, fitter.isTimeBudgetExhausted())
+            self.assertTrue(fit1.hasRun())
+            rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+            if exhausted:
+                # budget is used up before first iteration so model is unchanged
+                assertAlmostEqualList(self, [rmsError, maxError], initialErrors, delta=1.0E-12)
+            else:
+                self.assertAlmostEqual(rmsError, 0.14847306536783997, delta=1.0E-4)
+
+        # fitter run time budget exhausted before running later steps
+        fit2 = FitterStepFit()
+        fitter.addFitterStep(fit2)
+        fit1.setTimeBudget(0.0)
+        self.assertEqual(0.0, fitter.getTimeBudget())
+        self.assertTrue(fitter.setTimeBudget(1.0E-9))
+        fitter.run()
+        self.assertTrue(fitter.isTimeBudgetExhausted())
+        self.assertFalse(fit2.hasRun())
+        fitter.setTimeBudget(0.0)
+        fitter.run()
+        self.assertFalse(fitter.isTimeBudgetExhausted())
+        self.assertTrue(fit2.hasRun())
+
+    def test_timeBudgetNotReached(self):
+        """
+        Test time budget which is not reached gives the same fit as no time budget.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fittedParameters = []
+        for timeBudget in (0.0, 100.0):
+            fitter = Fitter(zinc_model_file, zinc_data_file)
+            fitter.load()
+            fit1 = FitterStepFit()
+            fitter.addFitterStep(fit1)
+            fit1.setGroupCurvaturePenalty(None, [0.01])
+            fit1.setMaximumSubIterations(5)
+            fit1.setTimeBudget(timeBudget)
+            fitter.run()
+            self.assertFalse(fit1.isTimeBudgetExhausted())
+            fieldparameters = fitter.getModelCoordinatesField().getFieldparameters()
+            result, parameters = fieldparameters.getParameters(fieldparameters.getNumberOfParameters())
+            self.assertEqual(RESULT_OK, result)
+            fittedParameters.append(parameters)
+            fitter.cleanup()
+        self.assertEqual(fittedParameters[0], fittedParameters[1])
+
+    def test_progressAndCancellation(self):
+        """
+        Test progress callback events and resuming fit after cancellation.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(3)
+        events = []
+        cancellationToken = threading.Event()
+        cancelled = []
+
+        def progressCallback(eventName, info):
+            events.append((eventName, info))
+            if (eventName == "iterationEnd") and (info["iteration"] == 2) and not cancelled:
+                cancellationToken.set()
+                cancelled.append(True)
+
+        fitter.setProgressCallback(progressCallback)
+        fitter.setCancellationToken(cancellationToken)
+        with self.assertRaises(FitterCancelled):
+            fitter.run()
+        self.assertEqual(["stepStart", "iterationStart", "projections", "iterationEnd",
+                          "iterationStart", "projections", "iterationEnd"], [event[0] for event in events])
+        self.assertEqual({"stepIndex": 1, "stepCount": 2, "stepType": "_FitterStepFit"}, events[0][1])
+        self.assertEqual({"activeDataCount": 166, "projectedDataCount": 162}, events[2][1])
+        iterationInfo = events[3][1]
+        self.assertEqual((1, 3), (iterationInfo["iteration"], iterationInfo["iterationCount"]))
+        self.assertAlmostEqual(iterationInfo["objectives"]["Data objective"], 3.5777082273774234, delta=1.0E-6)
+        self.assertAlmostEqual(iterationInfo["objectives"]["Deformation penalty objective"], 0.4202131360746307,
+                               delta=1.0E-6)
+        # objectives at end of iteration are reported at start of next iteration without re-evaluation
+        self.assertEqual(iterationInfo["objectives"], events[4][1]["objectives"])
+        self.assertFalse(fit1.hasRun())
+
+        # resume from parameters at cancellation
+        cancellationToken.clear()
+        events.clear()
+        fitter.run()
+        self.assertTrue(fit1.hasRun())
+        self.assertEqual("projections", events[0][0])
+        self.assertEqual("stepEnd", events[-1][0])
+        rmsError, maxError = fitter.getDataRMSAndMaximumProjectionError()
+        self.assertAlmostEqual(rmsError, 0.030661214433248814, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.19506680252730116, delta=1.0E-6)
+
+    def test_asyncFitter(self):
+        """
+        Test running fitter from asyncio with progress events.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(3)
+
+        async def collectEvents(progressEvents):
+            return [eventName async for eventName, info in progressEvents]
+
+        async def fit():
+            async with AsyncFitter(fitter) as asyncFitter:
+                await asyncFitter.load()
+                eventNames, reloaded = await asyncio.gather(
+                    collectEvents(asyncFitter.progressEvents()), asyncFitter.run())
+                self.assertFalse(reloaded)
+                errors = await asyncFitter.getDataRMSAndMaximumProjectionError()
+                fitStepCount = await asyncFitter.call(lambda: sum(
+                    1 for fitterStep in asyncFitter.getFitter().getFitterSteps() if fitterStep.hasRun()))
+                return eventNames, errors, fitStepCount
+
+        eventNames, (rmsError, maxError), fitStepCount = asyncio.run(fit())
+        self.assertEqual(["stepStart"] + ["iterationStart", "projections", "iterationEnd"] * 3 + ["stepEnd"],
+                         eventNames)
+        self.assertEqual(2, fitStepCount)
+        self.assertAlmostEqual(rmsError, 0.039213707607555735, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.27803076319485726, delta=1.0E-6)
+
+    def test_asyncFitterTaskCancelled(self):
+        """
+        Test cancelling an asyncio task awaiting run cancels the fit, which can be resumed.
+        """
+        zinc_model_file = os.path.join(here, "resources", "cube_to_sphere.exf")
+        zinc_data_file = os.path.join(here, "resources", "cube_to_sphere_data_random.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setGroupCurvaturePenalty(None, [0.01])
+        fit1.setNumberOfIterations(3)
+        # worker waits after first event until cancelling the awaiting task sets the cancellation token,
+        # so the fit is deterministically cancelled before its first iteration
+        setProgressCallback = fitter.setProgressCallback
+
+        def setWaitingProgressCallback(progressCallback):
+            def waitingProgressCallback(eventName, info):
+                progressCallback(eventName, info)
+                self.assertTrue(fitter.getCancellationToken().wait(10.0))
+
+            # only the first run waits
+            fitter.setProgressCallback = setProgressCallback
+            setProgressCallback(waitingProgressCallback)
+
+        fitter.setProgressCallback = setWaitingProgressCallback
+
+        async def fit():
+            async with AsyncFitter(fitter) as asyncFitter:
+                await asyncFitter.load()
+                progressEvents = asyncFitter.progressEvents()
+                runTask = asyncio.ensure_future(asyncFitter.run())
+                eventNames = []
+                async for eventName, info in progressEvents:
+                    if not eventNames:
+                        runTask.cancel()
+                    eventNames.append(eventName)
+                with self.assertRaises(asyncio.CancelledError):
+                    await runTask
+                # fit stopped early on worker, which is free for later calls
+                progressCallback, fit1HasRun = await asyncFitter.call(
+                    lambda: (asyncFitter.getFitter().getProgressCallback(), fit1.hasRun()))
+                reloaded = await asyncFitter.run()
+                self.assertFalse(reloaded)
+                errors = await asyncFitter.getDataRMSAndMaximumProjectionError()
+                return eventNames, progressCallback, fit1HasRun, errors
+
+        eventNames, progressCallback, fit1HasRun, (rmsError, maxError) = asyncio.run(fit())
+        self.assertEqual("stepStart", eventNames[0])
+        self.assertNotIn("stepEnd", eventNames)
+        self.assertIsNone(progressCallback)
+        self.assertFalse(fit1HasRun)
+        self.assertTrue(fit1.hasRun())
+        self.assertAlmostEqual(rmsError, 0.039213707607555735, delta=1.0E-6)
+        self.assertAlmostEqual(maxError, 0.27803076319485726, delta=1.0E-6)
+
     def test_groupSettings(self):
         """
         Test per-group settings, and inheritance from previous 
@@ -617,6 +1292,23 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         jac_det_el, jac_det_value = fitter.getLowestElementJacobianForGroup('left')
         self.assertIsNone(jac_det_value)
 
+        # all group statistics in one call, with CSV output
+        with tempfile.TemporaryDirectory() as tempDirName:
+            statisticsFileName = os.path.join(tempDirName, "statistics.csv")
+            statistics = fitter.getDataErrorStatistics([50.0, 100.0], statisticsFileName)
+            with open(statisticsFileName, newline="") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(["group", "count", "rms", "max", "mean", "percentile 50.0", "percentile 100.0"], rows[0])
+        self.assertEqual(5, len(rows))
+        self.assertEqual(["bottom", "sides", "top", "marker"], list(statistics.keys()))
+        for groupName, errors in groupErrors.items():
+            groupStatistics = statistics[groupName]
+            self.assertEqual(groupSizes[groupName], groupStatistics["count"])
+            self.assertAlmostEqual(groupStatistics["rms"], errors[0], 5)
+            self.assertAlmostEqual(groupStatistics["max"], errors[1], 5)
+            self.assertAlmostEqual(groupStatistics["percentiles"][1], errors[1], 5)
+            self.assertTrue(groupStatistics["mean"] <= groupStatistics["rms"])
+
         # test override and inherit
         config2 = FitterStepConfig()
         fitter.addFitterStep(config2)
@@ -647,9 +1339,26 @@ class FitCubeToSphereTestCase(unittest.TestCase):
         for groupName, count in groupSizes.items():
             self.assertEqual(count, getNodesetConditionalSize(
                 activeNodeset, fitter.getFieldmodule().findFieldByName(groupName)))
+        # test voxel decimation of data, applied before data proportion
+        config4 = FitterStepConfig()
+        fitter.addFitterStep(config4)
+        self.assertEqual((0.0, False, False), config4.getGroupDataVoxelSize("bottom"))
+        config4.setGroupDataVoxelSize("bottom", -1.0)
+        self.assertEqual((0.0, True, False), config4.getGroupDataVoxelSize("bottom"))
+        config4.setGroupDataVoxelSize("bottom", 0.25)
+        config4.setGroupDataVoxelSize("sides", 0.25)
+        self.assertEqual((0.25, True, False), config4.getGroupDataVoxelSize("bottom"))
+        config4.run()
+        activeNodeset = fitter.getActiveDataNodesetGroup()
+        groupSizes = {"bottom": 12, "sides": 10, "top": 72, "marker": 4}
+        for groupName, count in groupSizes.items():
+            self.assertEqual(count, getNodesetConditionalSize(
+                activeNodeset, fitter.getFieldmodule().findFieldByName(groupName)))
+        fitter.removeFitterStep(config4)
         del config1
         del config2
         del config3
+        del config4
 
         # test json serialisation
         s = fitter.encodeSettingsJSON()
@@ -1,6 +1,7 @@
 import logging
 import os
 import sys
+import tempfile
 import unittest
 from cmlibs.utils.zinc.field import createFieldMeshIntegral
 from cmlibs.utils.zinc.general import ChangeManager
@@ -11,7 +12,9 @@ from cmlibs.zinc.result import RESULT_OK
 from scaffoldfitter.fitter import Fitter
 from scaffoldfitter.fitterstepalign import FitterStepAlign
 from scaffoldfitter.fitterstepconfig import FitterStepConfig
+from scaffoldfitter.fitterdelta import FitterDeltaReader
 from scaffoldfitter.fitterstepfit import FitterStepFit
+from scaffoldfitter.fitterwriter import FitterFileWriter, decompressBuffer
 
 here = os.path.abspath(os.path.dirname(__file__))
 
@@ -42,7 +45,7 @@ class GeneralTestCase(unittest.TestCase):
         fit2 = FitterStepFit()
         fitter.addFitterStep(fit2)
 
-        for case in range(3):
+        for case in range(5):
             fitter.load()
             fieldmodule = fitter.getFieldmodule()
             coordinates = fitter.getModelCoordinatesField()
@@ -64,6 +67,17 @@ class GeneralTestCase(unittest.TestCase):
                     # relative outlier length applied to "trunk" group
                     config1.clearGroupOutlierLength(None)
                     config1.setGroupOutlierLength("trunk", -0.1)
+                elif case == 3:
+                    # percentile outlier filter applied to "trunk" group
+                    config1.clearGroupOutlierLength("trunk")
+                    config1.setGroupOutlierPercentile("trunk", 97.0)
+                    self.assertEqual((97.0, True, False), config1.getGroupOutlierPercentile("trunk"))
+                elif case == 4:
+                    # median absolute deviation outlier filter applied to default group
+                    config1.clearGroupOutlierPercentile("trunk")
+                    self.assertEqual((0.0, False, False), config1.getGroupOutlierPercentile("trunk"))
+                    config1.setGroupOutlierMADFactor(None, 10.0)
+                    self.assertEqual((10.0, False, True), config1.getGroupOutlierMADFactor("trunk"))
                 expectedActiveDataSize = 26  # one outlier has been filtered
                 expectedLength = 3.0331818804905284
                 expectedRmsError = 0.009620758125514172
@@ -302,5 +316,81 @@ class GeneralTestCase(unittest.TestCase):
                 self.assertEqual(minElementIdentifier, 102)
                 self.assertAlmostEqual(minJacobian, 0.8073661446227143, delta=TOL)
 
+    def test_write_model_data(self):
+        """
+        Test writing model and data to memory with compression, and intermediate files in the background.
+        """
+        zinc_model_file = os.path.join(here, "resources", "nerve_trunk_model.exf")
+        zinc_data_file = os.path.join(here, "resources", "nerve_path_data.exf")
+        fitter = Fitter(zinc_model_file, zinc_data_file)
+        fitter.load()
+
+        modelBuffer = fitter.writeModel()
+        compressedModelBuffer = fitter.writeModel(compression="gzip")
+        self.assertLess(len(compressedModelBuffer), len(modelBuffer))
+        self.assertEqual(decompressBuffer(compressedModelBuffer), modelBuffer)
+        dataBuffer = fitter.writeData()
+        compressedDataBuffer = fitter.writeData(compression="gzip")
+        self.assertLess(len(compressedDataBuffer), len(dataBuffer))
+        self.assertEqual(decompressBuffer(compressedDataBuffer), dataBuffer)
+        with self.assertRaises(ValueError):
+            fitter.writeModel(compression="lzma")
+
+        context = Context("Scaffoldfitter test")
+        region = context.getDefaultRegion()
+        self.assertEqual(read_from_buffer(region, decompressBuffer(compressedModelBuffer)), RESULT_OK)
+        self.assertTrue(region.getFieldmodule().findFieldByName("fitted coordinates").isValid())
+        self.assertEqual(region.getFieldmodule().findMeshByDimension(1).getSize(), 4)
+
+        fit1 = FitterStepFit()
+        fitter.addFitterStep(fit1)
+        fit1.setNumberOfIterations(2)
+        with tempfile.TemporaryDirectory() as outputDirectory:
+            fitter.run(modelFileNameStem=os.path.join(outputDirectory, "nerve"))
+            for iterName in ["1", "2"]:
+                fileName = os.path.join(outputDirectory, "nerve1_fit" + iterName + ".exf")
+                self.assertTrue(os.path.isfile(fileName))
+            self.assertEqual(region.readFile(fileName), RESULT_OK)
+            lastModelBuffer = fitter.writeModel()
+
+            # write delta file with topology once and changed parameters per iteration
+            fitter.setIntermediateOutputDelta(True)
+            fit2 = FitterStepFit()
+            fitter.addFitterStep(fit2)
+            fit2.setGroupDataWeight(None, 2.0)
+            fitter.run(modelFileNameStem=os.path.join(outputDirectory, "nerve"))
+            deltaFileName = os.path.join(outputDirectory, "nerve2_fit.exfdelta")
+            self.assertFalse(os.path.isfile(os.path.join(outputDirectory, "nerve2_fit1.exf")))
+            reader = FitterDeltaReader(deltaFileName)
+            self.assertEqual(reader.getFrameNumbers(), [1])
+            self.assertEqual(reader.getModelBuffer(), lastModelBuffer)
+            self.assertEqual(reader.getModelBuffer(1), fitter.writeModel())
+            self.assertLess(os.path.getsize(deltaFileName), len(lastModelBuffer) + 1000)
+        fitter.cleanup()
+
+    def test_file_writer(self):
+        """
+        Test queueing buffers for writing on background thread, flushing and reporting write errors.
+        """
+        writer = FitterFileWriter(maximumQueueSize=2)
+        with tempfile.TemporaryDirectory() as outputDirectory:
+            fileNames = [os.path.join(outputDirectory, "file" + str(i) + ".txt") for i in range(5)]
+            for i, fileName in enumerate(fileNames):
+                writer.write(fileName, b"buffer" + str(i).encode())
+            writer.write(fileNames[0], b" appended", append=True)
+            writer.flush()
+            for i, fileName in enumerate(fileNames):
+                with open(fileName, "rb") as f:
+                    self.assertEqual(f.read(), b"buffer" + str(i).encode() + (b" appended" if i == 0 else b""))
+            writer.write(os.path.join(outputDirectory, "missing", "file.txt"), b"buffer")
+            with self.assertRaises(OSError):
+                writer.flush()
+            # writer is usable after error is reported
+            writer.write(fileNames[1], b"rewritten")
+            writer.close()
+            with open(fileNames[1], "rb") as f:
+                self.assertEqual(f.read(), b"rewritten")
+
+
 if __name__ == "__main__":
     unittest.main()